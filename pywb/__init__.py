@@ -6,3 +6,5 @@
 from main import execute
 from optionparser import OptionParser
 from outputfilter import OutputFilter
+from resultparser import Result
+from resultparser import ResultParser
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Micro-benchmarks of pywb
+
+This exports:
+    - benchmark_expansion is a function that measures the cost of
+        an item passing nested generators, expanded by next() with
+        a visit stack, which was used by the loaders before,
+        by pywbutil.flatten and by itertools.chain.
+    - benchmark_loading is a function that measures the cost of
+        a packet loaded from a .pkt file and dumped into /dev/null.
+    - benchmark_startup is a function that measures the cost of
+        starting pywb, which is paid by every run of a sweep.
+    - execute is a function that runs all of benchmarks
+
+Usage: ./benchmark.py [packets count (default = 200000)]
+"""
+
+__all__ = [
+    "benchmark_expansion",
+    "benchmark_loading",
+    "benchmark_startup",
+    "execute",
+]
+
+import os
+import sys
+import time
+import types
+import shutil
+import socket
+import tempfile
+import threading
+import itertools
+import subprocess
+
+import pywbutil
+import packetsloader
+import packetsdumper
+
+DEFAULT_PACKETS_COUNT = 200000
+STARTUP_COUNT = 5
+_REPEAT = 5
+
+
+def _best_time(func):
+    """ The best seconds of func among _REPEAT runs """
+    best = None
+    for _ in xrange(_REPEAT):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _expand_by_next(generator):
+    """ The expansion of nested generators by next() and StopIteration """
+    visit_stack = [generator.__iter__()]
+    while visit_stack:
+        visitor = visit_stack[-1]
+        try:
+            visitor = next(visitor)
+            if isinstance(visitor, types.GeneratorType):
+                visit_stack.append(visitor.__iter__())
+            else:
+                yield visitor
+        except StopIteration:
+            visit_stack.pop()
+
+
+def _nest(items, depth):
+    """ A generator of items that is nested depth levels """
+    if depth == 0:
+        for item in items:
+            yield item
+    else:
+        yield _nest(items, depth - 1)
+
+
+def _consume(iterator):
+    for _ in iterator:
+        pass
+
+
+def benchmark_expansion(count, depth=3):
+    """ Measure the cost of expanding nested generators
+
+    Arguments:
+        - count: an integer, the number of items
+        - depth: an integer, the levels of nested generators
+
+    Return a list of (name, microseconds per item)
+    """
+    items = range(count)
+    expanders = [
+        ("next() visit stack", _expand_by_next),
+        ("pywbutil.flatten", pywbutil.flatten),
+    ]
+    results = []
+    for name, expander in expanders:
+        seconds = _best_time(
+            lambda: _consume(expander(_nest(items, depth))))
+        results.append((name, seconds * 1e6 / count))
+    seconds = _best_time(
+        lambda: _consume(itertools.chain.from_iterable([items])))
+    results.append(("itertools.chain", seconds * 1e6 / count))
+    return results
+
+
+def benchmark_loading(count):
+    """ Measure the cost of loading packets from a .pkt file
+        and dumping them
+
+    Arguments:
+        - count: an integer, the number of packets
+
+    Return a list of (name, microseconds per packet)
+    """
+    temp_dir = tempfile.mkdtemp(prefix="pywb-", dir=pywbutil.get_temp_dir())
+    try:
+        packets_file = os.path.join(temp_dir, "packets.pkt")
+        with packetsdumper.PacketsDumper(packets_file) as dumper:
+            for i in xrange(count):
+                dumper.dump("GET /%d HTTP/1.1\r\nHost: localhost\r\n\r\n" % i)
+
+        def _load():
+            _consume(packetsloader.load_packets_from_paths(packets_file))
+
+        def _load_and_dump():
+            with packetsdumper.PacketsDumper(os.devnull) as dumper:
+                dumper.dump(
+                    packetsloader.load_packets_from_paths(packets_file))
+
+        return [
+            ("load", _best_time(_load) * 1e6 / count),
+            ("load and dump", _best_time(_load_and_dump) * 1e6 / count),
+        ]
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def _serve_responses(server):
+    """ Answer each connection with an empty response until it's closed """
+    while True:
+        try:
+            connection, _ = server.accept()
+        except socket.error:
+            return
+        connection.recv(65536)
+        connection.sendall("HTTP/1.0 200 OK\r\nContent-Length: 0\r\n\r\n")
+        connection.close()
+
+
+def benchmark_startup(count):
+    """ Measure the cost of starting pywb by new processes,
+        'import main' is paid by every run, 'main.py -h' and
+        a run of a .pkt file without YAML include wb
+
+    Arguments:
+        - count: an integer, the number of processes of each case
+
+    Return a list of (name, microseconds per process),
+        the cases of wb are skipped if wb isn't found
+    """
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "main.py")
+    temp_dir = tempfile.mkdtemp(prefix="pywb-", dir=pywbutil.get_temp_dir())
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        server.bind(("127.0.0.1", 0))
+        server.listen(128)
+        thread = threading.Thread(target=_serve_responses, args=(server, ))
+        thread.daemon = True
+        thread.start()
+        packets_file = os.path.join(temp_dir, "packets.pkt")
+        with packetsdumper.PacketsDumper(packets_file) as dumper:
+            dumper.dump("GET / HTTP/1.0\r\nHost: localhost\r\n\r\n")
+        cases = [
+            ("import main", [sys.executable, "-c", "import main"]),
+        ]
+        try:
+            pywbutil.get_wb_path()
+            cases += [
+                ("main.py -h", [sys.executable, main_py, "-h"]),
+                ("main.py -F .pkt -n 1", [
+                    sys.executable, main_py, "-F", packets_file, "-n", "1",
+                    "127.0.0.1:%d/" % (server.getsockname()[1], )]),
+            ]
+        except IOError:
+            pass
+
+        def _start(arguments):
+            with open(os.devnull, "w") as devnull:
+                for _ in xrange(count):
+                    subprocess.call(
+                        arguments, stdout=devnull, stderr=devnull,
+                        cwd=os.path.dirname(main_py))
+
+        return [
+            (name, _best_time(lambda: _start(arguments)) * 1e6 / count)
+            for name, arguments in cases]
+    finally:
+        server.close()
+        shutil.rmtree(temp_dir)
+
+
+def execute(arguments):
+    """ Run all of benchmarks and print the results
+
+    Arguments:
+        - arguments: a list, the command arguments of benchmark
+    """
+    count = int(arguments[0]) if arguments else DEFAULT_PACKETS_COUNT
+    benchmarks = [
+        ("expansion of 3 nested generators", benchmark_expansion, count),
+        ("packets of .pkt file", benchmark_loading, count),
+        ("startup of pywb", benchmark_startup, STARTUP_COUNT),
+    ]
+    for title, benchmark, count in benchmarks:
+        print("%s, %d items:" % (title, count))
+        for name, cost in benchmark(count):
+            print("    %-24s %8.3f us/item" % (name, cost))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(execute(sys.argv[1:]))
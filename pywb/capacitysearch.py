@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Search the capacity of a server under a latency SLO
+
+This exports:
+    - SearchStep is a class of a run of wb at a concurrency
+        or a target rate, and whether it met the SLO.
+    - CapacitySearch is a class that probes the concurrency or
+        the target rate exponentially, then bisects between the last step
+        that met the SLO and the first one that didn't.
+    - format_search_report is a function that formats the steps and
+        the capacity found by a search.
+
+A search spec is 'key=value[,key=value...]', e.g. 'p99=50ms,errors=1%'.
+    'p<percent>' is the max latency of that percentile of the report of
+    wb, in 'us', 'ms' (default) or 's'. 'errors' is the max ratio of
+    the failed requests to the complete requests, e.g. '1%' or '0.01'
+    (default = 0). 'c=<from>-<to>' searches the concurrency of '-c'
+    (default = 1-1024), 'rate=<from>-<to>' searches the constant target
+    rate of '-M' instead, e.g. 'rate=100-10k'. 'precision' is when
+    the bisection stops, the gap between the passed and the failed step
+    relative to the passed one, e.g. '5%' (default).
+The capacity is the highest requests per second of the steps that met
+    the SLO, which isn't always the highest concurrency, since the
+    throughput of the closed loop may fall beyond the knee.
+"""
+
+__all__ = [
+    "SearchStep",
+    "CapacitySearch",
+    "format_search_report",
+]
+
+import re
+import csv
+import json
+import StringIO
+import collections
+
+import pywbutil
+import resultmerger
+
+_PERCENTILE = re.compile(r"^p(\d+)$")
+_LATENCY = re.compile(r"^(\d+(?:\.\d*)?)(us|ms|s)?$")
+_LATENCY_TO_US = {"us": 1, "ms": 1000, "s": 1000000}
+
+# The probe multiplies the value of the last passed step by it
+_PROBE_FACTOR = 2
+
+
+def _parse_ratio(value):
+    """ Parse a ratio as '1%' or '0.01' """
+    try:
+        if value.endswith("%"):
+            return float(value[:-1]) / 100
+        return float(value)
+    except ValueError:
+        raise ValueError("invalid ratio of --search: " + value)
+
+
+def _parse_latency(value):
+    """ Parse a latency into microseconds, milliseconds by default """
+    match = _LATENCY.match(value)
+    if not match:
+        raise ValueError("invalid latency of --search: " + value)
+    latency, unit = match.groups()
+    return int(float(latency) * _LATENCY_TO_US[unit or "ms"])
+
+
+def _parse_range(knob, value):
+    """ Parse '<from>-<to>' of the concurrency or the rate """
+    lower, _, upper = value.partition("-")
+    try:
+        if knob == "c":
+            lower, upper = int(lower), int(upper or lower)
+        else:
+            lower = pywbutil.parse_rate_profile(lower)[0][0]
+            upper = pywbutil.parse_rate_profile(upper)[0][0] \
+                if upper else lower
+    except (ValueError, TypeError):
+        raise ValueError("invalid range of --search: %s=%s" % (knob, value))
+    if lower <= 0 or upper < lower:
+        raise ValueError("invalid range of --search: %s=%s" % (knob, value))
+    return lower, upper
+
+
+class SearchStep(object):
+    """ A run of wb at a concurrency or a target rate
+
+    Arguments:
+        - value: an integer of the concurrency or a float of
+            the target rate
+        - result: the resultparser.Result of the run
+        - return_code: an integer, the return code of wb
+
+    Attributes:
+        - value: the concurrency or the target rate of the step
+        - result: the resultparser.Result of the run
+        - return_code: an integer, the return code of wb
+        - latency: an integer, the latency of the percentile of
+            the SLO in microseconds, None if it wasn't reported
+        - error_rate: a float, the ratio of the failed requests
+        - passed: a bool, if it's True, the step met the SLO
+        - reason: a string, why the step didn't meet the SLO
+    """
+    def __init__(self, value, result, return_code):
+        """ Create a step, it's checked by CapacitySearch
+        """
+        self.value = value
+        self.result = result
+        self.return_code = return_code
+        self.latency = None
+        self.error_rate = None
+        self.passed = False
+        self.reason = None
+
+    def to_dict(self):
+        """ Return an OrderedDict of the step and its result """
+        return collections.OrderedDict([
+            ("value", self.value),
+            ("passed", self.passed),
+            ("reason", self.reason),
+            ("requests_per_second", self.result.requests_per_second),
+            ("latency", self.latency),
+            ("error_rate", self.error_rate),
+            ("result", self.result.to_dict()),
+        ])
+
+
+class CapacitySearch(object):
+    """ Search the highest throughput that meets a latency SLO
+
+    Arguments:
+        - spec: a string, 'key=value[,key=value...]', see the module
+
+    Attributes:
+        - knob: a string, 'c' for the concurrency or 'rate' for
+            the target rate
+        - lower, upper: the range of the knob
+        - percentile: an integer, the percentile of the latency
+        - latency: an integer, the max latency in microseconds
+        - error_rate: a float, the max ratio of the failed requests
+        - precision: a float, the gap of the bisection to stop
+        - steps: a list of SearchStep in the order they ran
+    """
+    def __init__(self, spec):
+        """ Parse a search spec
+        """
+        self.knob = "c"
+        self.lower, self.upper = 1, 1024
+        self.percentile = None
+        self.latency = None
+        self.error_rate = 0.0
+        self.precision = 0.05
+        self.steps = []
+        for item in spec.split(","):
+            key, _, value = item.strip().partition("=")
+            if not value:
+                raise ValueError("invalid search: " + spec)
+            percentile = _PERCENTILE.match(key)
+            if percentile:
+                if int(percentile.group(1)) not in resultmerger.PERCENTAGES:
+                    raise ValueError("the percentiles of wb are " + ", ".join(
+                        "p%d" % (p, ) for p in resultmerger.PERCENTAGES))
+                self.percentile = int(percentile.group(1))
+                self.latency = _parse_latency(value)
+            elif key == "errors":
+                self.error_rate = _parse_ratio(value)
+            elif key in ["c", "rate"]:
+                self.knob = key
+                self.lower, self.upper = _parse_range(key, value)
+            elif key == "precision":
+                self.precision = _parse_ratio(value)
+            else:
+                raise ValueError("unknown key of search: " + key)
+        if self.percentile is None:
+            raise ValueError("--search needs a latency as p99=50ms")
+
+    def option(self, value):
+        """ Return the option of wb that sets the knob to value """
+        if self.knob == "c":
+            return ["-c", str(value)]
+        return ["-M", pywbutil.format_rate_profile([(value, value, None)])]
+
+    def label(self, value):
+        """ Return a string of the knob at value, e.g. 'c=64' """
+        if self.knob == "c":
+            return "c=%d" % (value, )
+        return "rate=%.10g" % (value, )
+
+    def check(self, step):
+        """ Check if a step meets the SLO, and set its verdict """
+        result = step.result
+        step.latency = result.percentiles.get(self.percentile)
+        if result.complete_requests:
+            step.error_rate = \
+                float(result.failed_requests or 0) / result.complete_requests
+        if step.return_code:
+            step.reason = "wb exited with %d" % (step.return_code, )
+        elif not result.complete_requests:
+            step.reason = "no complete requests"
+        elif step.error_rate > self.error_rate:
+            step.reason = "errors %.2f%%" % (step.error_rate * 100, )
+        elif step.latency is None:
+            step.reason = "no p%d reported" % (self.percentile, )
+        elif step.latency > self.latency:
+            step.reason = "p%d %d us" % (self.percentile, step.latency)
+        step.passed = step.reason is None
+
+    def _middle(self, passed, failed):
+        """ The next value of the bisection, None if it's close enough """
+        if self.knob == "c":
+            if failed - passed <= max(1, int(passed * self.precision)):
+                return None
+            return (passed + failed) // 2
+        if failed - passed <= passed * self.precision:
+            return None
+        return (passed + failed) / 2.0
+
+    def run(self, execute):
+        """ Run the steps of the search
+
+        Arguments:
+            - execute: a function that runs wb at a value of the knob,
+                and returns (resultparser.Result, return code)
+
+        Return the best SearchStep, see best
+        """
+        passed = failed = None
+        value = self.lower
+        while failed is None:
+            step = SearchStep(value, *execute(value))
+            self.check(step)
+            self.steps.append(step)
+            if not step.passed:
+                failed = value
+                continue
+            passed = value
+            if value >= self.upper:
+                break
+            value = min(self.upper, value * _PROBE_FACTOR)
+        if passed is not None and failed is not None:
+            value = self._middle(passed, failed)
+            while value is not None:
+                step = SearchStep(value, *execute(value))
+                self.check(step)
+                self.steps.append(step)
+                if step.passed:
+                    passed = value
+                else:
+                    failed = value
+                value = self._middle(passed, failed)
+        return self.best()
+
+    def best(self):
+        """ Return the SearchStep of the highest requests per second that
+            met the SLO, None if no step met it
+        """
+        passed = [step for step in self.steps if step.passed]
+        if not passed:
+            return None
+        return max(passed, key=lambda step: (
+            step.result.requests_per_second, -step.value))
+
+    def to_dict(self):
+        """ Return an OrderedDict of the search and its steps,
+            the steps are sorted by their values as a curve
+        """
+        best = self.best()
+        return collections.OrderedDict([
+            ("knob", self.knob),
+            ("lower", self.lower),
+            ("upper", self.upper),
+            ("percentile", self.percentile),
+            ("latency", self.latency),
+            ("error_rate", self.error_rate),
+            ("precision", self.precision),
+            ("capacity", best.result.requests_per_second if best else None),
+            ("best", best.value if best else None),
+            ("steps", [
+                step.to_dict()
+                for step in sorted(self.steps, key=lambda step: step.value)]),
+        ])
+
+    def to_json(self, **kw):
+        """ Return a JSON string of to_dict,
+            kw is passed to json.dumps
+        """
+        return json.dumps(self.to_dict(), **kw)
+
+    def to_csv(self):
+        """ Return a CSV string of the curve, a row per step """
+        output = StringIO.StringIO()
+        writer = csv.writer(output, lineterminator="\n")
+        writer.writerow([
+            self.knob, "passed", "reason", "requests_per_second",
+            "p%d" % (self.percentile, ), "error_rate",
+            "complete_requests", "failed_requests"])
+        for step in sorted(self.steps, key=lambda step: step.value):
+            writer.writerow([
+                step.value, step.passed, step.reason or "",
+                step.result.requests_per_second, step.latency,
+                step.error_rate, step.result.complete_requests,
+                step.result.failed_requests])
+        return output.getvalue()
+
+
+def format_search_report(search):
+    """ Format the steps and the capacity found by a search
+
+    Arguments:
+        - search: a CapacitySearch that has run
+
+    Return a list of lines end with '\\n'
+    """
+    lines = ["\n"]
+    lines.append(
+        "Capacity search:        %s-%s, p%d <= %d us, errors <= %.2f%%\n" % (
+            search.label(search.lower), "%.10g" % (search.upper, ),
+            search.percentile, search.latency, search.error_rate * 100))
+    lines.append("  %-6s %-14s %12s %12s %8s  %s\n" % (
+        "step", search.knob, "requests/s",
+        "p%d (us)" % (search.percentile, ), "errors", "verdict"))
+    for i, step in enumerate(search.steps):
+        lines.append("  %-6d %-14s %12.2f %12s %7.2f%%  %s\n" % (
+            i + 1, "%.10g" % (step.value, ),
+            step.result.requests_per_second or 0,
+            "-" if step.latency is None else step.latency,
+            (step.error_rate or 0) * 100,
+            "passed" if step.passed else step.reason))
+    best = search.best()
+    if best is None:
+        lines.append("Capacity:               no step met the SLO\n")
+    else:
+        lines.append("Capacity:               %.2f requests/s at %s\n" % (
+            best.result.requests_per_second or 0, search.label(best.value)))
+    return lines
@@ -0,0 +1,525 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Run wb on multiple hosts
+
+This exports:
+    - AGENT_WB_OPTIONS is a string, the options of wb that agents run,
+        in the format of getopt.
+    - Agent is a class that serves the runs of wb on a load host.
+    - Coordinator is a class that runs wb on multiple agents at the
+        same time, and collects their progress and results.
+    - parse_address is a function that parses '[host:]port'.
+    - is_loopback is a function that tells if a host is the loopback.
+    - check_agent_arguments is a function that checks if the arguments
+        of wb are run by agents.
+
+The coordinator and agents talk in JSON lines over TCP,
+    a run is made up of
+    - agent => coordinator: {"type": "hello", "nonce": hex} once it's
+        connected, the nonce is random for each connection
+    - coordinator => agent: {"type": "run", "arguments": [...],
+        "auth": HMAC-SHA256 of the nonce by the shared token or null,
+        "packets": {"digest": sha1, "size": bytes, "index_size": bytes}
+        or null}, the digest is of the packets and their index,
+        the index is 0 bytes if the packets file has no valid index
+    - agent => coordinator: {"type": "need_packets"} if the agent hasn't
+        kept the packets of the digest, then the coordinator sends
+        {"type": "packets", "size": bytes, "index_size": bytes} followed by
+        the raw packets and their index. The index is sent as well,
+        because the copies of deduplicated packets are only in it
+    - agent => coordinator: {"type": "ready"}
+    - coordinator => agent: {"type": "start", "start_time": seconds}
+        the start time is in the epoch, so the clocks of hosts
+        should be synchronized (e.g. by NTP)
+    - agent => coordinator: {"type": "line", "line": ...} for each line
+        of wb output and {"type": "progress", "interval": {...}}
+        for each progress heartbeat of wb
+    - agent => coordinator: {"type": "result", "result": {...},
+        "histograms": {...}, "return_code": code} when wb exits,
+        or {"type": "error", "message": ...} if the run failed
+An agent only runs the arguments whose options are in AGENT_WB_OPTIONS,
+    so a coordinator cannot make it read or write its files. The file of
+    '-F' is the packets sent by the coordinator, and the sessions of '-8'
+    are resumed within the run by a temporary file of the agent. Both
+    can't be repeated, since wb takes the last one of an option.
+"""
+
+__all__ = [
+    "AGENT_WB_OPTIONS",
+    "Agent",
+    "Coordinator",
+    "parse_address",
+    "is_loopback",
+    "check_agent_arguments",
+]
+
+import os
+import hmac
+import json
+import time
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+import collections
+import SocketServer
+
+import pywbutil
+import histogram
+import packetsindex
+import resultparser
+import resultmerger
+
+CONNECT_TIMEOUT = 10  # seconds
+START_DELAY = 1.0  # seconds between the agents are ready and start
+
+# The options of wb that an agent runs, they shape the load but don't
+#   read or write the files of the agent, except '-F' and '-8' of the run
+AGENT_WB_OPTIONS = "n:c:t:s:b:B:T:m:C:H:A:P:X:Z:f:v:j:J:L:M:N:Q:R:U:Y:W:"\
+                   "F:8:2:kdSqlriIwVh1345K7"
+
+# The options of files that an agent replaces by its own files
+_AGENT_FILE_OPTIONS = ["-F", "-8"]
+
+_LOOPBACK_HOSTS = ["localhost", "::1"]
+
+
+def parse_address(address, default_host=""):
+    """ Parse an address '[host:]port' into (host, port) """
+    host, _, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError("invalid address: " + address)
+    return (host or default_host, int(port))
+
+
+def is_loopback(host):
+    """ Return True if host is only reachable from the local host """
+    return host in _LOOPBACK_HOSTS or host.startswith("127.")
+
+
+def _auth(token, nonce):
+    return hmac.new(str(token), str(nonce), hashlib.sha256).hexdigest()
+
+
+def _agent_options(arguments):
+    """ Yield (index, option) of the options in the arguments of wb,
+        the options with an argument are paired as getopt does, so
+        '-ofile' or '-ko file' isn't taken for another option
+    """
+    i = 0
+    while i < len(arguments):
+        index, option = i, arguments[i]
+        i += 1
+        if not option.startswith("-"):
+            continue  # the target of wb
+        position = AGENT_WB_OPTIONS.find(option[1:2])
+        if len(option) != 2 or position == -1:
+            raise ValueError("agents don't run wb with " + option)
+        if AGENT_WB_OPTIONS[position + 1:][:1] == ":":
+            if i == len(arguments):
+                raise ValueError("%s of agents needs an argument" % (
+                    option, ))
+            i += 1
+        yield index, option
+
+
+def check_agent_arguments(arguments):
+    """ Raise ValueError if an argument isn't run by agents,
+        the files of '-F' and '-8' are replaced by the agent, and wb
+        takes the last one of an option, so they can't be repeated
+
+    >>> check_agent_arguments(["-F", "a.pkt", "-H", "a: 1", "-H", "b: 2"])
+    >>> check_agent_arguments(["-F", "a.pkt", "-F", "/etc/passwd"])
+    Traceback (most recent call last):
+    ...
+    ValueError: agents don't run wb with -F repeated
+    """
+    options = set()
+    for _, option in _agent_options(arguments):
+        if option in _AGENT_FILE_OPTIONS and option in options:
+            raise ValueError("agents don't run wb with %s repeated" % (
+                option, ))
+        options.add(option)
+
+
+def _send(fd, message):
+    fd.write(json.dumps(message) + "\n")
+    fd.flush()
+
+
+def _receive(fd):
+    line = fd.readline()
+    if not line:
+        raise IOError("connection is closed")
+    return json.loads(line, object_pairs_hook=collections.OrderedDict)
+
+
+def _load_histograms(dict_):
+    """ Load the histograms sent by an agent, the keys of JSON are strings """
+    return dict(
+        (int(heartbeat), dict(
+            (name, histogram.Histogram.from_dict(histogram_))
+            for name, histogram_ in named_histograms.items()))
+        for heartbeat, named_histograms in dict_.items())
+
+
+def _digest(files):
+    hash_ = hashlib.sha1()
+    for file_ in files:
+        with open(file_, "rb") as fd:
+            while True:
+                bytes_ = fd.read(1024 * 1024)
+                if not bytes_:
+                    break
+                hash_.update(bytes_)
+    return hash_.hexdigest()
+
+
+def _packets_files(packets_file):
+    """ The packets file and its index if the index is valid """
+    if packetsindex.PacketsIndex.load(packets_file) is None:
+        return [packets_file]
+    return [packets_file, packets_file + packetsindex.INDEX_SUFFIX]
+
+
+class _AgentHandler(SocketServer.StreamRequestHandler):
+    """ Handle a run requested by a coordinator """
+    def handle(self):
+        try:
+            self._run()
+        except Exception as error:
+            try:
+                _send(self.wfile, {"type": "error", "message": str(error)})
+            except (IOError, socket.error):
+                pass
+
+    def _receive_file(self, file_, size, hash_):
+        """ Receive size bytes into a temporary file of file_ """
+        temp_file = "%s.%d.tmp" % (file_, os.getpid())
+        with open(temp_file, "wb") as fd:
+            remain_size = size
+            while remain_size > 0:
+                bytes_ = self.rfile.read(min(remain_size, 1024 * 1024))
+                if not bytes_:
+                    raise IOError("packets are truncated")
+                hash_.update(bytes_)
+                fd.write(bytes_)
+                remain_size -= len(bytes_)
+        return temp_file
+
+    def _receive_packets(self, packets):
+        """ Return the path of packets kept by the agent """
+        packets_file = os.path.join(
+            self.server.packets_dir, packets["digest"] + ".pkt")
+        files = [packets_file]
+        if packets.get("index_size"):
+            files.append(packets_file + packetsindex.INDEX_SUFFIX)
+        if all(os.path.exists(file_) for file_ in files):
+            return packets_file
+        _send(self.wfile, {"type": "need_packets"})
+        message = _receive(self.rfile)
+        if message["type"] != "packets":
+            raise ValueError("unexpected message: " + message["type"])
+        hash_ = hashlib.sha1()
+        temp_files = [
+            self._receive_file(file_, size, hash_)
+            for file_, size in zip(
+                files, [message["size"], message.get("index_size")])]
+        if hash_.hexdigest() != packets["digest"]:
+            for temp_file in temp_files:
+                os.remove(temp_file)
+            raise ValueError("packets don't match their digest")
+        # the index is renamed after the packets, so it isn't older
+        for temp_file, file_ in zip(temp_files, files):
+            os.rename(temp_file, file_)
+        return packets_file
+
+    def _run(self):
+        nonce = os.urandom(16).encode("hex")
+        _send(self.wfile, {"type": "hello", "nonce": nonce})
+        message = _receive(self.rfile)
+        if message["type"] != "run":
+            raise ValueError("unexpected message: " + message["type"])
+        if self.server.token and not hmac.compare_digest(
+                _auth(self.server.token, nonce),
+                str(message.get("auth") or "")):
+            raise ValueError("the token of the coordinator is wrong")
+        arguments = [pywbutil.get_wb_path()] + message["arguments"]
+        check_agent_arguments(arguments[1:])
+        options = dict(
+            (option, index + 2)
+            for index, option in _agent_options(arguments[1:]))
+        if "-F" in options:
+            if not message.get("packets"):
+                raise ValueError("-F needs the packets of the coordinator")
+            packets_file = self._receive_packets(message["packets"])
+            arguments[options["-F"]] = packets_file
+        _send(self.wfile, {"type": "ready"})
+
+        message = _receive(self.rfile)
+        if message["type"] != "start":
+            return
+        delay = message["start_time"] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        temp_dir = tempfile.mkdtemp(
+            prefix="pywb-", dir=pywbutil.get_temp_dir())
+        try:
+            if "-8" in options:
+                arguments[options["-8"]] = os.path.join(
+                    temp_dir, "tls.session")
+            # the histograms of latencies are used to merge latencies
+            hist_file = os.path.join(temp_dir, "histograms.txt")
+            arguments[1:1] = ["-D", hist_file]
+            streamer = _ResultStreamer(self.wfile)
+            return_code = self.server.execute_wb(arguments, [streamer])
+            histograms = {}
+            if os.path.exists(hist_file):
+                histograms = histogram.read_histograms(hist_file)
+            _send(self.wfile, {
+                "type": "result",
+                "result": streamer.result_parser.result.to_dict(),
+                "histograms": dict(
+                    (heartbeat, dict(
+                        (name, histogram_.to_dict())
+                        for name, histogram_ in named_histograms.items()))
+                    for heartbeat, named_histograms in histograms.items()),
+                "return_code": return_code,
+            })
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+class _ResultStreamer(object):
+    """ Stream the output and progress of wb to the coordinator """
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self.result_parser = resultparser.ResultParser()
+
+    def __call__(self, line):
+        intervals = len(self.result_parser.result.intervals)
+        self.result_parser(line)
+        _send(self._wfile, {"type": "line", "line": line})
+        for interval in self.result_parser.result.intervals[intervals:]:
+            _send(self._wfile, {"type": "progress", "interval": interval})
+        return None
+
+
+class Agent(SocketServer.TCPServer):
+    """ Serve the runs of wb requested by coordinators, one run at a time
+
+    Arguments:
+        - address: a tuple of (host, port) to listen
+        - execute_wb: a function like main.execute_wb,
+            (arguments, filters) => return code of wb
+        - packets_dir: a string, the directory to keep the packets
+            sent by coordinators (default = a temporary directory)
+        - token: a string shared with the coordinators, it's needed
+            unless the agent only listens on the loopback (default = None)
+
+    Attributes:
+        - packets_dir: a string, the directory to keep the packets
+        - token: a string shared with the coordinators
+    """
+    allow_reuse_address = True
+
+    def __init__(self, address, execute_wb, packets_dir=None, token=None):
+        """ Create an agent listening on address
+        """
+        if not token and not is_loopback(address[0]):
+            raise ValueError(
+                "an agent listening on %s needs a token" % (address[0] or
+                                                            "any address"))
+        SocketServer.TCPServer.__init__(self, address, _AgentHandler)
+        self.execute_wb = execute_wb
+        self.token = token
+        self._temp_dir = None
+        if not packets_dir:
+            self._temp_dir = tempfile.mkdtemp(
+                prefix="pywb-agent-", dir=pywbutil.get_temp_dir())
+            packets_dir = self._temp_dir
+        self.packets_dir = packets_dir
+
+    def server_close(self):
+        SocketServer.TCPServer.server_close(self)
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+
+class Coordinator(object):
+    """ Run wb on multiple agents at the same time
+
+    Arguments:
+        - agents: a list of (host, port) of agents
+        - token: a string shared with the agents (default = None)
+
+    Attributes:
+        - agents: a list of (host, port) of agents
+    """
+    def __init__(self, agents, token=None):
+        """ Create a coordinator of agents
+        """
+        self.agents = agents
+        self._token = token
+
+    def _prepare(self, agent, fd, arguments):
+        """ Send the run to agent and wait for it to be ready """
+        message = _receive(fd)
+        if message["type"] != "hello":
+            raise IOError("agent %s:%d isn't an agent of pywb" % agent)
+        auth = None
+        if self._token:
+            auth = _auth(self._token, message["nonce"])
+        packets = None
+        if "-F" in arguments:
+            files = _packets_files(arguments[arguments.index("-F") + 1])
+            sizes = [os.path.getsize(file_) for file_ in files] + [0]
+            packets = {
+                "digest": _digest(files),
+                "size": sizes[0],
+                "index_size": sizes[1],
+            }
+        _send(fd, {
+            "type": "run", "arguments": arguments, "auth": auth,
+            "packets": packets,
+        })
+        message = _receive(fd)
+        if message["type"] == "need_packets":
+            _send(fd, {
+                "type": "packets",
+                "size": packets["size"],
+                "index_size": packets["index_size"],
+            })
+            for file_ in files:
+                with open(file_, "rb") as file_fd:
+                    shutil.copyfileobj(file_fd, fd)
+            fd.flush()
+            message = _receive(fd)
+        if message["type"] == "error":
+            raise IOError("agent %s:%d: %s" % (agent + (message["message"], )))
+        if message["type"] != "ready":
+            raise IOError("agent %s:%d isn't ready" % agent)
+
+    def run(self, arguments_list, filters, lock=None):
+        """ Run wb on agents and wait for their results
+
+        Arguments:
+            - arguments_list: a list of the arguments of wb for each agent,
+                without the path of wb. The file of '-F' is sent to the
+                agent if the agent hasn't kept it
+            - filters: a list of callables, (agent_id, message) => None,
+                they are called with the 'line' and 'progress' messages
+                of agents, and the merged progress of all of agents
+                as {"type": "progress", "interval": {...}} with
+                agent_id None. They are called by a thread per agent,
+                but never at the same time
+            - lock: a lock to call filters (default = a new lock)
+
+        Return a list of (Result, histograms, return code) of agents,
+            see histogram.read_histograms
+        """
+        if len(arguments_list) > len(self.agents):
+            raise ValueError("%d runs for %d agents"
+                             % (len(arguments_list), len(self.agents)))
+        lock = lock or threading.Lock()
+        connections = []
+        fds = []
+        try:
+            for agent, arguments in zip(self.agents, arguments_list):
+                try:
+                    connection = socket.create_connection(
+                        agent, CONNECT_TIMEOUT)
+                except socket.error as error:
+                    raise IOError("agent %s:%d: %s" % (agent + (error, )))
+                connections.append(connection)
+                fds.append(connection.makefile("rwb"))
+                self._prepare(agent, fds[-1], arguments)
+                connection.settimeout(None)
+
+            start_time = time.time() + START_DELAY
+            for fd in fds:
+                _send(fd, {"type": "start", "start_time": start_time})
+
+            progress = _Progress(len(fds), filters)
+            outcomes = [None] * len(fds)
+            threads = [
+                threading.Thread(
+                    target=self._collect,
+                    args=(agent_id, fd, filters, lock, progress, outcomes))
+                for agent_id, fd in enumerate(fds)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for fd in fds:
+                fd.close()
+            for connection in connections:
+                connection.close()
+        for agent, outcome in zip(self.agents, outcomes):
+            if isinstance(outcome, Exception):
+                raise IOError("agent %s:%d: %s" % (agent + (outcome, )))
+        return outcomes
+
+    @staticmethod
+    def _collect(agent_id, fd, filters, lock, progress, outcomes):
+        """ Receive the messages of an agent until its result """
+        try:
+            while True:
+                message = _receive(fd)
+                if message["type"] == "result":
+                    outcomes[agent_id] = (
+                        resultparser.Result.from_dict(message["result"]),
+                        _load_histograms(message["histograms"]),
+                        message["return_code"])
+                    return
+                if message["type"] == "error":
+                    raise IOError(message["message"])
+                with lock:
+                    for filter_ in filters:
+                        filter_(agent_id, message)
+                    if message["type"] == "progress":
+                        progress.add(agent_id, message["interval"])
+        except Exception as error:
+            outcomes[agent_id] = error
+            with lock:
+                progress.remove(agent_id)
+
+
+class _Progress(object):
+    """ Merge the progress heartbeats of agents,
+        a heartbeat is merged once every running agent has reported it
+    """
+    def __init__(self, agents, filters):
+        self._results = [resultparser.Result() for _ in xrange(agents)]
+        self._running = set(xrange(agents))
+        self._filters = filters
+        self._merged = 0
+
+    def add(self, agent_id, interval):
+        self._results[agent_id].intervals.append(interval)
+        self._merge()
+
+    def remove(self, agent_id):
+        self._running.discard(agent_id)
+        self._merge()
+
+    def _merge(self):
+        if not self._running:
+            return
+        reported = min(
+            len(self._results[agent_id].intervals)
+            for agent_id in self._running)
+        if reported <= self._merged:
+            return
+        intervals = resultmerger.merge_intervals(self._results)
+        for interval in intervals[self._merged:reported]:
+            for filter_ in self._filters:
+                filter_(None, {"type": "progress", "interval": interval})
+        self._merged = reported
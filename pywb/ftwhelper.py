@@ -9,16 +9,17 @@ This export:
     - FTW_TYPE: is a enum that contains RULE, TEST, STAGE, PACKETS.
     - FtwDict: is a subclass of dict, that store the data from ftw
     - FtwStr: is a subclass of str, that store the data from ftw
-    - get: is a function to get a target_type generator from sources.
+    - get: is a function to get a target_type iterator from sources.
 
 This is a wrapper to provied the access to FTW(https://github.com/fastly/ftw).
+ftw and yaml are imported by the functions that compile the rules,
+because importing them costs more than a short run of wb,
+and the packets of a cached rule don't need them.
 """
 
 import os
-import yaml
 import types
-
-import ftw
+import itertools
 
 import pywbutil
 
@@ -54,6 +55,10 @@ class FtwDict(dict):
         - original_data: an internal type of ftw.
         - *args, **kw: arguments to initialize a dict.
             It's the dict format of original data.
+
+    Attributes:
+        - TEST_TITLE: a string, the title of the test this dict belongs to,
+            None for a rule
     """
     def __new__(cls, ftw_type, original_file, original_data, *args, **kw):
         obj = dict.__new__(cls, *args, **kw)
@@ -64,6 +69,7 @@ class FtwDict(dict):
         self.FTW_TYPE = ftw_type
         self.ORIGINAL_FILE = original_file
         self.ORIGINAL_DATA = original_data
+        self.TEST_TITLE = None
 
 
 class FtwStr(str):
@@ -74,19 +80,31 @@ class FtwStr(str):
         - original_file: a string of path to specified
             where this dict come from
         - original_data: an string.
+        - test_title: a string, the title of the test
+            this string comes from (default = None)
+        - expected_output: a dict, the output of the stage
+            this string comes from (default = None)
     """
-    def __new__(cls, ftw_type, original_file, original_data):
+    def __new__(
+            cls, ftw_type, original_file, original_data,
+            test_title=None, expected_output=None):
         obj = str.__new__(cls, original_data)
         return obj
 
-    def __init__(self, ftw_type, original_file, original_data):
+    def __init__(
+            self, ftw_type, original_file, original_data,
+            test_title=None, expected_output=None):
         self.FTW_TYPE = ftw_type
         self.ORIGINAL_FILE = original_file
+        self.TEST_TITLE = test_title
+        self.EXPECTED_OUTPUT = expected_output
 
 
 @pywbutil.accept_iterable
 @pywbutil.expand_nest_generator
 def _load_ftw_rules_from_strings(strings):
+    import ftw
+    import yaml
     for string_ in strings:
         ftw_rule = ftw.ruleset.Ruleset(yaml.load(string_))
         rule = FtwDict(
@@ -100,6 +118,7 @@ def _load_ftw_rules_from_strings(strings):
 @pywbutil.accept_iterable
 @pywbutil.expand_nest_generator
 def _load_ftw_rules_from_files(files):
+    import ftw
     for file_ in files:
         file_ = os.path.abspath(os.path.expanduser(file_))
         if os.path.splitext(file_)[-1].lower() != ".yaml":
@@ -136,66 +155,82 @@ def _load_ftw_rules_from_paths(paths):
             raise IOError("No such file or path: '%s'" % (path_, ))
 
 
+def _rule_to_tests(rule):
+    tests = []
+    for ftw_test in rule.ORIGINAL_DATA.tests:
+        test = FtwDict(
+            FTW_TYPE.TEST,
+            rule.ORIGINAL_FILE,
+            ftw_test,
+            ftw_test.test_dict)
+        test.TEST_TITLE = ftw_test.test_title
+        tests.append(test)
+    return tests
+
+
+def _test_to_stages(test):
+    stages = []
+    for ftw_stage in test.ORIGINAL_DATA.stages:
+        stage = FtwDict(
+            FTW_TYPE.STAGE,
+            test.ORIGINAL_FILE,
+            ftw_stage,
+            ftw_stage.stage_dict)
+        stage.TEST_TITLE = test.TEST_TITLE
+        stages.append(stage)
+    return stages
+
+
+def _stage_to_packets(stage):
+    import ftw
+    http_ua = ftw.http.HttpUA()
+    http_ua.request_object = stage.ORIGINAL_DATA.input
+    http_ua.build_request()
+    packet = FtwStr(
+        FTW_TYPE.PACKETS,
+        stage.ORIGINAL_FILE,
+        http_ua.request,
+        stage.TEST_TITLE,
+        stage.get("output"))
+    return (packet, )
+
+
+# The converter from a FTW_TYPE to the list of next FTW_TYPE
+_CONVERTERS = {
+    FTW_TYPE.RULE: _rule_to_tests,      # ftw.rule => ftw.test
+    FTW_TYPE.TEST: _test_to_stages,     # ftw.test => ftw.stage
+    FTW_TYPE.STAGE: _stage_to_packets,  # ftw.stage => pkt
+}
+
+
+def _load_ftw_rules(source):
+    path_ = os.path.abspath(os.path.expanduser(source))
+    if os.path.exists(path_):
+        return _load_ftw_rules_from_paths(path_)
+    return _load_ftw_rules_from_strings(source)
+
+
+def _convert_all(sources, source_type, target_type):
+    """ Convert the sources of source_type into target_type.
+        Each level of conversion is flattened by itertools in C,
+        so an item passes no nested generator.
+    """
+    for ftw_type in xrange(source_type, target_type):
+        sources = itertools.chain.from_iterable(
+            itertools.imap(_CONVERTERS[ftw_type], sources))
+    return sources
+
+
 def _convert(source, target_type):
     if not hasattr(source, "FTW_TYPE") \
             or source.FTW_TYPE == FTW_TYPE.INVALID \
             or target_type == FTW_TYPE.INVALID:
         raise ValueError("%s is invalid type" % (source, ))
-    if source.FTW_TYPE > FTW_TYPE:
+    if source.FTW_TYPE > target_type:
         raise ValueError(
             "Cannot do this upper convert from %s to %s"
-            % (source.FTW_TYPE, FTW_TYPE))
-
-    if source.FTW_TYPE == FTW_TYPE:
-        yield source
-    # ftw.stage => pkt
-    elif source.FTW_TYPE == FTW_TYPE.STAGE \
-            and target_type == FTW_TYPE.PACKETS:
-        http_ua = ftw.http.HttpUA()
-        http_ua.request_object = source.ORIGINAL_DATA.input
-        http_ua.build_request()
-        packet = FtwStr(
-            FTW_TYPE.PACKETS,
-            source.ORIGINAL_FILE,
-            http_ua.request)
-        yield packet
-    # ftw.test => ftw.stage
-    elif source.FTW_TYPE == FTW_TYPE.TEST \
-            and target_type == FTW_TYPE.STAGE:
-        for ftw_stage in source.ORIGINAL_DATA.stages:
-            stage = FtwDict(
-                FTW_TYPE.STAGE,
-                source.ORIGINAL_FILE,
-                ftw_stage,
-                ftw_stage.stage_dict)
-            yield stage
-    # ftw.rule => ftw.test
-    elif source.FTW_TYPE == FTW_TYPE.RULE \
-            and target_type == FTW_TYPE.TEST:
-        for ftw_test in source.ORIGINAL_DATA.tests:
-            test = FtwDict(
-                FTW_TYPE.TEST,
-                source.ORIGINAL_FILE,
-                ftw_test,
-                ftw_test.test_dict)
-            yield test
-    # ftw.* => ftw.*
-    else:
-        internal_type = source.FTW_TYPE + 1
-        source = _convert(source, internal_type)
-        visitor = source.__iter__()
-        visit_stack = [visitor]
-        while visit_stack:
-            visitor = visit_stack[-1]
-            try:
-                visitor = next(visitor)
-                if visitor.FTW_TYPE < target_type:
-                    visitor = _convert(visitor, visitor.FTW_TYPE + 1)
-                    visit_stack.append(visitor)
-                else:
-                    yield visitor
-            except StopIteration:
-                visit_stack.pop()
+            % (source.FTW_TYPE, target_type))
+    return _convert_all((source, ), source.FTW_TYPE, target_type)
 
 
 def get(source, target_type):
@@ -209,22 +244,15 @@ def get(source, target_type):
             objects that comes from ftwhelper.get
         target_type: a enum of FTW_TYPE to specify the generator type
 
-    Return a generator that generate target_type
+    Return an iterator that generate target_type
     """
     if hasattr(source, "FTW_TYPE"):
-        for item in _convert(source, target_type):
-            yield item
+        return _convert(source, target_type)
+    if not hasattr(source, "__iter__"):
+        sources = [source]
     else:
-        if not hasattr(source, "__iter__"):
-            sources = [source]
-        else:
-            sources = source
-        for source in sources:
-            path_ = os.path.abspath(os.path.expanduser(source))
-            if os.path.exists(path_):
-                rules = _load_ftw_rules_from_paths(path_)
-            else:
-                rules = _load_ftw_rules_from_strings(source)
-            for rule in rules:
-                for destination in _convert(rule, target_type):
-                    yield destination
+        sources = source
+    return _convert_all(
+        itertools.chain.from_iterable(
+            _load_ftw_rules(source) for source in sources),
+        FTW_TYPE.RULE, target_type)
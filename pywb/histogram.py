@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Latency histograms of wb
+
+This exports:
+    - Histogram is a class of log-bucketed latencies, the same as
+        the histograms of wb, which can be merged without losing accuracy.
+    - read_histograms is a function that reads the histograms saved by
+        the '-D' option of wb.
+    - merge_histograms is a function that merges the histograms of
+        multiple wb.
+
+A histogram file of wb has a line per histogram after its header,
+    '<heartbeat> <name> <count> <min> <max> <sum> <sum_squares>
+    <index>:<count>...', the name is 'connect', 'processing', 'waiting',
+    'total' or 'lag' (the schedule lag), the heartbeat is the sequence
+    number of the progress interval or 0 for the whole test.
+    Only non-empty buckets are saved, all of latencies are in microseconds.
+"""
+
+__all__ = [
+    "Histogram",
+    "read_histograms",
+    "merge_histograms",
+]
+
+import re
+import math
+import collections
+
+# the bits of the sub-buckets of each power of 2, see the header
+SUB_BITS = 7
+
+_HEADER = re.compile(r"^#.*\(us, sub_bits=(\d+)\)$")
+
+
+class Histogram(object):
+    """ Log-bucketed latencies, the latencies below 2^(SUB_BITS + 1) have
+        their own buckets, above that each power of 2 is split into
+        2^SUB_BITS buckets
+
+    Attributes:
+        - count: an integer, the number of latencies
+        - min, max: integers, microseconds
+        - sum: an integer, the sum of latencies
+        - sum_squares: a float, the sum of the squares of latencies
+        - buckets: a dict, the key is the index of bucket and
+            the value is the number of latencies in it
+    """
+    def __init__(self):
+        """ Create an empty histogram
+        """
+        self.count = 0
+        self.min = 0
+        self.max = 0
+        self.sum = 0
+        self.sum_squares = 0.0
+        self.buckets = {}
+
+    def merge(self, other):
+        """ Add the latencies of other histogram into this one """
+        if not other.count:
+            return
+        if not self.count or other.min < self.min:
+            self.min = other.min
+        if not self.count or other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def mean(self):
+        """ Return the mean latency as wb, an integer """
+        return self.sum // self.count if self.count else 0
+
+    def sd(self):
+        """ Return the sample standard deviation, a float """
+        if self.count < 2:
+            return 0.0
+        mean = float(self.sum) / self.count
+        variance = (self.sum_squares - mean * self.sum) / (self.count - 1)
+        return math.sqrt(variance) if variance > 0 else 0.0
+
+    def percentile(self, percentage):
+        """ Return the latency that percentage% of latencies are within,
+            the highest latency of its bucket as wb
+        """
+        if not self.count:
+            return 0
+        if percentage >= 100:
+            return self.max
+        rank = self.count * percentage // 100 + 1
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return max(self.min, min(self.max, _highest(index)))
+        return self.max
+
+    def to_dict(self):
+        """ Return an OrderedDict of all of attributes """
+        return collections.OrderedDict([
+            ("count", self.count),
+            ("min", self.min),
+            ("max", self.max),
+            ("sum", self.sum),
+            ("sum_squares", self.sum_squares),
+            ("buckets", collections.OrderedDict(
+                (str(index), self.buckets[index])
+                for index in sorted(self.buckets))),
+        ])
+
+    @classmethod
+    def from_dict(cls, dict_):
+        """ Create a Histogram from the dict of to_dict """
+        histogram = cls()
+        histogram.count = dict_["count"]
+        histogram.min = dict_["min"]
+        histogram.max = dict_["max"]
+        histogram.sum = dict_["sum"]
+        histogram.sum_squares = dict_["sum_squares"]
+        histogram.buckets = dict(
+            (int(index), count) for index, count in dict_["buckets"].items())
+        return histogram
+
+
+def _highest(index):
+    """ The highest latency of a bucket """
+    shift = (index >> SUB_BITS) - 1
+    if shift <= 0:
+        return index
+    return ((index - (shift << SUB_BITS)) << shift) + (1 << shift) - 1
+
+
+def read_histograms(hist_file):
+    """ Read the histograms saved by the '-D' option of wb
+
+    Arguments:
+        - hist_file: a string, the path of the histogram file
+
+    Return an OrderedDict, the key is the heartbeat and the value is
+        an OrderedDict of the name and the Histogram
+    """
+    histograms = collections.OrderedDict()
+    with open(hist_file, "r") as fd:
+        header = _HEADER.match(fd.readline().rstrip("\n"))
+        if not header or int(header.group(1)) != SUB_BITS:
+            raise ValueError(hist_file + " isn't a histogram file of wb")
+        for line in fd:
+            columns = line.split()
+            if len(columns) < 7:
+                continue  # truncated
+            histogram = Histogram()
+            histogram.count = int(columns[2])
+            histogram.min = int(columns[3])
+            histogram.max = int(columns[4])
+            histogram.sum = int(columns[5])
+            histogram.sum_squares = float(columns[6])
+            for bucket in columns[7:]:
+                index, count = bucket.split(":")
+                histogram.buckets[int(index)] = int(count)
+            histograms.setdefault(
+                int(columns[0]), collections.OrderedDict())[columns[1]] = \
+                histogram
+    return histograms
+
+
+def merge_histograms(histograms_list):
+    """ Merge the histograms of multiple wb, by heartbeat and name
+
+    Arguments:
+        - histograms_list: a list of the histograms of each wb,
+            see read_histograms
+
+    Return an OrderedDict as read_histograms
+    """
+    merged = collections.OrderedDict()
+    for histograms in histograms_list:
+        for heartbeat, named_histograms in histograms.items():
+            merged_histograms = merged.setdefault(
+                heartbeat, collections.OrderedDict())
+            for name, histogram in named_histograms.items():
+                merged_histograms.setdefault(name, Histogram()).merge(
+                    histogram)
+    return merged
@@ -8,18 +8,25 @@
 
 This exports:
     - execute_wb is a function that executes wb by a subprocess
+    - execute_wbs is a function that executes multiple wb at the same time
     - execute is a function that executes pywb
 """
 
 __all__ = [
     "execute_wb",
+    "execute_wbs",
     "execute",
 ]
 
 import os
 import sys
 import re
+import errno
+import shutil
 import signal
+import tempfile
+import itertools
+import threading
 import subprocess
 import collections
 
@@ -27,22 +34,102 @@ import optionparser
 import outputfilter
 import packetsloader
 import packetsdumper
+import packetscache
+import packetsindex
+import packetstats
+import trafficmix
+import capacitysearch
+import resultparser
+import resultmerger
+import responseverifier
+import histogram
+import telemetry
+import cluster
 import pywbutil
 
 
+# The environment variable of the token shared by agents and coordinators,
+#   so that the token isn't seen in the command line
+AGENT_TOKEN_ENV = "PYWB_AGENT_TOKEN"
+
+
+def _cpu_count():
+    """ The number of CPUs, multiprocessing is imported on demand,
+        because it slows down the startup of every run
+    """
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+
+def _option_count(options, option):
+    """ The count of a wb option in the arguments of pywb, 0 if it's unset """
+    for i in xrange(len(options) - 1, 0, -1):
+        if options[i - 1] == option and options[i].isdigit():
+            return int(options[i])
+    return 0
+
+
 class _PacketFileEnhance(optionparser.OptionParser):
     """ Packet file parser, enhance option '-F' to
         load multiple options, yaml file and directory
 
     Arguments:
         - packets_file: a string, the file for storing all packets
-            needed sent by wb
+            needed sent by wb. If it's None, a unique temporary file
+            of this run will be created in a RAM-backed directory,
+            and removed after wb exits (default = None)
+        - cache: a PacketsCache to reuse the packets compiled before,
+            None means that the cache is disabled
+        - options: a list, the arguments of pywb, only the packets
+            that wb reads within its '-Q' are loaded,
+            None means all of packets (default = None)
+
+    Attributes:
+        - cache: the PacketsCache used to load packets
+        - jobs: an integer, the number of processes to compile packets
+        - sample: a string, one of packetsloader.SAMPLES, the way to
+            take the packets within '-Q'
+        - seed: a string, the seed of the 'random' sample,
+            None means a different sample each time
+        - stream: a bool, if it's True, packets are streamed to wb
+            through a FIFO while they are being compiled
+        - slices: an integer, the max number of disjoint slices
+            the packets are dumped into, a slice per wb worker,
+            see slice
+        - slice_files: a list of the files of non-empty slices
+            returned by the last slice
+        - rules: a bool, if it's True, the rules of packets are written
+            beside the packets file and each slice, see packetstats
+        - mix: a trafficmix.TrafficMix, the packets of its groups are
+            put together and its alias table is written beside
+            the packets file and each slice, None means that
+            all of packets are sent in turn
+        - mix_affinity: a bool, if it's True, each connection of wb
+            keeps sending the group of the mix it picked first
+        - packets_file: a string, the file of packets passed to wb,
+            None if packets haven't been dumped
     """
-    def __init__(self, packets_file):
+    def __init__(self, packets_file=None, cache=None, options=None):
         """ Create a _PacketFileEnhance
         """
         self._packets_file = packets_file
         self._read_packets_paths = []
+        self._max_count = _option_count(options or [], "-Q")
+        self._temp_dir = None
+        self._stream_thread = None
+        self._stream_error = None
+        self.cache = cache
+        self.jobs = 1
+        self.sample = "first"
+        self.seed = None
+        self.stream = False
+        self.slices = 1
+        self.slice_files = []
+        self._slicings = {}
+        self.rules = False
+        self.mix = None
+        self.mix_affinity = False
+        self.packets_file = None
 
     def load(self, options):
         """ See OptionParser.do """
@@ -60,16 +147,197 @@ class _PacketFileEnhance(optionparser.OptionParser):
             raise ValueError("-F needs an argument")
         return file_count
 
+    def _limit(self, slices=1):
+        """ The number of packets that all of wb read, '-Q' is of each
+            slice. '-n' doesn't limit them, because wb sends the whole
+            packets file '-n' times
+        """
+        if not self._max_count:
+            return None
+        return self._max_count * slices
+
+    def _load_packets(self, slices=1):
+        return packetsloader.load_packets_from_paths(
+            self._read_packets_paths, cache=self.cache, jobs=self.jobs,
+            limit=self._limit(slices), sample=self.sample, seed=self.seed)
+
+    def _load_groups(self, slices=1):
+        """ The packets of each group of the mix, '-Q' is split
+            among groups by their weights
+        """
+        group_files = self.mix.group_files(
+            packetsloader.walk_paths(self._read_packets_paths))
+        limit = self._limit(slices)
+        limits = self.mix.split(limit) if limit else [None] * len(group_files)
+        return [
+            itertools.ifilter(None, packetsloader.load_packets_from_paths(
+                files, cache=self.cache, jobs=self.jobs,
+                limit=limit, sample=self.sample, seed=self.seed))
+            for files, limit in zip(group_files, limits)]
+
+    def _dump_packets(self, packets_file, index=False):
+        # the copies of packets are only the entries of the index
+        with packetsdumper.PacketsDumper(
+                packets_file, index, self.rules, dedup=index) as dumper:
+            if not self.mix:
+                for packet in self._load_packets():
+                    dumper.dump(packet)
+                return
+            counts = []
+            for packets in self._load_groups():
+                counts.append(0)
+                for packet in packets:
+                    dumper.dump(packet)
+                    counts[-1] += 1
+        self.mix.write(packets_file, counts)
+
+    def _dump_slices(self, slice_files):
+        """ Dump packets into slices by round robin,
+            the empty slices are removed
+        """
+        dumpers = [
+            packetsdumper.PacketsDumper(
+                slice_file, index=True, rules=self.rules, dedup=True)
+            for slice_file in slice_files]
+        packets_count = 0
+        try:
+            if self.mix:
+                return self._dump_mixed_slices(slice_files, dumpers)
+            for packet in self._load_packets(len(dumpers)):
+                if not packet:
+                    continue
+                dumpers[packets_count % len(dumpers)].dump(packet)
+                packets_count += 1
+        finally:
+            for dumper in dumpers:
+                dumper.__exit__(None, None, None)
+        for slice_file in slice_files[packets_count:]:
+            os.remove(slice_file)
+            os.remove(slice_file + packetsindex.INDEX_SUFFIX)
+        return slice_files[:packets_count]
+
+    def _dump_mixed_slices(self, slice_files, dumpers):
+        """ Dump the packets of each group into slices by round robin,
+            the packets of a group smaller than the slices are dumped
+            into every slice, so that every slice has every group
+        """
+        counts = [[] for _ in dumpers]
+        packets_count = 0
+        for packets in self._load_groups(len(dumpers)):
+            for slice_counts in counts:
+                slice_counts.append(0)
+            first_packets = list(itertools.islice(packets, len(dumpers)))
+            if len(first_packets) < len(dumpers):
+                for i, dumper in enumerate(dumpers):
+                    dumper.dump(first_packets[i % len(first_packets)])
+                    counts[i][-1] += 1
+                continue
+            for packet in itertools.chain(first_packets, packets):
+                slice_id = packets_count % len(dumpers)
+                dumpers[slice_id].dump(packet)
+                counts[slice_id][-1] += 1
+                packets_count += 1
+        for slice_file, slice_counts in zip(slice_files, counts):
+            self.mix.write(slice_file, slice_counts)
+        return slice_files
+
+    def slice(self, arguments, workers):
+        """ Dump the packets into a slice per wb that runs the arguments
+            of wb split among workers, see _count_workers. They are
+            dumped once for each number of wb, so no packet is left out
+            if fewer wb run than the slices, e.g. by a low '-c' or
+            a step of '--search'
+
+        Arguments:
+            - arguments: a list, the arguments of wb
+            - workers: an integer, the max number of workers
+
+        Return a list of the files of non-empty slices,
+            [] if the packets aren't sliced
+        """
+        if self.slices <= 1 or not self._read_packets_paths:
+            return []
+        workers = min(
+            _count_workers(arguments, workers, sliced=True), self.slices)
+        if workers not in self._slicings:
+            if self.sample == "random" and self.seed is None:
+                # every number of wb takes the same packets
+                self.seed = os.urandom(8).encode("hex")
+            root, ext = os.path.splitext(self.packets_file)
+            slice_files = self._dump_slices([
+                "%s-%d-of-%d%s" % (root, i, workers, ext)
+                for i in xrange(workers)])
+            if not slice_files:
+                raise ValueError(
+                    "no packets in " + str(self._read_packets_paths))
+            self._slicings[workers] = slice_files
+        self.slice_files = self._slicings[workers]
+        return self.slice_files
+
+    def _stream_packets(self, fifo):
+        """ Dump packets into the FIFO read by wb """
+        try:
+            self._dump_packets(fifo)
+        except (IOError, OSError) as error:
+            # wb has stopped reading packets, it has reported the reason
+            if error.errno != errno.EPIPE:
+                self._stream_error = error
+        except Exception as error:
+            self._stream_error = error
+
     def dump(self):
         """ See OptionParser.dump """
         if not self._read_packets_paths:
             return []
-        with packetsdumper.PacketsDumper(self._packets_file) as dumper:
-            for packet in\
-                    packetsloader.load_packets_from_paths(
-                        self._read_packets_paths):
-                dumper.dump(packet)
-        return ["-F", self._packets_file]
+        if self.slices > 1 and self.stream:
+            raise ValueError("--stream cannot slice packets for workers")
+        if self.mix and self.stream:
+            raise ValueError(
+                "--stream cannot put the groups of --mix together")
+        if self.mix:
+            self.mix.affinity = self.mix_affinity
+        packets_file = self._packets_file
+        if not packets_file or self.stream:
+            self._temp_dir = tempfile.mkdtemp(
+                prefix="pywb-", dir=pywbutil.get_temp_dir())
+            packets_file = os.path.join(self._temp_dir, "packets.pkt")
+        self.packets_file = packets_file
+        if self.slices > 1:
+            # the packets are sliced once the number of wb is known,
+            # '-F' is replaced by the slice of each wb
+            return ["-F", packets_file]
+        if self.stream:
+            os.mkfifo(packets_file)
+            self._stream_thread = threading.Thread(
+                target=self._stream_packets, args=(packets_file, ))
+            self._stream_thread.daemon = True
+            self._stream_thread.start()
+        else:
+            # wb locates the packets by the index instead of scanning them
+            self._dump_packets(packets_file, index=True)
+        return ["-F", packets_file]
+
+    def clean(self):
+        """ See OptionParser.clean """
+        if self._stream_thread:
+            fifo = os.path.join(self._temp_dir, "packets.pkt")
+            while self._stream_thread.is_alive():
+                # wb exited before reading all packets, open and close
+                # the read side to release the blocked writer
+                try:
+                    fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                except OSError:
+                    fd = None
+                self._stream_thread.join(0.1)
+                if fd is not None:
+                    os.close(fd)
+            self._stream_thread = None
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+        if self._stream_error:
+            error, self._stream_error = self._stream_error, None
+            raise error
 
     def help(self):
         """ See OptionParser.help """
@@ -78,6 +346,692 @@ include these kind of files\n" % (",".join(packetsloader.LOADERS.keys()))
         return help_string
 
 
+class _PacketCacheEnhance(optionparser.OptionParser):
+    """ Packet cache parser, '--cache-dir' sets the directory of the cache
+        for the packets compiled by '-F', '--no-cache' disables the cache
+
+    Arguments:
+        - option: a string, '--cache-dir' or '--no-cache'
+        - packet_file_enhance: the _PacketFileEnhance using the cache
+    """
+    def __init__(self, option, packet_file_enhance):
+        if option not in ["--cache-dir", "--no-cache"]:
+            raise ValueError(
+                self.__class__.__name__
+                + " doesn't support option : "
+                + option)
+        self._option = option
+        self._packet_file_enhance = packet_file_enhance
+
+    def load(self, options):
+        if self._option == "--no-cache":
+            self._packet_file_enhance.cache = None
+            return 0
+        if not options or options[0].startswith("-"):
+            raise ValueError(self._option + " needs an argument")
+        self._packet_file_enhance.cache = packetscache.PacketsCache(
+            options[0])
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        if self._option == "--cache-dir":
+            return "    --cache-dir dir Directory of the cache for "\
+                + "packets compiled by -F (default=%s)\n"\
+                % (packetscache.DEFAULT_CACHE_DIR, )
+        else:
+            return "    --no-cache      Compile all of files of -F "\
+                + "without the cache\n"
+
+
+class _PacketJobsEnhance(optionparser.OptionParser):
+    """ Packet jobs parser, '--jobs' sets the number of processes
+        to compile the packets of '-F' in parallel
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance compiling packets
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+
+    def load(self, options):
+        if not options or not options[0].isdigit():
+            raise ValueError("--jobs needs a number")
+        jobs = int(options[0])
+        if jobs == 0:
+            jobs = _cpu_count()
+        self._packet_file_enhance.jobs = jobs
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --jobs N        Number of processes to compile "\
+            + "packets of -F (0: one per CPU, default=1)\n"
+
+
+class _PacketStreamEnhance(optionparser.OptionParser):
+    """ Packet stream parser, '--stream' streams the packets of '-F'
+        to wb through a FIFO, so that wb reads packets while
+        they are being compiled
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance compiling packets
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+
+    def load(self, options):
+        self._packet_file_enhance.stream = True
+        return 0
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --stream        Stream packets of -F to wb "\
+            + "through a FIFO while compiling them\n"
+
+
+class _PacketSampleEnhance(optionparser.OptionParser):
+    """ Packet sample parser, '--sample' sets the way to take the packets
+        of '-F' when only a part of them can be read by wb within '-Q'
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance loading packets
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+
+    def load(self, options):
+        if not options:
+            raise ValueError("--sample needs %s" % (
+                "|".join(packetsloader.SAMPLES), ))
+        sample, _, seed = options[0].partition(":")
+        if sample not in packetsloader.SAMPLES:
+            raise ValueError("--sample needs %s" % (
+                "|".join(packetsloader.SAMPLES), ))
+        self._packet_file_enhance.sample = sample
+        self._packet_file_enhance.seed = seed or None
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --sample first|random[:seed]|stratified  Packets of -F "\
+            + "to load if -Q limits them (default=first)\n"
+
+
+class _OutputPumpEnhance(optionparser.OptionParser):
+    """ Output pump parser, '--pump' drains the output of wb
+        on a reader thread, so that slow filters never block wb
+
+    Attributes:
+        - max_lines: an integer, the max number of lines waiting for
+            filters, None means that the pump is disabled
+    """
+    def __init__(self):
+        self.max_lines = None
+
+    def load(self, options):
+        if not options or not options[0].isdigit() or int(options[0]) <= 0:
+            raise ValueError("--pump needs a positive number")
+        self.max_lines = int(options[0])
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --pump N        Drain output of wb on a thread, "\
+            + "keep at most N lines for filters\n"
+
+
+class _ResultEnhance(optionparser.OptionParser):
+    """ Result parser, '--json' and '--csv' save the results
+        parsed from the output of wb into a file
+
+    Arguments:
+        - option: a string, '--json' or '--csv'
+        - result_parser: the ResultParser parsing the output of wb
+
+    Attributes:
+        - result_file: a string, the file to save the results,
+            '-' means stdout, None means not to save them
+    """
+    def __init__(self, option, result_parser):
+        if option not in ["--json", "--csv"]:
+            raise ValueError(
+                self.__class__.__name__
+                + " doesn't support option : "
+                + option)
+        self._option = option
+        self._result_parser = result_parser
+        self.result_file = None
+
+    def load(self, options):
+        if not options or (options[0].startswith("-") and options[0] != "-"):
+            raise ValueError(self._option + " needs an argument")
+        self.result_file = options[0]
+        return 1
+
+    def dump(self):
+        return []
+
+    def save(self, search=None):
+        """ Save the results into result_file
+
+        Arguments:
+            - search: a capacitysearch.CapacitySearch, if it's set,
+                its steps are saved instead of the results of a wb
+                (default = None)
+        """
+        if not self.result_file:
+            return
+        result = search or self._result_parser.result
+        if self._option == "--json":
+            data = result.to_json(indent=4) + "\n"
+        else:
+            data = result.to_csv()
+        if self.result_file == "-":
+            sys.stdout.write(data)
+        else:
+            with open(os.path.expanduser(self.result_file), "w") as fd:
+                fd.write(data)
+
+    def help(self):
+        if self._option == "--json":
+            return "    --json file     Save the results of wb as JSON "\
+                + "into file ('-' for stdout)\n"
+        else:
+            return "    --csv file      Save the summary of results of wb "\
+                + "as CSV into file ('-' for stdout)\n"
+
+
+class _MetricsEnhance(optionparser.OptionParser):
+    """ Metrics parser, '--metrics-file' and '--metrics-port' publish
+        the progress heartbeats of wb while it runs, see telemetry
+
+    Arguments:
+        - option: a string, '--metrics-file' or '--metrics-port'
+        - metrics_publisher: the telemetry.MetricsPublisher to set up
+    """
+    def __init__(self, option, metrics_publisher):
+        if option not in ["--metrics-file", "--metrics-port"]:
+            raise ValueError(
+                self.__class__.__name__
+                + " doesn't support option : "
+                + option)
+        self._option = option
+        self._metrics_publisher = metrics_publisher
+
+    def load(self, options):
+        if not options or options[0].startswith("-"):
+            if self._option == "--metrics-file":
+                raise ValueError("--metrics-file needs an argument")
+            raise ValueError("--metrics-port needs [host:]port")
+        if self._option == "--metrics-file":
+            self._metrics_publisher.metrics_file = \
+                os.path.expanduser(options[0])
+        else:
+            self._metrics_publisher.address = \
+                cluster.parse_address(options[0], "127.0.0.1")
+        return 1
+
+    def dump(self):
+        return []
+
+    def clean(self):
+        self._metrics_publisher.close()
+
+    def help(self):
+        if self._option == "--metrics-file":
+            return "    --metrics-file file  Append each progress heartbeat "\
+                + "of wb as a JSON line to file\n"
+        else:
+            return "    --metrics-port [host:]port  Serve the progress of wb "\
+                + "as Prometheus metrics (host defaults to 127.0.0.1)\n"
+
+
+def _read_rules_of_wb(file_, packet_file_enhance):
+    """ Pair the file saved by each wb with the rules of its packets
+
+    Arguments:
+        - file_: a string, the file passed to wb, the workers save
+            into the files suffixed by their ids
+        - packet_file_enhance: the _PacketFileEnhance dumping packets
+
+    Return a list of (file, rules) of the files saved by wb,
+        see packetstats.read_rules
+    """
+    packets_files = packet_file_enhance.slice_files \
+        or [packet_file_enhance.packets_file]
+    files = [(file_, packets_files[0])]
+    worker_id = 0
+    while os.path.exists("%s.%d" % (file_, worker_id)):
+        files.append((
+            "%s.%d" % (file_, worker_id),
+            packets_files[min(worker_id, len(packets_files) - 1)]))
+        worker_id += 1
+    return [
+        (saved_file,
+         packetstats.read_rules(packets_file) if packets_file else {})
+        for saved_file, packets_file in files
+        if os.path.exists(saved_file)]
+
+
+class _RulesEnhance(optionparser.OptionParser):
+    """ Rules parser, '--rules' reports the slowest rules and
+        the most blocked rules of the packets of '-F',
+        by the latencies and response codes of each packet saved by wb
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance dumping packets
+
+    Attributes:
+        - top: an integer, the number of rules of each ranking,
+            None means not to report them
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+        self._temp_dir = None
+        self._stats_file = None
+        self.top = None
+
+    def load(self, options):
+        if not options or not options[0].isdigit() or int(options[0]) <= 0:
+            raise ValueError("--rules needs a positive number")
+        self.top = int(options[0])
+        self._packet_file_enhance.rules = True
+        return 1
+
+    def dump(self):
+        if not self.top:
+            return []
+        self._temp_dir = tempfile.mkdtemp(
+            prefix="pywb-", dir=pywbutil.get_temp_dir())
+        self._stats_file = os.path.join(self._temp_dir, "packets.stats")
+        return ["-6", self._stats_file]
+
+    def report(self):
+        """ Print the rankings of rules after wb exits """
+        if not self.top:
+            return
+        stats_and_rules = [
+            (packetstats.read_packet_stats(stats_file), rules)
+            for stats_file, rules in _read_rules_of_wb(
+                self._stats_file, self._packet_file_enhance)]
+        sys.stdout.write("".join(packetstats.format_rules_report(
+            packetstats.group_by_rules(stats_and_rules), self.top)))
+
+    def clean(self):
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+    def help(self):
+        return "    --rules N       Report the N slowest rules and "\
+            + "the N most blocked rules of -F\n"
+
+
+class _VerifyEnhance(optionparser.OptionParser):
+    """ Verify parser, '--verify' checks the responses of the packets
+        of '-F' against the expected outputs of their FTW stages,
+        the responses are saved by wb as binary records
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance dumping packets
+        - options: a list, the command arguments of pywb
+
+    Attributes:
+        - verify: a bool, if it's True, the responses are verified
+    """
+    def __init__(self, packet_file_enhance, options):
+        self._packet_file_enhance = packet_file_enhance
+        self._save_messages = "-o" in options
+        self._temp_dir = None
+        self._msg_file = None
+        self.verify = False
+
+    def load(self, options):
+        if self._save_messages:
+            raise ValueError("--verify cannot be used with -o")
+        self.verify = True
+        self._packet_file_enhance.rules = True
+        return 0
+
+    def dump(self):
+        if not self.verify:
+            return []
+        self._temp_dir = tempfile.mkdtemp(
+            prefix="pywb-", dir=pywbutil.get_temp_dir())
+        self._msg_file = os.path.join(self._temp_dir, "messages.bin")
+        return ["-o", self._msg_file, "-7", "-K"]
+
+    def report(self):
+        """ Print the failed tests after wb exits
+
+        Return False if any response isn't expected
+        """
+        if not self.verify:
+            return True
+        verdicts = responseverifier.verify_responses(
+            _read_rules_of_wb(self._msg_file, self._packet_file_enhance))
+        sys.stdout.write("".join(
+            responseverifier.format_verification_report(verdicts)))
+        return not any(verdict.failed for verdict in verdicts)
+
+    def clean(self):
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+    def help(self):
+        return "    --verify        Check the responses of -F against "\
+            + "the expected outputs of FTW\n"
+
+
+class _RateEnhance(optionparser.OptionParser):
+    """ Rate parser, '--rate' runs wb in the open loop, the requests
+        start at the intended times of the target rate regardless of
+        responses, and their latencies are measured from those times
+
+    Attributes:
+        - profile: a string, the target rate profile of '-M' of wb,
+            None means the closed loop
+    """
+    def __init__(self):
+        self.profile = None
+
+    def load(self, options):
+        if not options or options[0].startswith("-"):
+            raise ValueError("--rate needs a rate profile")
+        pywbutil.parse_rate_profile(options[0])
+        self.profile = options[0]
+        return 1
+
+    def dump(self):
+        if not self.profile:
+            return []
+        return ["-M", self.profile]
+
+    def help(self):
+        return "    --rate profile  Send requests at the target rate "\
+            + "regardless of responses,\n"\
+            + "                    e.g. 1k, 100-1k@30 (ramp in 30s), "\
+            + "100@10,200@10,400 (steps)\n"
+
+
+class _MixEnhance(optionparser.OptionParser):
+    """ Mix parser, '--mix' sends the packets of '-F' by the weights
+        of their groups instead of in turn, e.g. 'benign/=95,attacks/=5',
+        see trafficmix. If the groups have rates, wb runs in the open loop
+        at the sum of them
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance dumping packets
+        - rate_enhance: the _RateEnhance of '--rate'
+        - options: a list, the command arguments of pywb
+    """
+    def __init__(self, packet_file_enhance, rate_enhance, options):
+        self._packet_file_enhance = packet_file_enhance
+        self._rate_enhance = rate_enhance
+        self._target_rate = "-M" in options
+
+    def load(self, options):
+        if not options or options[0].startswith("-"):
+            raise ValueError("--mix needs groups and their weights")
+        self._packet_file_enhance.mix = trafficmix.TrafficMix(options[0])
+        return 1
+
+    def dump(self):
+        mix = self._packet_file_enhance.mix
+        if not mix:
+            return []
+        packets_file = self._packet_file_enhance.packets_file
+        if not packets_file:
+            raise ValueError("--mix needs -F")
+        options = ["-9", packets_file + trafficmix.MIX_SUFFIX]
+        if mix.rate is not None:
+            if self._rate_enhance.profile or self._target_rate:
+                raise ValueError(
+                    "the rates of --mix cannot be used with --rate or -M")
+            options += ["-M", pywbutil.format_rate_profile(
+                [(mix.rate, mix.rate, None)])]
+        return options
+
+    def help(self):
+        return "    --mix selector=weight[,...]  Send the packets of -F "\
+            + "by the weights of groups,\n"\
+            + "                    e.g. benign/=95,attacks/=5, "\
+            + "rule:9201*=1k/s (rates of the open loop)\n"
+
+
+class _MixAffinityEnhance(optionparser.OptionParser):
+    """ Mix affinity parser, '--mix-affinity' makes each connection
+        of wb keep sending the group of '--mix' it picked first
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance dumping packets
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+
+    def load(self, options):
+        self._packet_file_enhance.mix_affinity = True
+        return 0
+
+    def dump(self):
+        if self._packet_file_enhance.mix_affinity \
+                and not self._packet_file_enhance.mix:
+            raise ValueError("--mix-affinity needs --mix")
+        return []
+
+    def help(self):
+        return "    --mix-affinity  Each connection keeps the group of "\
+            + "--mix it picked first\n"
+
+
+class _SearchEnhance(optionparser.OptionParser):
+    """ Search parser, '--search' runs wb step by step to search
+        the highest throughput that meets a latency SLO,
+        e.g. 'p99=50ms,errors=1%', see capacitysearch.
+        The packets of '-F' are dumped once for all of steps
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance dumping packets
+        - rate_enhance: the _RateEnhance of '--rate'
+        - options: a list, the command arguments of pywb
+
+    Attributes:
+        - search: a capacitysearch.CapacitySearch,
+            None means a single run
+    """
+    def __init__(self, packet_file_enhance, rate_enhance, options):
+        self._packet_file_enhance = packet_file_enhance
+        self._rate_enhance = rate_enhance
+        self._target_rate = "-M" in options
+        self._no_percentiles = "-d" in options
+        self.search = None
+
+    def load(self, options):
+        if not options or options[0].startswith("-"):
+            raise ValueError("--search needs a latency SLO")
+        self.search = capacitysearch.CapacitySearch(options[0])
+        return 1
+
+    def dump(self):
+        if not self.search:
+            return []
+        if self._no_percentiles:
+            raise ValueError("--search needs the percentiles, without -d")
+        mix = self._packet_file_enhance.mix
+        if self.search.knob == "rate" and (
+                self._rate_enhance.profile or self._target_rate
+                or (mix and mix.rate is not None)):
+            raise ValueError(
+                "--search of rate cannot be used with --rate, -M "
+                "or the rates of --mix")
+        return []
+
+    def help(self):
+        return "    --search slo    Search the highest throughput under "\
+            + "the SLO by -c or the rate,\n"\
+            + "                    e.g. p99=50ms,errors=1%, "\
+            + "p99=10ms,rate=100-10k\n"
+
+
+class _WorkersEnhance(optionparser.OptionParser):
+    """ Workers parser, '--workers' fans the load out to multiple wb,
+        each of them sends a disjoint slice of the packets of '-F'
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance slicing packets
+
+    Attributes:
+        - workers: an integer, the max number of wb
+        - pin: a bool, if it's True, each wb is pinned to a CPU
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+        self.workers = 1
+        self.pin = False
+
+    def load(self, options):
+        if not options or not options[0].isdigit():
+            raise ValueError("--workers needs a number")
+        workers = int(options[0])
+        if workers == 0:
+            workers = _cpu_count()
+        self.workers = workers
+        self._packet_file_enhance.slices = workers
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --workers N     Split -c, -n, -R and --rate among N wb "\
+            + "and merge their results (0: one per CPU),\n"\
+            + "                    each wb sends its slice of -F -n times\n"
+
+
+class _WorkersPinEnhance(optionparser.OptionParser):
+    """ Workers pin parser, '--pin' pins each wb of '--workers' to a CPU
+
+    Arguments:
+        - workers_enhance: the _WorkersEnhance
+    """
+    def __init__(self, workers_enhance):
+        self._workers_enhance = workers_enhance
+
+    def load(self, options):
+        self._workers_enhance.pin = True
+        return 0
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --pin           Pin each wb of --workers to a CPU "\
+            + "by taskset\n"
+
+
+class _AgentEnhance(optionparser.OptionParser):
+    """ Agent parser, '--agent' serves the runs of wb requested by
+        the coordinators of '--agents' instead of running wb,
+        the host defaults to 127.0.0.1
+
+    Attributes:
+        - address: a tuple of (host, port) to listen,
+            None means that pywb isn't an agent
+        - token: a string shared with the coordinators, it's needed
+            unless the agent only listens on the loopback
+    """
+    def __init__(self):
+        self.address = None
+        self.token = os.environ.get(AGENT_TOKEN_ENV)
+
+    def load(self, options):
+        if not options or options[0].startswith("-"):
+            raise ValueError("--agent needs [host:]port")
+        self.address = cluster.parse_address(options[0], "127.0.0.1")
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --agent [host:]port  Serve the runs of wb requested "\
+            + "by --agents (host defaults to 127.0.0.1)\n"
+
+
+class _AgentTokenEnhance(optionparser.OptionParser):
+    """ Agent token parser, '--agent-token' sets the token shared by
+        the agent of '--agent' and the coordinator of '--agents',
+        it defaults to the environment variable AGENT_TOKEN_ENV
+
+    Arguments:
+        - agent_enhance: the _AgentEnhance of '--agent'
+        - agents_enhance: the _AgentsEnhance of '--agents'
+    """
+    def __init__(self, agent_enhance, agents_enhance):
+        self._agent_enhance = agent_enhance
+        self._agents_enhance = agents_enhance
+
+    def load(self, options):
+        if not options or not options[0] or options[0].startswith("-"):
+            raise ValueError("--agent-token needs a token")
+        self._agent_enhance.token = options[0]
+        self._agents_enhance.token = options[0]
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --agent-token token  Token shared by --agent and "\
+            + "--agents (default: $" + AGENT_TOKEN_ENV + ")\n"
+
+
+class _AgentsEnhance(optionparser.OptionParser):
+    """ Agents parser, '--agents' fans the load out to the agents
+        on multiple hosts, each of them sends a disjoint slice of
+        the packets of '-F'
+
+    Arguments:
+        - packet_file_enhance: the _PacketFileEnhance slicing packets
+
+    Attributes:
+        - agents: a list of (host, port) of agents
+        - token: a string shared with the agents
+    """
+    def __init__(self, packet_file_enhance):
+        self._packet_file_enhance = packet_file_enhance
+        self.agents = []
+        self.token = os.environ.get(AGENT_TOKEN_ENV)
+
+    def load(self, options):
+        if not options or options[0].startswith("-"):
+            raise ValueError("--agents needs host:port[,host:port...]")
+        self.agents = [
+            cluster.parse_address(address, "localhost")
+            for address in options[0].split(",") if address]
+        self._packet_file_enhance.slices = len(self.agents)
+        return 1
+
+    def dump(self):
+        return []
+
+    def help(self):
+        return "    --agents host:port[,...]  Split -c, -n, -R and --rate "\
+            + "among the wb of agents and merge their results\n"
+
+
 class _UploadFileEnhance(optionparser.OptionParser):
     """ Upload file parser, enhance option '-p' and -u'
         to automatically inferring the Content-Type by file ext,
@@ -134,8 +1088,9 @@ supports to upload one files>")
 
         file_ext = os.path.splitext(upload_file)[-1].lower()
         content_type = "application/octet-stream"
-        if file_ext in pywbutil.MIME_TYPE_DICT:
-            content_type = pywbutil.MIME_TYPE_DICT[file_ext]
+        mime_type_dict = pywbutil.get_mime_type_dict()
+        if file_ext in mime_type_dict:
+            content_type = mime_type_dict[file_ext]
         return [self._action, upload_file, "-T", content_type]
 
     def help(self):
@@ -230,33 +1185,479 @@ class _HelpInfoGenerator(outputfilter.OutputFilter):
         return line
 
 
-def execute_wb(arguments, filters):
+class _OutputPump(object):
+    """ Drain the output of wb on a reader thread, so that wb never
+        blocks on its stdout however slow the filters are.
+        The lines are handed to the filters in batches.
+
+    Arguments:
+        - stream: a file object, the output of wb
+        - max_lines: an integer, the max number of lines waiting for
+            the filters, the oldest lines are dropped beyond it
+
+    Attributes:
+        - dropped: an integer, the number of dropped lines
+        - delayed: an integer, the number of lines that arrived
+            while the filters were busy
+    """
+    def __init__(self, stream, max_lines):
+        """ Create an output pump and start its reader thread
+        """
+        self._stream = stream
+        self._max_lines = max_lines
+        self._lines = collections.deque()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._eof = False
+        self.dropped = 0
+        self.delayed = 0
+        self._reader = threading.Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _append(self, lines):
+        with self._condition:
+            if self._busy or self._lines:
+                self.delayed += len(lines)
+            self._lines.extend(lines)
+            while len(self._lines) > self._max_lines:
+                self._lines.popleft()
+                self.dropped += 1
+            self._condition.notify()
+
+    def _read(self):
+        """ Read the output by chunks and split it into lines """
+        fd = self._stream.fileno()
+        remainder = ""
+        try:
+            while True:
+                bytes_ = os.read(fd, 64 * 1024)
+                if not bytes_:
+                    break
+                bytes_ = remainder + bytes_
+                lines = bytes_.split("\n")
+                remainder = lines.pop()
+                if lines:
+                    self._append([line + "\n" for line in lines])
+            if remainder:
+                self._append([remainder])
+        finally:
+            with self._condition:
+                self._eof = True
+                self._condition.notify()
+
+    def __iter__(self):
+        """ Generate the batches of lines until wb closes its output """
+        while True:
+            with self._condition:
+                self._busy = False
+                while not self._lines and not self._eof:
+                    self._condition.wait()
+                if not self._lines:
+                    break
+                lines = list(self._lines)
+                self._lines.clear()
+                self._busy = True
+            yield lines
+        self._reader.join()
+
+
+def _filter_line(line, filters):
+    for filter_ in filters:
+        line = filter_(line)
+        if line is None:
+            break
+
+
+def _filter_output(wb, filters, pump_lines=None):
+    """ Process the output of wb by filters until wb closes it """
+    if pump_lines:
+        pump = _OutputPump(wb.stdout, pump_lines)
+        for lines in pump:
+            for line in lines:
+                _filter_line(line, filters)
+        if pump.dropped or pump.delayed:
+            sys.stderr.write(
+                "pywb: %d lines of wb output were delayed, %d were dropped\n"
+                % (pump.delayed, pump.dropped))
+    else:
+        while True:
+            line = wb.stdout.readline()
+            if not line:
+                break
+            _filter_line(line, filters)
+
+
+def execute_wb(arguments, filters, pump_lines=None):
     """ execute wb by a subprocess
 
     Argument:
         - arguments: A string list of the arguments will pass to wb
         - filters: A list of filters to process
             the output of wb
+        - pump_lines: An integer, if it's set, the output of wb is
+            drained by an _OutputPump that keeps at most pump_lines lines
+            for filters, otherwise wb waits for the filters to process
+            each line (default = None)
 
     Return an interger that is return code of wb
     """
-    wb = subprocess.Popen(
-        arguments, shell=False,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return execute_wbs([arguments], [filters], pump_lines)[0]
+
+
+def execute_wbs(arguments_list, filters_list, pump_lines=None):
+    """ execute multiple wb by subprocesses at the same time
+
+    Argument:
+        - arguments_list: A list of the arguments of each wb
+        - filters_list: A list of the filters of each wb,
+            the filters of different wb are called by different threads
+        - pump_lines: See execute_wb
+
+    Return a list of interger that are return codes of wb
+    """
+    wbs = [
+        subprocess.Popen(
+            arguments, shell=False,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for arguments in arguments_list]
     # ignore SIGINT
     original_handler = signal.getsignal(signal.SIGINT)
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    while True:
-        line = wb.stdout.readline()
-        if not line:
-            break
-        for filter_ in filters:
-            line = filter_(line)
-            if line is None:
-                break
+    if len(wbs) == 1:
+        _filter_output(wbs[0], filters_list[0], pump_lines)
+    else:
+        threads = [
+            threading.Thread(
+                target=_filter_output, args=(wb, filters, pump_lines))
+            for wb, filters in zip(wbs, filters_list)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
     # recover SIGINT
     signal.signal(signal.SIGINT, original_handler)
-    return wb.wait()
+    return [wb.wait() for wb in wbs]
+
+
+def _share(total, workers, worker_id):
+    """ The share of worker_id when total is split to workers """
+    return total // workers + (1 if worker_id < total % workers else 0)
+
+
+def _parse_rps(rps):
+    """ Parse the argument of '-R' as wb, e.g. 10k """
+    scales = {"k": 1000, "m": 1000000, "g": 1000000000}
+    scale = scales.get(rps[-1:].lower())
+    if scale is None:
+        return int(rps)
+    return int(scale * float(rps[:-1]))
+
+
+def _wb_options(arguments):
+    """ Pair the options of wb with their arguments
+
+    Arguments:
+        - arguments: a list, the arguments of wb
+
+    Return a list of (option, argument) in order, the argument is None
+        for a flag or the target of wb
+    """
+    options = []
+    i = 1
+    while i < len(arguments):
+        option = arguments[i]
+        position = optionparser.ACCEPTABLE_WB_OPTIONS.find(option[1:2])
+        if option.startswith("-") and len(option) == 2 and position != -1 \
+                and optionparser.ACCEPTABLE_WB_OPTIONS[position + 1:][:1] \
+                == ":" and i + 1 < len(arguments):
+            options.append((option, arguments[i + 1]))
+            i += 2
+        else:
+            options.append((option, None))
+            i += 1
+    return options
+
+
+def _set_option(arguments, option, argument):
+    """ Return the arguments of wb with option set to argument,
+        the other values of option are removed
+    """
+    new_arguments = arguments[:1] + [option, argument]
+    for option_, argument_ in _wb_options(arguments):
+        if option_ == option:
+            continue
+        new_arguments.append(option_)
+        if argument_ is not None:
+            new_arguments.append(argument_)
+    return new_arguments
+
+
+def _count_workers(arguments, workers, sliced=False):
+    """ The number of wb that run the arguments of wb split among workers,
+        each of them needs a share of '-c' and '-R', and of '-n' unless
+        the packets are sliced
+
+    Arguments:
+        - arguments: a list, the arguments of wb
+        - workers: an integer, the max number of workers
+        - sliced: a bool, if it's True, each worker sends its own slice
+            of the packets of '-F' (default = False)
+    """
+    values = dict(_wb_options(arguments))
+    workers = min(workers, int(values.get("-c", 1)))
+    if "-n" in values and not sliced:
+        workers = min(workers, int(values["-n"]))
+    if "-R" in values:
+        workers = min(workers, _parse_rps(values["-R"]))
+    return max(workers, 1)
+
+
+def _split_arguments(arguments, workers, packet_files):
+    """ Split the arguments of wb into the arguments of workers
+
+    Arguments:
+        - arguments: a list, the arguments of wb
+        - workers: an integer, the max number of workers
+        - packet_files: a list of the slices of packets, a slice per worker,
+            see _PacketFileEnhance.slice
+
+    Return a list of the arguments of each worker,
+        '-c', '-n', '-R' and the rates of '-M' are split among workers,
+        but '-n' isn't split if the packets are sliced, because wb sends
+        its packets file '-n' times, so each worker sends its slice
+        '-n' times and all of packets are sent '-n' times as by a wb,
+        '-F' is replaced by the slice of each worker, and '-9' by
+        the mix file of the slice,
+        '-e', '-g', '-o' and '-6' files are suffixed by the id of each worker
+    """
+    options = _wb_options(arguments)
+    if "-D" in dict(options):
+        raise ValueError("-D cannot be used with --workers or --agents")
+    workers = _count_workers(arguments, workers, bool(packet_files))
+    if packet_files:
+        if len(packet_files) > workers:
+            raise ValueError("%d slices of packets for %d workers"
+                             % (len(packet_files), workers))
+        workers = len(packet_files)
+
+    arguments_list = []
+    for worker_id in xrange(workers):
+        worker_arguments = arguments[:1]
+        for option, argument in options:
+            if option == "-c" or option == "-n" and not packet_files:
+                argument = str(_share(int(argument), workers, worker_id))
+            elif option == "-R":
+                argument = str(_share(_parse_rps(argument), workers, worker_id))
+            elif option == "-M":
+                argument = pywbutil.format_rate_profile([
+                    (rate_from / workers, rate_to / workers, seconds)
+                    for rate_from, rate_to, seconds
+                    in pywbutil.parse_rate_profile(argument)])
+            elif option == "-F" and packet_files:
+                argument = packet_files[worker_id]
+            elif option == "-9" and packet_files:
+                argument = packet_files[worker_id] + trafficmix.MIX_SUFFIX
+            elif option in ["-e", "-g", "-o", "-6"]:
+                argument = "%s.%d" % (argument, worker_id)
+            worker_arguments.append(option)
+            if argument is not None:
+                worker_arguments.append(argument)
+        arguments_list.append(worker_arguments)
+    return arguments_list
+
+
+class _PrefixedOutputFilter(outputfilter.OutputFilter):
+    """ Parse the output of a worker or a step of search,
+        then pass it to the filters of pywb with a prefix
+
+    Arguments:
+        - prefix: a string, e.g. '[worker 0] '
+        - filters: a list of the filters of pywb
+        - lock: a lock shared by workers to call the filters of pywb
+
+    Attributes:
+        - result_parser: the ResultParser of the prefixed output
+    """
+    def __init__(self, prefix, filters, lock):
+        self._prefix = prefix
+        self._filters = filters
+        self._lock = lock
+        self.result_parser = resultparser.ResultParser()
+
+    def __call__(self, line):
+        self.result_parser(line)
+        with self._lock:
+            _filter_line(self._prefix + line, self._filters)
+        return None
+
+
+def _execute_workers(
+        arguments, workers, filters,
+        pin=False, packet_files=None, pump_lines=None):
+    """ Execute wb by workers and merge their results
+
+    Arguments:
+        - arguments: a list, the arguments of wb
+        - workers: an integer, the max number of workers
+        - filters: a list of the filters of pywb, the output of workers
+            is prefixed by their ids, and the merged results are
+            passed to filters as the report of a wb
+        - pin: a bool, if it's True, each worker is pinned to a CPU
+        - packet_files: a list of the slices of packets
+        - pump_lines: See execute_wb
+
+    Return an integer, the first non-zero return code of workers or 0
+    """
+    arguments_list = _split_arguments(arguments, workers, packet_files)
+    temp_dir = tempfile.mkdtemp(prefix="pywb-", dir=pywbutil.get_temp_dir())
+    try:
+        hist_files = []
+        for worker_id, worker_arguments in enumerate(arguments_list):
+            # the histograms of latencies are used to merge latencies
+            hist_file = os.path.join(
+                temp_dir, "histograms-%d.txt" % (worker_id, ))
+            worker_arguments[1:1] = ["-D", hist_file]
+            hist_files.append(hist_file)
+            if pin:
+                cpu = worker_id % _cpu_count()
+                worker_arguments[0:0] = ["taskset", "-c", str(cpu)]
+        lock = threading.Lock()
+        worker_filters = [
+            _PrefixedOutputFilter(
+                "[worker %d] " % (worker_id, ), filters, lock)
+            for worker_id in xrange(len(arguments_list))]
+        return_codes = execute_wbs(
+            arguments_list, [[filter_] for filter_ in worker_filters],
+            pump_lines)
+
+        _report_merged_results(
+            [filter_.result_parser.result for filter_ in worker_filters],
+            [histogram.read_histograms(hist_file)
+             for hist_file in hist_files if os.path.exists(hist_file)],
+            filters)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return _first_failure(return_codes)
+
+
+def _report_merged_results(results, histograms_list, filters):
+    """ Pass the merged results to filters as the report of a wb """
+    result = resultmerger.merge_results(
+        results, histogram.merge_histograms(histograms_list))
+    for line in resultmerger.format_result(result):
+        _filter_line(line, filters)
+
+
+def _first_failure(return_codes):
+    for return_code in return_codes:
+        if return_code:
+            return return_code
+    return 0
+
+
+class _AgentMessageFilter(object):
+    """ Pass the messages of agents to the filters of pywb,
+        the lines of each agent are prefixed by its address and
+        the merged progress of agents is prefixed by '[cluster] '
+
+    Arguments:
+        - agents: a list of (host, port) of agents
+        - filters: a list of the filters of pywb
+    """
+    def __init__(self, agents, filters):
+        self._prefixes = ["[agent %s:%d] " % agent for agent in agents]
+        self._filters = filters
+
+    def __call__(self, agent_id, message):
+        if agent_id is None:
+            line = "[cluster] " \
+                + resultmerger.format_interval(message["interval"])
+        elif message["type"] == "line":
+            line = self._prefixes[agent_id] + message["line"]
+        else:
+            return
+        _filter_line(line, self._filters)
+
+
+def _execute_agents(
+        arguments, agents, filters, packet_files=None, token=None):
+    """ Execute wb by agents and merge their results
+
+    Arguments:
+        - arguments: a list, the arguments of wb
+        - agents: a list of (host, port) of agents
+        - filters: a list of the filters of pywb, the output of agents
+            is prefixed by their addresses, and the merged results are
+            passed to filters as the report of a wb
+        - packet_files: a list of the slices of packets
+        - token: a string shared with the agents (default = None)
+
+    Return an integer, the first non-zero return code of agents or 0
+    """
+    arguments_list = _split_arguments(arguments, len(agents), packet_files)
+    coordinator = cluster.Coordinator(agents, token)
+    outcomes = coordinator.run(
+        # the agents run their own wb
+        [agent_arguments[1:] for agent_arguments in arguments_list],
+        [_AgentMessageFilter(agents, filters)])
+    results, histograms_list, return_codes = zip(*outcomes)
+    _report_merged_results(results, histograms_list, filters)
+    return _first_failure(return_codes)
+
+
+def _execute_search(search, arguments, run, filters):
+    """ Run wb step by step to search the highest throughput under an SLO
+
+    Arguments:
+        - search: a capacitysearch.CapacitySearch
+        - arguments: a list, the arguments of wb, the option of
+            the knob of search is set by each step
+        - run: a function that runs wb once by (arguments, filters)
+            and returns its return code
+        - filters: a list of the filters of pywb, the output of each step
+            is prefixed by the knob, e.g. '[search c=64] '
+
+    Return 0 if a step met the SLO, otherwise 1
+    """
+    def execute_step(value):
+        step_filter = _PrefixedOutputFilter(
+            "[search %s] " % (search.label(value), ), filters,
+            threading.Lock())
+        step_arguments = _set_option(arguments, *search.option(value))
+        return_code = run(step_arguments, [step_filter])
+        return step_filter.result_parser.result, return_code
+
+    best = search.run(execute_step)
+    sys.stdout.write("".join(capacitysearch.format_search_report(search)))
+    return 0 if best else 1
+
+
+def _clean_parsers(enhance_options, failed=False):
+    """ Clean all of the enhance parsers, even if some of them fail
+
+    Arguments:
+        - enhance_options: a dict of the enhance parsers
+        - failed: a bool, if it's True, pywb is raising another exception,
+            which isn't replaced by the errors of parsers, then they are
+            written to stderr (default = False)
+
+    The first error of parsers is raised after all of them are cleaned,
+        unless failed is True
+    """
+    first_error = None
+    for option, parser in enhance_options.items():
+        try:
+            parser.clean()
+        except Exception as error:
+            if failed or first_error:
+                sys.stderr.write(
+                    "pywb: cannot clean %s: %s\n" % (option, error))
+            else:
+                first_error = sys.exc_info()
+    if first_error:
+        raise first_error[0], first_error[1], first_error[2]
 
 
 def execute(arguments, customized_options={}, customized_filters=[]):
@@ -275,9 +1676,49 @@ def execute(arguments, customized_options={}, customized_filters=[]):
     Return an interger that is return code of wb
     """
 
+    packet_file_enhance = _PacketFileEnhance(
+        cache=packetscache.PacketsCache(), options=arguments)
+    output_pump_enhance = _OutputPumpEnhance()
+    result_parser = resultparser.ResultParser()
+    workers_enhance = _WorkersEnhance(packet_file_enhance)
+    agent_enhance = _AgentEnhance()
+    agents_enhance = _AgentsEnhance(packet_file_enhance)
+    rules_enhance = _RulesEnhance(packet_file_enhance)
+    verify_enhance = _VerifyEnhance(packet_file_enhance, arguments)
+    metrics_publisher = telemetry.MetricsPublisher()
+    rate_enhance = _RateEnhance()
+    search_enhance = _SearchEnhance(
+        packet_file_enhance, rate_enhance, arguments)
     enhance_options =\
         collections.OrderedDict([
-            ("-F", _PacketFileEnhance(".default.pkt")),
+            ("-F", packet_file_enhance),
+            ("--cache-dir",
+                _PacketCacheEnhance("--cache-dir", packet_file_enhance)),
+            ("--no-cache",
+                _PacketCacheEnhance("--no-cache", packet_file_enhance)),
+            ("--jobs", _PacketJobsEnhance(packet_file_enhance)),
+            ("--stream", _PacketStreamEnhance(packet_file_enhance)),
+            ("--sample", _PacketSampleEnhance(packet_file_enhance)),
+            ("--pump", output_pump_enhance),
+            ("--rate", rate_enhance),
+            ("--mix", _MixEnhance(
+                packet_file_enhance, rate_enhance, arguments)),
+            ("--mix-affinity", _MixAffinityEnhance(packet_file_enhance)),
+            ("--search", search_enhance),
+            ("--workers", workers_enhance),
+            ("--pin", _WorkersPinEnhance(workers_enhance)),
+            ("--agent", agent_enhance),
+            ("--agents", agents_enhance),
+            ("--agent-token",
+                _AgentTokenEnhance(agent_enhance, agents_enhance)),
+            ("--rules", rules_enhance),
+            ("--verify", verify_enhance),
+            ("--json", _ResultEnhance("--json", result_parser)),
+            ("--csv", _ResultEnhance("--csv", result_parser)),
+            ("--metrics-file",
+                _MetricsEnhance("--metrics-file", metrics_publisher)),
+            ("--metrics-port",
+                _MetricsEnhance("--metrics-port", metrics_publisher)),
             ("-p", _UploadFileEnhance("-p", arguments)),
             ("-u", _UploadFileEnhance("-u", arguments)),
         ])
@@ -285,17 +1726,88 @@ def execute(arguments, customized_options={}, customized_filters=[]):
     for opt, parser in customized_options.items():
         enhance_options[opt] = parser
 
-    arguments = optionparser.parse(
-        arguments,
-        enhance_options=enhance_options)
+    failed = False
+    try:
+        arguments = optionparser.parse(
+            arguments,
+            enhance_options=enhance_options)
 
-    output_filters = [
-        _HelpInfoGenerator(enhance_options),
-        _simple_printer,
-    ]
+        output_filters = [
+            result_parser,
+            _HelpInfoGenerator(enhance_options),
+            _simple_printer,
+        ]
+        if metrics_publisher.enabled():
+            # the heartbeats are parsed again only if they are published
+            metrics_publisher.start()
+            output_filters.insert(1, metrics_publisher)
+
+        output_filters = customized_filters + output_filters
+        if agent_enhance.address:
+            agent = cluster.Agent(
+                agent_enhance.address,
+                lambda arguments, filters: execute_wb(
+                    arguments, filters,
+                    pump_lines=output_pump_enhance.max_lines),
+                token=agent_enhance.token)
+            try:
+                agent.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                agent.server_close()
+            return 0
+        if agents_enhance.agents:
+            if workers_enhance.workers > 1:
+                raise ValueError("--workers cannot be used with --agents")
+            if rules_enhance.top or verify_enhance.verify:
+                raise ValueError(
+                    "--rules and --verify cannot be used with --agents")
+            if packet_file_enhance.mix:
+                raise ValueError("--mix cannot be used with --agents")
+            # the files of agents are neither read nor written
+            cluster.check_agent_arguments(arguments[1:])
+        search = search_enhance.search
+        if search and (rules_enhance.top or verify_enhance.verify):
+            raise ValueError(
+                "--rules and --verify cannot be used with --search")
 
-    output_filters = customized_filters + output_filters
-    return execute_wb(arguments, output_filters)
+        def run(arguments, filters):
+            """ Run wb once by agents, workers or itself """
+            if agents_enhance.agents:
+                return _execute_agents(
+                    arguments, agents_enhance.agents, filters,
+                    packet_files=packet_file_enhance.slice(
+                        arguments, len(agents_enhance.agents)),
+                    token=agents_enhance.token)
+            if workers_enhance.workers > 1:
+                return _execute_workers(
+                    arguments, workers_enhance.workers, filters,
+                    pin=workers_enhance.pin,
+                    packet_files=packet_file_enhance.slice(
+                        arguments, workers_enhance.workers),
+                    pump_lines=output_pump_enhance.max_lines)
+            return execute_wb(
+                arguments, filters,
+                pump_lines=output_pump_enhance.max_lines)
+
+        if search:
+            return_code = _execute_search(
+                search, arguments, run, output_filters)
+        else:
+            return_code = run(arguments, output_filters)
+        rules_enhance.report()
+        if not verify_enhance.report() and not return_code:
+            return_code = 1
+        for _, parser in enhance_options.items():
+            if isinstance(parser, _ResultEnhance):
+                parser.save(search)
+        return return_code
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _clean_parsers(enhance_options, failed)
 
 if __name__ == '__main__':
     sys.exit(execute(sys.argv[1:]))
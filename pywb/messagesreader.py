@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Read the messages saved by wb as binary records
+
+This exports:
+    - Record is a class of the bytes received by wb from a response.
+    - read_records is a function that streams the records of a file
+        saved by the '-o' and '-7' options of wb.
+    - read_responses is a function that streams the responses of
+        the output file of wb, including its rotated segment.
+    - execute is a function that prints the responses of
+        the output file of wb.
+
+A binary output file of wb starts with 'WBCAP001', followed by records,
+each record is a header of big-endian fields then the received bytes,
+    data length (4), kind (1), reserved (1), status (2), pkt_seq (4),
+    connection (4), microseconds since the start of test (8).
+The kind is FIRST for the first bytes of a response, NEXT for the
+following bytes and TIMEOUT for a response that timed out. The body is
+saved only if '-K' is set. The records of concurrent connections are
+interleaved, they are told apart by their connection. Once '-G' is
+exceeded, wb renames the full file to '<msg_file>.1' and starts a new one,
+a record is never split.
+
+Usage: ./messagesreader.py msg_file
+"""
+
+__all__ = [
+    "Record",
+    "read_records",
+    "read_responses",
+    "execute",
+]
+
+import os
+import sys
+import struct
+import collections
+
+MAGIC = "WBCAP001"
+
+FIRST = 1
+NEXT = 2
+TIMEOUT = 3
+
+_HEADER = struct.Struct("!IBxHIIQ")
+
+
+class Record(object):
+    """ The bytes received by wb from a response
+
+    Arguments:
+        - kind: an integer, FIRST, NEXT or TIMEOUT
+        - status: an integer, the response code, 0 if it's unknown
+        - pkt_seq: an integer, the sequence number of the packet
+            in the packets file, 0 if there is no '-F'
+        - connection: an integer, the index of the connection of wb
+        - time: an integer, microseconds since the start of test
+        - data: a string, the received bytes
+
+    Attributes:
+        the same as Arguments
+    """
+    __slots__ = ["kind", "status", "pkt_seq", "connection", "time", "data"]
+
+    def __init__(self, kind, status, pkt_seq, connection, time, data):
+        """ Create a record
+        """
+        self.kind = kind
+        self.status = status
+        self.pkt_seq = pkt_seq
+        self.connection = connection
+        self.time = time
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+
+def read_records(file_):
+    """ Stream the records of a binary output file of wb
+
+    Arguments:
+        - file_: a string, the path of the file
+
+    Return a generator of Record, a truncated record at the end
+        of file, e.g. wb was killed, is ignored
+    """
+    with open(file_, "rb") as fd:
+        if fd.read(len(MAGIC)) != MAGIC:
+            raise ValueError(file_ + " isn't a binary output file of wb")
+        while True:
+            header = fd.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, kind, status, pkt_seq, connection, time_ = \
+                _HEADER.unpack(header)
+            data = fd.read(length)
+            if len(data) < length:
+                return
+            yield Record(kind, status, pkt_seq, connection, time_, data)
+
+
+def read_responses(msg_file):
+    """ Stream the responses of the output file of wb,
+        the records of a response are joined into a Record of FIRST,
+        a response is generated once the next response of
+        its connection starts or the file ends
+
+    Arguments:
+        - msg_file: a string, the path of '-o', its rotated segment
+            '<msg_file>.1' is read before it if it exists
+
+    Return a generator of Record, a Record of TIMEOUT for a response
+        that timed out
+    """
+    responses = {}  # the receiving response of each connection
+    for file_ in [msg_file + ".1", msg_file]:
+        if file_ != msg_file and not os.path.exists(file_):
+            continue
+        for record in read_records(file_):
+            response = responses.get(record.connection)
+            if record.kind == NEXT and response is not None:
+                response.data += record.data
+                response.status = response.status or record.status
+                continue
+            if response is not None:
+                yield response
+            responses[record.connection] = record
+    for connection in sorted(responses):
+        yield responses[connection]
+
+
+def execute(arguments):
+    """ Print a line per response of the output file of wb,
+        '<seconds> <pkt_seq> <status> <bytes>', and the number of
+        responses of each status
+
+    Arguments:
+        - arguments: a list, the output file of wb
+    """
+    if len(arguments) != 1:
+        sys.stderr.write(__doc__.split("Usage: ")[-1])
+        return 1
+    statuses = collections.Counter()
+    for response in read_responses(arguments[0]):
+        status = "timeout" if response.kind == TIMEOUT else response.status
+        statuses[status] += 1
+        print("%.6f %d %s %d" % (
+            response.time / 1000000.0, response.pkt_seq, status,
+            len(response)))
+    for status, count in sorted(statuses.items()):
+        sys.stderr.write("%s: %d\n" % (status, count))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(execute(sys.argv[1:]))
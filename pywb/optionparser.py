@@ -6,6 +6,8 @@
 """ Option parser
 
 This exports:
+    - ACCEPTABLE_WB_OPTIONS is a string, the options of wb in
+        the format of getopt, a letter followed by ':' needs an argument.
     - parse is a function that parses all options and
         delegate them to those enhance parsers.
     - OptionParser is a class, it's an abstract class
@@ -17,6 +19,7 @@ Option parser of pywb to improve or modify the action which
 """
 
 __all__ = [
+    "ACCEPTABLE_WB_OPTIONS",
     "parse",
     "OptionParser",
 ]
@@ -27,6 +30,11 @@ import abc
 
 import pywbutil
 
+ACCEPTABLE_WB_OPTIONS = "n:c:t:s:b:T:p:u:v:lrkVhwiIx:"\
+                        "y:z:C:H:P:A:g:X:de:SqB:m:Z:f:"\
+                        "Y:a:o:F:j:J:O:R:D:U:Y:W:E:G:Q:L:M:N:"\
+                        "K012:3456:78:9:"
+
 
 def parse(options, enhance_options):
     """ Parse all options and delegate them to those enhance parsers
@@ -37,10 +45,7 @@ def parse(options, enhance_options):
             the value is option parser of processing arguments
     """
 
-    acceptable_wb_options = "n:c:t:s:b:T:p:u:v:lrkVhwiIx:"\
-                            "y:z:C:H:P:A:g:X:de:SqB:m:Z:f:"\
-                            "Y:a:o:F:j:J:O:R:D:U:Y:W:E:G:Q:"\
-                            "K012:3456789"
+    acceptable_wb_options = ACCEPTABLE_WB_OPTIONS
     # Anonymous_options are those options without prefix dash.
     # They were not defined at acceptable_wb_option.
     # e.g. destination hostname
@@ -119,3 +124,9 @@ class OptionParser(object):
         Return is a string of help document for option bound by this instance
         """
         return " "
+
+    def clean(self):
+        """ Clean up the resources of this action after wb exits,
+            e.g. temporary files created by dump
+        """
+        pass
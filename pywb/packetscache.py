@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Cache of compiled packets
+
+This exports:
+    - PacketsCache is a class that saves the packets compiled from
+        a source file, so that an unchanged source file needn't
+        be compiled again.
+
+The packets are keyed by the content hash of their source file.
+An index entry per source path remembers the mtime, size and hash
+of the file, so the hash is only recomputed when mtime or size changed.
+"""
+
+__all__ = ["PacketsCache"]
+
+import os
+import sys
+import json
+import errno
+import hashlib
+
+CACHE_VERSION = 3  # bump it when the way to compile packets is changed
+DEFAULT_CACHE_DIR = os.path.join("~", ".pywb", "cache")
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024  # bytes
+# The eviction leaves the cache at this ratio of max_size, so that the packets
+#   put after it don't scan the cache again until they fill the room
+EVICTION_RATIO = 0.9
+
+
+def _makedirs(path_):
+    try:
+        os.makedirs(path_)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+
+
+class PacketsCache(object):
+    """ Save the packets compiled from source files
+
+    Arguments:
+        - cache_dir: a string, the directory to save the cache
+            (default = ~/.pywb/cache)
+        - max_size: an integer, the max bytes of packets kept in the cache.
+            The least recently used packets will be evicted once
+            the cache exceeds it, down to EVICTION_RATIO of it
+            (default = 512MB)
+
+    Attributes:
+        - cache_dir: a string, the absolute path of the cache directory
+        - max_size: an integer, the max bytes of packets
+        - _digests: a dict, the content hash of the source files
+            computed by this instance, key is the path of source file
+        - _size: an integer, the bytes of packets in the cache found by
+            the last scan plus the bytes put since, None before
+            the first scan
+    """
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        """ Create a packets cache
+        """
+        if not cache_dir:
+            cache_dir = DEFAULT_CACHE_DIR
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = max_size
+        self._index_dir = os.path.join(self.cache_dir, "index")
+        self._packets_dir = os.path.join(self.cache_dir, "packets")
+        self._digests = {}
+        self._size = None
+
+    def get(self, source):
+        """ Get the packets compiled from source
+
+        Arguments:
+            - source: a string, the path of source file
+
+        Return a list of (packet, test title, expected output),
+            or None if they weren't cached or the source file
+            has been changed
+        """
+        source = os.path.abspath(os.path.expanduser(source))
+        try:
+            digest = self._lookup(source)
+            if digest is None:
+                return None
+            packets_file = self._packets_path(digest)
+            packets = self._read_packets(packets_file)
+            # refresh the mtime of packets for LRU eviction
+            os.utime(packets_file, None)
+            return packets
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def contains(self, source):
+        """ Return True if the packets compiled from source are cached
+            and the source file hasn't been changed, the packets
+            aren't read
+
+        Arguments:
+            - source: a string, the path of source file
+        """
+        source = os.path.abspath(os.path.expanduser(source))
+        try:
+            digest = self._lookup(source)
+            return digest is not None \
+                and os.path.exists(self._packets_path(digest))
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+
+    def _lookup(self, source):
+        """ The content hash of source by its index entry,
+            None if the source file has been changed
+        """
+        stat_ = os.stat(source)
+        entry = self._read_index(source)
+        if entry and entry["mtime"] == stat_.st_mtime \
+                and entry["size"] == stat_.st_size:
+            digest = entry["digest"]
+        else:
+            digest = self._digest(source)
+            if not entry or entry["digest"] != digest:
+                return None
+            self._write_index(source, stat_, digest)
+        self._digests[source] = digest
+        return digest
+
+    def put(self, source, packets):
+        """ Save the packets compiled from source
+
+        Arguments:
+            - source: a string, the path of source file
+            - packets: a list of packets compiled from source,
+                their TEST_TITLE and EXPECTED_OUTPUT are saved
+                with them if they have them
+        """
+        source = os.path.abspath(os.path.expanduser(source))
+        try:
+            stat_ = os.stat(source)
+            digest = self._digests.get(source)
+            if digest is None:
+                digest = self._digest(source)
+            _makedirs(self._packets_dir)
+            size = self._write_packets(self._packets_path(digest), packets)
+            self._write_index(source, stat_, digest)
+            self._digests[source] = digest
+            self._account(size)
+        except (IOError, OSError) as error:
+            sys.stderr.write(
+                "Cannot cache packets of %s: %s\n" % (source, error))
+
+    def _digest(self, source):
+        """ Content hash of source file """
+        hash_ = hashlib.sha1("%d\0" % (CACHE_VERSION, ))
+        with open(source, "rb") as fd:
+            while True:
+                bytes_ = fd.read(1024 * 1024)
+                if not bytes_:
+                    break
+                hash_.update(bytes_)
+        return hash_.hexdigest()
+
+    def _index_path(self, source):
+        name = hashlib.sha1(source).hexdigest()
+        return os.path.join(self._index_dir, name + ".json")
+
+    def _packets_path(self, digest):
+        return os.path.join(self._packets_dir, digest + ".pkt")
+
+    def _read_index(self, source):
+        index_file = self._index_path(source)
+        if not os.path.exists(index_file):
+            return None
+        with open(index_file, "r") as fd:
+            entry = json.load(fd)
+        if entry.get("path") != source:
+            return None
+        return entry
+
+    def _write_index(self, source, stat_, digest):
+        _makedirs(self._index_dir)
+        entry = {
+            "path": source,
+            "mtime": stat_.st_mtime,
+            "size": stat_.st_size,
+            "digest": digest,
+        }
+        self._write_atomically(
+            self._index_path(source), json.dumps(entry))
+
+    @staticmethod
+    def _read_packets(packets_file):
+        """ Packets are saved as a list of '<length>[ <JSON>]\\n<packet>',
+            the JSON is [test title, expected output]
+        """
+        packets = []
+        with open(packets_file, "rb") as fd:
+            data = fd.read()
+        position = 0
+        while position < len(data):
+            line_end = data.index("\n", position)
+            length, _, metadata = \
+                data[position:line_end].partition(" ")
+            length = int(length)
+            test_title, expected_output = \
+                json.loads(metadata) if metadata else (None, None)
+            position = line_end + 1
+            if position + length > len(data):
+                raise ValueError("%s is truncated" % (packets_file, ))
+            packets.append((
+                data[position:position + length],
+                test_title, expected_output))
+            position += length
+        return packets
+
+    def _write_packets(self, packets_file, packets):
+        chunks = []
+        for packet in packets:
+            metadata = [
+                getattr(packet, "TEST_TITLE", None),
+                getattr(packet, "EXPECTED_OUTPUT", None)]
+            packet = str(packet)
+            if any(metadata):
+                chunks.append("%d %s\n" % (len(packet), json.dumps(metadata)))
+            else:
+                chunks.append("%d\n" % (len(packet), ))
+            chunks.append(packet)
+        data = "".join(chunks)
+        self._write_atomically(packets_file, data)
+        return len(data)
+
+    @staticmethod
+    def _write_atomically(file_, data):
+        """ Write into a temporary file then rename it,
+            so that concurrent pywb never read a partial file
+        """
+        temp_file = "%s.%d.tmp" % (file_, os.getpid())
+        with open(temp_file, "wb") as fd:
+            fd.write(data)
+        os.rename(temp_file, file_)
+
+    def _account(self, size):
+        """ Count the bytes of packets put, the cache is only scanned
+            by _evict the first time and once it may exceed max_size,
+            so putting packets of many files doesn't stat all of them
+            each time. The packets put again or by other pywb are
+            found by the scan
+        """
+        if self.max_size is None:
+            return
+        if self._size is not None and self._size + size <= self.max_size:
+            self._size += size
+            return
+        self._evict()
+
+    def _evict(self):
+        """ Remove the least recently used packets if the cache exceeds
+            max_size, until it doesn't exceed EVICTION_RATIO of max_size
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        total_size = 0
+        for file_ in os.listdir(self._packets_dir):
+            if not file_.endswith(".pkt"):
+                continue
+            file_ = os.path.join(self._packets_dir, file_)
+            try:
+                stat_ = os.stat(file_)
+            except OSError:
+                continue
+            entries.append((stat_.st_mtime, stat_.st_size, file_))
+            total_size += stat_.st_size
+        entries.sort()
+        if total_size > self.max_size:
+            for _, size, file_ in entries:
+                if total_size <= self.max_size * EVICTION_RATIO:
+                    break
+                try:
+                    os.remove(file_)
+                except OSError:
+                    continue
+                total_size -= size
+        self._size = total_size
@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Extract timed HTTP requests from packet captures
+
+This exports:
+    - load_packets_from_pcap_files is a function that loads
+        the HTTP requests sent by clients in .pcap files as TimedPackets.
+    - execute is a function that converts .pcap files into
+        a timed .pkt file.
+
+The captures are in the libpcap format (not pcapng) of Ethernet,
+Linux cooked, loopback or raw IP links. The TCP streams from clients
+to servers are reassembled by their sequence numbers, then split into
+requests by their headers, Content-Length and chunked bodies.
+The time to send of a request is the time of the segment carrying its
+first byte, relative to the first request of all of captures.
+
+Usage: ./packetscapture.py pcap_files... pkt_file
+"""
+
+__all__ = [
+    "load_packets_from_pcap_files",
+    "execute",
+]
+
+import re
+import sys
+import bisect
+import socket
+import struct
+import collections
+
+import pywbutil
+import packetsdumper
+
+_PCAP_MAGICS = {
+    # magic: units of a second of the timestamp
+    0xa1b2c3d4: 1000000,
+    0xa1b23c4d: 1000000000,
+}
+_PCAPNG_MAGIC = 0x0a0d0d0a
+
+_LINKTYPE_NULL = 0
+_LINKTYPE_ETHERNET = 1
+_LINKTYPE_RAW = (12, 14, 101)
+_LINKTYPE_LINUX_SLL = 113
+_LINKTYPE_LINUX_SLL2 = 276
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86dd
+_ETHERTYPE_VLANS = (0x8100, 0x88a8, 0x9100)
+_IPPROTO_TCP = 6
+
+_TCP_SYN = 0x02
+_TCP_ACK = 0x10
+
+_REQUEST_LINE = re.compile(r"[A-Z]+ \S+ HTTP/\d")
+_HEADER_END = re.compile(r"\r?\n\r?\n")
+_CONTENT_LENGTH = re.compile(r"^Content-Length:[ \t]*(\d+)", re.I | re.M)
+_CHUNKED = re.compile(r"^Transfer-Encoding:[ \t]*.*chunked", re.I | re.M)
+_CHUNK_SIZE = re.compile(r"([0-9a-fA-F]+)[^\r\n]*\r?\n")
+_EMPTY_LINES = re.compile(r"[\r\n]*")
+
+
+def _read_pcap(file_):
+    """ Generate (microseconds, link type, frame) of a pcap file """
+    with open(file_, "rb") as fd:
+        header = fd.read(24)
+        if len(header) < 24:
+            return
+        for byte_order in ["<", ">"]:
+            magic, = struct.unpack(byte_order + "I", header[:4])
+            if magic in _PCAP_MAGICS:
+                break
+            if magic == _PCAPNG_MAGIC:
+                raise ValueError(
+                    file_ + " is pcapng, convert it by "
+                    "'editcap -F pcap' first")
+        else:
+            raise ValueError(file_ + " is not a pcap file")
+        units = _PCAP_MAGICS[magic]
+        link_type, = struct.unpack(byte_order + "I", header[20:24])
+        record = struct.Struct(byte_order + "IIII")
+        while True:
+            record_header = fd.read(record.size)
+            if len(record_header) < record.size:
+                return
+            seconds, fraction, captured_length, _ = \
+                record.unpack(record_header)
+            frame = fd.read(captured_length)
+            if len(frame) < captured_length:
+                return
+            yield (seconds * 1000000 + fraction * 1000000 // units,
+                   link_type, frame)
+
+
+def _link_payload(link_type, frame):
+    """ Return (ethertype, IP packet) of a frame or None """
+    if link_type == _LINKTYPE_ETHERNET:
+        position = 12
+        ethertype, = struct.unpack_from("!H", frame, position)
+        while ethertype in _ETHERTYPE_VLANS and len(frame) >= position + 6:
+            position += 4
+            ethertype, = struct.unpack_from("!H", frame, position)
+        return ethertype, frame[position + 2:]
+    if link_type == _LINKTYPE_LINUX_SLL:
+        return struct.unpack_from("!H", frame, 14)[0], frame[16:]
+    if link_type == _LINKTYPE_LINUX_SLL2:
+        return struct.unpack_from("!H", frame, 0)[0], frame[20:]
+    if link_type == _LINKTYPE_NULL:
+        # the address family is in the byte order of the capturing host
+        family = struct.unpack_from("<I", frame)[0]
+        if family > 0xffff:
+            family = struct.unpack_from(">I", frame)[0]
+        if family == socket.AF_INET:
+            return _ETHERTYPE_IPV4, frame[4:]
+        return _ETHERTYPE_IPV6, frame[4:]
+    if link_type in _LINKTYPE_RAW:
+        version = ord(frame[0]) >> 4 if frame else 0
+        if version == 4:
+            return _ETHERTYPE_IPV4, frame
+        return _ETHERTYPE_IPV6, frame
+    raise ValueError("unsupported link type %d of pcap" % (link_type, ))
+
+
+def _tcp_segment(ethertype, packet):
+    """ Return (source, destination, TCP segment) of an IP packet or None,
+        the fragments and extension headers of IPv6 are ignored
+    """
+    if ethertype == _ETHERTYPE_IPV4 and len(packet) >= 20:
+        header_length = (ord(packet[0]) & 0x0f) * 4
+        total_length, flags_offset, _, protocol = \
+            struct.unpack_from("!2xHxxHBB", packet)
+        if protocol != _IPPROTO_TCP or flags_offset & 0x3fff:
+            return None
+        return (socket.inet_ntoa(packet[12:16]),
+                socket.inet_ntoa(packet[16:20]),
+                packet[header_length:total_length])
+    if ethertype == _ETHERTYPE_IPV6 and len(packet) >= 40:
+        payload_length, next_header = struct.unpack_from("!4xHB", packet)
+        if next_header != _IPPROTO_TCP:
+            return None
+        return (socket.inet_ntop(socket.AF_INET6, packet[8:24]),
+                socket.inet_ntop(socket.AF_INET6, packet[24:40]),
+                packet[40:40 + payload_length])
+    return None
+
+
+class _Stream(object):
+    """ The segments sent from a side of a TCP connection
+
+    Attributes:
+        - from_client: a bool, True if it's sent by the side that sent SYN,
+            None if the handshake wasn't captured
+        - segments: a list of (sequence number, time, payload)
+    """
+    def __init__(self):
+        self.from_client = None
+        self.first_sequence = None
+        self.segments = []
+
+    def add(self, sequence, time_, flags, payload):
+        if flags & _TCP_SYN:
+            self.from_client = not flags & _TCP_ACK
+            self.first_sequence = (sequence + 1) & 0xffffffff
+        if not payload:
+            return
+        if self.first_sequence is None:
+            self.first_sequence = sequence
+        self.segments.append((sequence, time_, payload))
+
+    def reassemble(self):
+        """ Return (data, offsets, times), the segments are ordered by
+            their sequence numbers and the retransmitted bytes are dropped,
+            the segment at offsets[i] of data was captured at times[i]
+        """
+        segments = sorted(
+            ((sequence - self.first_sequence) & 0xffffffff, time_, payload)
+            for sequence, time_, payload in self.segments)
+        chunks = []
+        offsets = []
+        times = []
+        size = 0
+        for position, time_, payload in segments:
+            if position + len(payload) <= size:
+                continue  # retransmitted
+            if position < size:
+                payload = payload[size - position:]
+            offsets.append(size)
+            times.append(time_)
+            chunks.append(payload)
+            size += len(payload)
+        return "".join(chunks), offsets, times
+
+
+def _request_end(data, position):
+    """ Return the end of the request at position,
+        or the end of data if the request is truncated
+    """
+    header_end = _HEADER_END.search(data, position)
+    if not header_end:
+        return len(data)
+    header = data[position:header_end.start()]
+    end = header_end.end()
+    if _CHUNKED.search(header):
+        while True:
+            chunk = _CHUNK_SIZE.match(data, end)
+            if not chunk:
+                return len(data)
+            chunk_size = int(chunk.group(1), 16)
+            end = chunk.end()
+            if chunk_size == 0:
+                # the trailers end with an empty line
+                trailers_end = _HEADER_END.search(data, end - 2)
+                return trailers_end.end() if trailers_end else len(data)
+            end += chunk_size + 2  # the CRLF after the chunk
+    content_length = _CONTENT_LENGTH.search(header)
+    if content_length:
+        end += int(content_length.group(1))
+    return min(end, len(data))
+
+
+def _split_requests(data, offsets, times):
+    """ Generate (time, request) of a reassembled stream """
+    position = _EMPTY_LINES.match(data).end()
+    while position < len(data):
+        end = _request_end(data, position)
+        segment = bisect.bisect_right(offsets, position) - 1
+        yield times[segment], data[position:end]
+        position = _EMPTY_LINES.match(data, end).end()
+
+
+@pywbutil.accept_iterable
+def load_packets_from_pcap_files(files):
+    """ Load the HTTP requests sent by clients in pcap files
+
+    Arguments:
+        - files: a list of the paths of pcap files
+
+    Return a list of TimedPackets ordered by their time to send
+    """
+    streams = collections.OrderedDict()
+    for file_ in files:
+        for time_, link_type, frame in _read_pcap(file_):
+            try:
+                link = _link_payload(link_type, frame)
+                segment = link and _tcp_segment(*link)
+            except (struct.error, IndexError, socket.error):
+                continue  # truncated by the snapshot length
+            if not segment or len(segment[2]) < 20:
+                continue
+            source, destination, tcp = segment
+            source_port, destination_port, sequence, _, offset, flags = \
+                struct.unpack_from("!HHIIBB", tcp)
+            key = (source, source_port, destination, destination_port)
+            stream = streams.get(key)
+            if stream is None:
+                stream = streams[key] = _Stream()
+            stream.add(sequence, time_, flags, tcp[(offset >> 4) * 4:])
+
+    requests = []
+    for stream in streams.values():
+        if not stream.segments or stream.from_client is False:
+            continue
+        data, offsets, times = stream.reassemble()
+        if stream.from_client is None and not _REQUEST_LINE.match(data):
+            continue  # the responses of a connection without handshake
+        requests.extend(_split_requests(data, offsets, times))
+    if not requests:
+        return []
+    requests.sort(key=lambda request: request[0])
+    start_time = requests[0][0]
+    return [
+        pywbutil.TimedPacket(request, time_ - start_time)
+        for time_, request in requests]
+
+
+def execute(arguments):
+    """ Convert pcap files into a timed .pkt file with its index
+
+    Arguments:
+        - arguments: a list, the pcap files and then the pkt file
+    """
+    if len(arguments) < 2:
+        sys.stderr.write(__doc__.split("Usage: ")[-1])
+        return 1
+    packets = load_packets_from_pcap_files(arguments[:-1])
+    with packetsdumper.PacketsDumper(arguments[-1], index=True) as dumper:
+        dumper.dump(packets)
+    if packets:
+        print("%d requests in %.6f seconds" % (
+            len(packets), packets[-1].time_to_send / 1000000.0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(execute(sys.argv[1:]))
@@ -7,11 +7,26 @@
 
 This exports:
     - PacketsDumper is a class to dump packets into a file
+
+The packets are separated by '\\0', unless the first packet is
+a TimedPacket, then each packet is led by a line of '<size> <sec>.<usec>',
+so that wb replays them at their time to send.
+If it's asked, the rules the packets come from are written beside the file,
+see packetstats.write_rules.
+If the packets are deduplicated, the same bytes are written only once, and
+their copies are the entries of the index pointing at them, in the order
+and the number of times they were dumped, so the packets file is complete
+only with its index.
 """
 
 __all__ = ["PacketsDumper"]
 
 import sys
+import hashlib
+
+import pywbutil
+import packetsindex
+import packetstats
 
 
 class PacketsDumper(object):
@@ -19,6 +34,16 @@ class PacketsDumper(object):
 
     Arguments:
         file_name: A path to save the packets(default = None).
+        index: A flag, if it's True, a PacketsIndex of the packets is
+            written beside the file when the dumper is closed,
+            it needs a file name(default = False).
+        rules: A flag, if it's True, the rules and the expected outputs
+            of the packets from FTW are written beside the file
+            when the dumper is closed,
+            it needs a file name(default = False).
+        dedup: A flag, if it's True, a packet whose bytes have been
+            dumped isn't written again, it's an entry of the index
+            pointing at the bytes, it needs index(default = False).
 
     Attributes:
         file_name: A path to save the packets.
@@ -28,10 +53,36 @@ class PacketsDumper(object):
             if file name was None, file_fd is stdout.
 
         _is_empty: A flag means the file for saving packets is empty
+
+        _timed: A flag means the packets are led by their time to send,
+            it's decided by the first packet.
+
+        _time_to_send: The time to send of the last dumped packet,
+            a packet without time is sent at the same time.
+
+        _offset: The bytes that have been written into the file.
+
+        _index_entries: A list of (offset, length, time_to_send)
+            of dumped packets, it is None if index wasn't set.
+
+        _rules: A list of (original file, test title, expected output)
+            of dumped packets,
+            None for a packet without them,
+            it is None if rules wasn't set.
+
+        _offsets: A dict, the key is (length, SHA-1) of dumped bytes
+            and the value is their offset,
+            it is None if dedup wasn't set.
     """
-    def __init__(self, file_name=None):
+    def __init__(self, file_name=None, index=False, rules=False, dedup=False):
         """ Create a packets dumper
         """
+        if index and not file_name:
+            raise ValueError("index needs a file name")
+        if dedup and not index:
+            raise ValueError("dedup needs an index")
+        if rules and not file_name:
+            raise ValueError("rules needs a file name")
         if file_name:
             self.file_name = file_name
             self._file_fd = open(self.file_name, 'wb')
@@ -39,6 +90,12 @@ class PacketsDumper(object):
             self._file_fd = sys.stdout
 
         self._is_empty = True
+        self._timed = False
+        self._time_to_send = 0
+        self._offset = 0
+        self._index_entries = [] if index else None
+        self._rules = [] if rules else None
+        self._offsets = {} if dedup else None
 
     def dump(self, packets):
         """ dump packets into the file
@@ -48,9 +105,43 @@ class PacketsDumper(object):
         for packet in packets:
             if not packet:
                 continue
-            if not self._is_empty:
+            if self._rules is not None:
+                original_file = getattr(packet, "ORIGINAL_FILE", None)
+                self._rules.append(original_file and (
+                    original_file, getattr(packet, "TEST_TITLE", None),
+                    getattr(packet, "EXPECTED_OUTPUT", None)))
+            if isinstance(packet, pywbutil.TimedPacket):
+                self._time_to_send = packet.time_to_send
+                self._timed = self._timed or self._is_empty
+                packet = packet.data
+            # a buffer is a view of loaded packets, write it without copy
+            if not isinstance(packet, buffer):
+                packet = str(packet)
+            if self._offsets is not None:
+                key = (len(packet), hashlib.sha1(packet).digest())
+                if key in self._offsets:
+                    self._index_entries.append(
+                        (self._offsets[key], len(packet), self._time_to_send))
+                    continue
+            if self._timed:
+                header = "%d %d.%06d\n" % (
+                    len(packet), self._time_to_send // 1000000,
+                    self._time_to_send % 1000000)
+                self._file_fd.write(header)
+                self._offset += len(header)
+            elif not self._is_empty:
                 self._file_fd.write("\0")
-            self._file_fd.write(str(packet))
+                self._offset += 1
+            if self._offsets is not None:
+                self._offsets[key] = self._offset
+            self._file_fd.write(packet)
+            if self._index_entries is not None:
+                self._index_entries.append(
+                    (self._offset, len(packet), self._time_to_send))
+            self._offset += len(packet)
+            if self._timed:
+                self._file_fd.write("\n")
+                self._offset += 1
             self._is_empty = False
 
     def __enter__(self):
@@ -59,3 +150,10 @@ class PacketsDumper(object):
     def __exit__(self, *_):
         if self._file_fd != sys.stdout:
             self._file_fd.close()
+        # the index is written after the packets,
+        # so that it's never older than the packets file
+        if self._index_entries is not None:
+            packetsindex.PacketsIndex.write(
+                self.file_name, self._index_entries, self._offset)
+        if self._rules is not None and any(self._rules):
+            packetstats.write_rules(self.file_name, self._rules)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Index of packets file
+
+This exports:
+    - INDEX_SUFFIX: is a string, the suffix appended to the path of
+        a packets file to get the path of its index file.
+    - PacketsIndex is a class that gives the count, the position and
+        the time to send of the packets in a packets file without
+        scanning it.
+
+An index file is a sidecar of a .pkt file, e.g. 'packets.pkt.idx'.
+All of integers are little endian, it's made up of
+    - a header: '<magic:8s><version:u32><reserved:u32><count:u64><size:u64>',
+        size is the bytes of the packets file when it was indexed.
+    - a table of count entries: '<offset:u64><length:u64><time_to_send:u64>',
+        time_to_send is in microseconds.
+An index file older than its packets file or with a different size
+is stale and ignored. wb reads the same index file.
+"""
+
+__all__ = [
+    "INDEX_SUFFIX",
+    "PacketsIndex",
+]
+
+import os
+import mmap
+import struct
+
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = "WBPKTIDX"
+INDEX_VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQQ")
+_ENTRY = struct.Struct("<QQQ")
+
+
+def _index_path(packets_file):
+    return packets_file + INDEX_SUFFIX
+
+
+class PacketsIndex(object):
+    """ A read-only table of (offset, length, time_to_send) of packets,
+        it supports len(), iteration, indexing and slicing in O(1).
+
+    Arguments:
+        - data: a string or a mmap of the index file
+        - count: an integer, the number of packets
+        - data_size: an integer, the bytes of the packets file
+
+    Attributes:
+        - data_size: an integer, the bytes of the packets file
+    """
+    def __init__(self, data, count, data_size):
+        """ Create a packets index, use PacketsIndex.load instead
+        """
+        self._data = data
+        self._count = count
+        self.data_size = data_size
+
+    @classmethod
+    def load(cls, packets_file):
+        """ Load the index of packets file
+
+        Arguments:
+            - packets_file: a string, the path of packets file
+
+        Return a PacketsIndex, or None if the index file doesn't exist,
+            is invalid or is stale
+        """
+        index_file = _index_path(packets_file)
+        try:
+            packets_stat = os.stat(packets_file)
+            index_stat = os.stat(index_file)
+            if index_stat.st_mtime < packets_stat.st_mtime \
+                    or index_stat.st_size < _HEADER.size:
+                return None
+            with open(index_file, "rb") as fd:
+                data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        magic, version, _, count, data_size = _HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION \
+                or data_size != packets_stat.st_size \
+                or len(data) < _HEADER.size + count * _ENTRY.size:
+            return None
+        return cls(data, count, data_size)
+
+    @staticmethod
+    def write(packets_file, entries, data_size):
+        """ Write the index of packets file
+
+        Arguments:
+            - packets_file: a string, the path of packets file
+            - entries: a list of (offset, length, time_to_send) of packets
+            - data_size: an integer, the bytes of the packets file
+        """
+        chunks = [_HEADER.pack(
+            INDEX_MAGIC, INDEX_VERSION, 0, len(entries), data_size)]
+        for entry in entries:
+            chunks.append(_ENTRY.pack(*entry))
+        with open(_index_path(packets_file), "wb") as fd:
+            fd.write("".join(chunks))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in xrange(*key.indices(self._count))]
+        if key < 0:
+            key += self._count
+        if key < 0 or key >= self._count:
+            raise IndexError("packet index out of range")
+        return _ENTRY.unpack_from(
+            self._data, _HEADER.size + key * _ENTRY.size)
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self[i]
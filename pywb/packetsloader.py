@@ -9,78 +9,280 @@ This exports:
     - LOADERS: is a dict, the key is file extension of supported files
         of loader. the value is the load function that create
         a packets generator from file.
+    - SAMPLES: is a list of the ways to sample the packets
+        when their number is limited.
+    - walk_paths: is a function that generates the supported files
+        in a set of paths.
     - load_packets_from_paths: is a function that load a set of paths
         that include .pkt or .yaml files to a packets generator.
+        The packets compiled from .yaml files can be reused
+        by a PacketsCache.
 
-Load packets saved in files(.yaml, .pkt) or strings into a packets generator
+Load packets saved in files(.yaml, .pkt, .pcap) or strings into a packets generator.
+The .pkt files may separate packets by '\\0' or lead each packet by a line
+of '<size> <sec>.<usec>'. If a .pkt file has a PacketsIndex beside it,
+its packets are located by the index instead of scanning the file.
+If the number of packets is limited, the files are loaded on demand and
+no file is loaded once there are enough packets, so that a short run
+doesn't wait for the whole corpus to be compiled.
 """
 
 __all__ = [
     "LOADERS",
+    "SAMPLES",
+    "walk_paths",
     "load_packets_from_paths",
 ]
 
 import os
-import io
+import re
 import sys
+import mmap
+import random
 import functools
-
-import ftw
-import yaml
+import itertools
+import collections
 
 import pywbutil
 import ftwhelper
+import packetsindex
+import packetscapture
 
 
-@pywbutil.accept_iterable
-@pywbutil.expand_nest_generator
 def _load_packets_from_yaml_files(files):
-    yield ftwhelper.get(files, ftwhelper.FTW_TYPE.PACKETS)
+    return ftwhelper.get(files, ftwhelper.FTW_TYPE.PACKETS)
+
+
+# The leading line of each packet in the sized .pkt format,
+# '<size> <sec>.<usec>', the time to send is optional
+_SIZED_PACKET_HEADER = re.compile(
+    r"\s*(\d+)[ \t]*(?:(\d+)\.(\d+))?[^\r\n]*[\r\n]\s*")
+# The end of the sized packets, the spaces after the last packet
+_SIZED_PACKETS_END = re.compile(r"\s*\Z")
+
+
+# The separator of packets in the raw .pkt format,
+# a regex searches a mmap faster than mmap.find
+_RAW_PACKET_DELIMITER = re.compile("\0")
+
+
+def _scan_raw_packets(data):
+    """ Generate (offset, length) of the packets separated by '\\0' """
+    position = 0
+    size = len(data)
+    while position < size:
+        delimiter = _RAW_PACKET_DELIMITER.search(data, position)
+        delimit_pos = delimiter.start() if delimiter else size
+        if delimit_pos > position:
+            yield position, delimit_pos - position
+        position = delimit_pos + 1
+
+
+def _scan_sized_packets(data):
+    """ Generate (offset, length, time_to_send) of the packets
+        with a leading line '<size> <sec>.<usec>',
+        time_to_send is in microseconds.
+        This is the same format as parse_pktfile of wb accepts,
+        a packet of size 0 ends the packets.
+        Raise ValueError if a header is malformed, instead of dropping
+        the packets after it.
+    """
+    position = 0
+    size = len(data)
+    while position < size:
+        header = _SIZED_PACKET_HEADER.match(data, position)
+        if not header:
+            if _SIZED_PACKETS_END.match(data, position):
+                break
+            raise ValueError(
+                "packet at %d has no header '<size> <sec>.<usec>'"
+                % (position, ))
+        length = int(header.group(1))
+        if length <= 0:
+            break
+        time_to_send = 0
+        if header.group(2) is not None:
+            time_to_send = int(header.group(2)) * 1000000 \
+                + int(header.group(3))
+        position = header.end()
+        if position + length > size:
+            raise ValueError(
+                "packet at %d needs %d bytes body" % (position, length))
+        yield position, length, time_to_send
+        position += length
+
+
+def _map_file(file_):
+    """ Map the file into memory, the mapping will be released
+        when there is no view of it.
+        Return None if file is empty.
+    """
+    with open(file_, "rb") as fd:
+        if not os.path.isfile(file_):  # pipe or FIFO cannot be mapped
+            return fd.read() or None
+        try:
+            return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return None
 
 
 @pywbutil.accept_iterable
-@pywbutil.expand_nest_generator
 def _load_packets_from_pkt_files(files):
-    buffer_ = ""
+    """ The packets are zero-copy views of the memory-mapped files,
+        the packets of '<size> <sec>.<usec>' format are TimedPackets
+    """
     for file_ in files:
         file_ = os.path.abspath(os.path.expanduser(file_))
-        with open(file_, "rb", io.DEFAULT_BUFFER_SIZE) as fd:
-            while True:
-                bytes_ = fd.read(io.DEFAULT_BUFFER_SIZE)
-                if not bytes_:
-                    if buffer_:
-                        yield buffer_
-                    break
-                while bytes_:
-                    delimit_pos = bytes_.find('\0')
-                    if delimit_pos == -1:
-                        buffer_ += bytes_
-                        bytes_ = None
-                    else:
-                        buffer_ += bytes_[:delimit_pos]
-                        if buffer_:
-                            yield buffer_
-                        buffer_ = ""
-                        bytes_ = bytes_[delimit_pos + 1:]
+        data = _map_file(file_)
+        if not data:
+            continue
+        index = packetsindex.PacketsIndex.load(file_)
+        if index is not None and data[0].isdigit():
+            for offset, length, time_to_send in index:
+                yield pywbutil.TimedPacket(
+                    buffer(data, offset, length), time_to_send)
+        elif index is not None:
+            for offset, length, _ in index:
+                yield buffer(data, offset, length)
+        elif data[0].isdigit():
+            try:
+                for offset, length, time_to_send in \
+                        _scan_sized_packets(data):
+                    yield pywbutil.TimedPacket(
+                        buffer(data, offset, length), time_to_send)
+            except ValueError as error:
+                raise ValueError("%s: %s" % (file_, error))
+        else:
+            for offset, length in _scan_raw_packets(data):
+                yield buffer(data, offset, length)
 
 
 LOADERS = {
     ".yaml": _load_packets_from_yaml_files,
     ".pkt": _load_packets_from_pkt_files,
+    ".pcap": packetscapture.load_packets_from_pcap_files,
 }
 
+# Loaders whose packets are compiled and worth being cached
+CACHEABLE_LOADERS = [
+    ".yaml",
+]
 
-@pywbutil.accept_iterable
-@pywbutil.expand_nest_generator
-def load_packets_from_paths(paths):
-    """ Load a set of paths that
-        include .pkt or .yaml files to a packets generator.
+# The files being compiled ahead of the packets generated, per job
+COMPILING_WINDOW = 2
+
+# The ways to sample a limited number of packets,
+# 'first' takes the packets in the order of files,
+# 'random' takes them in a random order of files,
+# 'stratified' takes the same number of packets from each file
+SAMPLES = [
+    "first",
+    "random",
+    "stratified",
+]
 
-    Arguments:
-        paths: a set of paths include .pkt or .yaml files.
 
-    Return a packets generator
-        that will generate all of packets saved in those paths
+def _load_packets_with_cache(file_, loader, cache):
+    packets = cache.get(file_)
+    if packets is None:
+        packets = list(loader(file_))
+        cache.put(file_, packets)
+        for packet in packets:
+            yield packet
+    else:
+        for packet, test_title, expected_output in packets:
+            yield ftwhelper.FtwStr(
+                ftwhelper.FTW_TYPE.PACKETS, file_, packet,
+                test_title, expected_output)
+
+
+def _load_packets_from_file(file_, cache):
+    file_ext = os.path.splitext(file_)[-1].lower()
+    if cache and file_ext in CACHEABLE_LOADERS:
+        return _load_packets_with_cache(file_, LOADERS[file_ext], cache)
+    return LOADERS[file_ext](file_)
+
+
+def _compile_packets(file_):
+    """ Compile a file into a list of (packet, test title, expected output)
+        in a worker process. Packets are returned as plain strings
+        so that they can be pickled.
+    """
+    file_ext = os.path.splitext(file_)[-1].lower()
+    return [
+        (str(packet), getattr(packet, "TEST_TITLE", None),
+         getattr(packet, "EXPECTED_OUTPUT", None))
+        for packet in LOADERS[file_ext](file_)]
+
+
+def _close_pool(pool):
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+def _load_packets_in_parallel(files, cache, jobs, limit=None):
+    """ Compile the cacheable files by a process pool of jobs workers.
+        The packets are generated in the same order of files,
+        which is the same as the serial loading. The files are submitted
+        in a window of COMPILING_WINDOW * jobs files ahead of the packets
+        generated, so once limit non-empty packets are generated,
+        no more files are compiled and the pool is closed.
+        The packets of the cached files and the files that aren't
+        compiled are only read once the window reaches them.
+    """
+    files = iter(files)
+    # window is a deque of (file, compiling result or None)
+    window = collections.deque()
+    pool = None
+    count = 0
+    try:
+        while True:
+            for file_ in itertools.islice(
+                    files, COMPILING_WINDOW * jobs - len(window)):
+                file_ext = os.path.splitext(file_)[-1].lower()
+                compiling = None
+                if file_ext in CACHEABLE_LOADERS \
+                        and not (cache and cache.contains(file_)):
+                    if pool is None:
+                        # on demand, it slows down the startup
+                        import multiprocessing
+                        pool = multiprocessing.Pool(jobs)
+                    compiling = pool.apply_async(_compile_packets, (file_, ))
+                window.append((file_, compiling))
+            if not window:
+                break
+            file_, compiling = window.popleft()
+            if compiling is None:
+                # the cached packets are read here, or compiled here
+                # if they have been evicted since
+                packets = _load_packets_from_file(file_, cache)
+            else:
+                packets = [
+                    ftwhelper.FtwStr(
+                        ftwhelper.FTW_TYPE.PACKETS, file_, packet,
+                        test_title, expected_output)
+                    for packet, test_title, expected_output
+                    in compiling.get()]
+                if cache:
+                    cache.put(file_, packets)
+            for packet in packets:
+                if limit is not None and packet:
+                    count += 1
+                    if count >= limit:
+                        # the files being compiled are given up
+                        _close_pool(pool)
+                        pool = None
+                        yield packet
+                        return
+                yield packet
+    finally:
+        _close_pool(pool)
+
+
+def walk_paths(paths):
+    """ Generate the supported files in paths, the files of
+        a directory are generated in the order of os.walk
     """
     for path_ in paths:
         path_ = os.path.abspath(os.path.expanduser(path_))
@@ -90,13 +292,73 @@ def load_packets_from_paths(paths):
                     file_ext = os.path.splitext(file_)[-1].lower()
                     if file_ext not in LOADERS:
                         continue
-                    yield LOADERS[file_ext](
-                        os.path.join(root, file_))
+                    yield os.path.join(root, file_)
         elif os.path.isfile(path_):
             file_ext = os.path.splitext(path_)[-1].lower()
             if file_ext not in LOADERS:
                 raise ValueError(path_ + " is not supported to load packets")
-            yield LOADERS[file_ext](path_)
+            yield path_
         else:
             raise IOError("No such file or path: '%s'" % (path_, ))
 
+
+def _load_stratified_packets(files, limit, cache):
+    """ Take limit packets evenly from files, the packets of a file are
+        taken from its beginning. If there are more files than limit,
+        a packet is taken from every len(files) / limit file, so that
+        the rest of files are never loaded
+    """
+    files = list(files)
+    if len(files) > limit:
+        files = [files[i * len(files) // limit] for i in xrange(limit)]
+    for i, file_ in enumerate(files):
+        quota = limit // len(files) + (1 if i < limit % len(files) else 0)
+        for packet in itertools.islice(itertools.ifilter(
+                None, _load_packets_from_file(file_, cache)), quota):
+            yield packet
+
+
+@pywbutil.accept_iterable
+def load_packets_from_paths(
+        paths, cache=None, jobs=1, limit=None, sample="first", seed=None):
+    """ Load a set of paths that
+        include .pkt or .yaml files to a packets generator.
+
+    Arguments:
+        paths: a set of paths include .pkt or .yaml files.
+        cache: a PacketsCache to reuse the packets compiled before,
+            None means that all of files will be compiled (default = None)
+        jobs: an integer, the number of processes to compile .yaml files,
+            the packets are generated in the same order
+            whatever jobs is (default = 1)
+        limit: an integer, the max number of non-empty packets,
+            None means all of packets (default = None)
+        sample: one of SAMPLES, the way to take the limited packets,
+            a 'stratified' sample is compiled by a process
+            whatever jobs is (default = 'first')
+        seed: the seed of the 'random' sample,
+            None means a different order each time (default = None)
+
+    Return a packets iterator
+        that will generate all of packets saved in those paths,
+        or the sample of them if limit is set
+    """
+    if sample not in SAMPLES:
+        raise ValueError("unsupported sample: " + str(sample))
+    files = walk_paths(paths)
+    if limit is not None and sample == "stratified":
+        return _load_stratified_packets(files, limit, cache)
+    if limit is not None and sample == "random":
+        files = list(files)
+        random.Random(seed).shuffle(files)
+    if jobs > 1:
+        packets = _load_packets_in_parallel(files, cache, jobs, limit)
+    else:
+        # the packets of each file are chained in C,
+        # no Python frame is added to each packet
+        packets = itertools.chain.from_iterable(
+            _load_packets_from_file(file_, cache) for file_ in files)
+    if limit is None:
+        return packets
+    # the chain is lazy, the files after the limit are never loaded
+    return itertools.islice(itertools.ifilter(None, packets), limit)
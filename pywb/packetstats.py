@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Latencies and outcomes of each packet and each rule
+
+This exports:
+    - RULES_SUFFIX is the suffix of the rules file beside a .pkt file.
+    - write_rules is a function that writes the rules the packets
+        come from and their expected outputs beside a .pkt file.
+    - read_rules is a function that reads the rules file of a .pkt file.
+    - PacketStats is a class of the latencies and response codes
+        of a packet or a rule.
+    - read_packet_stats is a function that reads the stats saved by
+        the '-6' option of wb.
+    - group_by_rules is a function that adds up the stats of the packets
+        from the same rule.
+    - format_rules_report is a function that ranks the slowest and
+        the most blocked rules.
+
+A rules file has a line per packet of the .pkt file,
+    '<pkt_seq>\\t<original file>\\t<test title>\\t<expected output>',
+    the expected output is the JSON of the output of the FTW stage,
+    the pkt_seq is the sequence number of the packet in the .pkt file,
+    the empty packets aren't counted, as PacketsDumper and wb do.
+A stats file of wb has a line per packet that was sent after its header,
+    '<pkt_seq> <count> <min> <max> <sum> <sum_squares> <no_response>
+    <1xx> <2xx> <3xx> <4xx> <5xx> <index>:<count>...', the buckets are
+    the same as histogram.Histogram, all of latencies are in microseconds.
+    The packet 0 is the request of the command line if there is no '-F'.
+"""
+
+__all__ = [
+    "RULES_SUFFIX",
+    "write_rules",
+    "read_rules",
+    "PacketStats",
+    "read_packet_stats",
+    "group_by_rules",
+    "format_rules_report",
+]
+
+import os
+import re
+import json
+import collections
+
+import histogram
+
+RULES_SUFFIX = ".rules"
+
+# The outcomes counted by wb, by the class of response code
+OUTCOMES = ["no_response", "1xx", "2xx", "3xx", "4xx", "5xx"]
+
+# The outcomes that mean the request was blocked
+BLOCKED_OUTCOMES = ["4xx", "5xx"]
+
+_HEADER = re.compile(r"^# pkt_seq .*\(us, sub_bits=(\d+)\)$")
+
+
+def write_rules(packets_file, rules):
+    """ Write the rules of packets beside a .pkt file
+
+    Arguments:
+        - packets_file: a string, the path of the .pkt file
+        - rules: a list of (original file, test title, expected output)
+            of each packet in the .pkt file, None for a packet
+            without a rule
+    """
+    with open(packets_file + RULES_SUFFIX, "w") as fd:
+        fd.write("# pkt_seq\toriginal_file\ttest_title\texpected_output\n")
+        for pkt_seq, rule in enumerate(rules):
+            if not rule:
+                continue
+            original_file, test_title, expected_output = rule
+            fd.write("%d\t%s\t%s\t%s\n" % (
+                pkt_seq, original_file or "",
+                " ".join(str(test_title or "").split()),
+                json.dumps(expected_output) if expected_output else ""))
+
+
+def read_rules(packets_file):
+    """ Read the rules file of a .pkt file
+
+    Arguments:
+        - packets_file: a string, the path of the .pkt file
+
+    Return a dict, the key is the pkt_seq and the value is
+        (original file, test title, expected output),
+        it's empty if there isn't a rules file
+    """
+    rules = {}
+    rules_file = packets_file + RULES_SUFFIX
+    if not os.path.exists(rules_file):
+        return rules
+    with open(rules_file, "r") as fd:
+        for line in fd:
+            if line.startswith("#"):
+                continue
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 4:
+                continue  # truncated
+            rules[int(columns[0])] = (
+                columns[1] or None, columns[2] or None,
+                json.loads(columns[3]) if columns[3] else None)
+    return rules
+
+
+class PacketStats(object):
+    """ The latencies and response codes of a packet or a rule
+
+    Arguments:
+        - name: a string, the name of the packet or rule
+
+    Attributes:
+        - name: a string, the name of the packet or rule
+        - histogram: a histogram.Histogram of the latencies
+        - outcomes: an OrderedDict, the key is an item of OUTCOMES and
+            the value is the number of requests of that outcome
+        - tests: a set of the test titles of the packets
+    """
+    def __init__(self, name):
+        """ Create empty stats
+        """
+        self.name = name
+        self.histogram = histogram.Histogram()
+        self.outcomes = collections.OrderedDict(
+            (outcome, 0) for outcome in OUTCOMES)
+        self.tests = set()
+
+    def merge(self, other):
+        """ Add the requests of other stats into this one """
+        self.histogram.merge(other.histogram)
+        for outcome, count in other.outcomes.items():
+            self.outcomes[outcome] += count
+        self.tests.update(other.tests)
+
+    def blocked(self):
+        """ Return the number of blocked requests """
+        return sum(self.outcomes[outcome] for outcome in BLOCKED_OUTCOMES)
+
+    def blocked_ratio(self):
+        """ Return the ratio of blocked requests, a float """
+        if not self.histogram.count:
+            return 0.0
+        return float(self.blocked()) / self.histogram.count
+
+
+def read_packet_stats(stats_file):
+    """ Read the stats saved by the '-6' option of wb
+
+    Arguments:
+        - stats_file: a string, the path of the stats file
+
+    Return an OrderedDict, the key is the pkt_seq and
+        the value is the PacketStats of the packet
+    """
+    stats = collections.OrderedDict()
+    with open(stats_file, "r") as fd:
+        header = _HEADER.match(fd.readline().rstrip("\n"))
+        if not header or int(header.group(1)) != histogram.SUB_BITS:
+            raise ValueError(stats_file + " isn't a packet stats file of wb")
+        for line in fd:
+            columns = line.split()
+            if len(columns) < 6 + len(OUTCOMES):
+                continue  # truncated
+            pkt_seq = int(columns[0])
+            packet_stats = PacketStats("packet #%d" % (pkt_seq, ))
+            histogram_ = packet_stats.histogram
+            histogram_.count = int(columns[1])
+            histogram_.min = int(columns[2])
+            histogram_.max = int(columns[3])
+            histogram_.sum = int(columns[4])
+            histogram_.sum_squares = float(columns[5])
+            for i, outcome in enumerate(OUTCOMES):
+                packet_stats.outcomes[outcome] = int(columns[6 + i])
+            for bucket in columns[6 + len(OUTCOMES):]:
+                index, count = bucket.split(":")
+                histogram_.buckets[int(index)] = int(count)
+            stats[pkt_seq] = packet_stats
+    return stats
+
+
+def _rule_name(original_file):
+    """ The rule of a FTW file is its name, e.g. 920100 of 920100.yaml """
+    return os.path.splitext(os.path.basename(original_file))[0]
+
+
+def group_by_rules(stats_and_rules):
+    """ Add up the stats of the packets from the same rule
+
+    Arguments:
+        - stats_and_rules: a list of (stats, rules) of each wb,
+            see read_packet_stats and read_rules, the packets
+            without a rule are reported by themselves
+
+    Return a list of PacketStats, a PacketStats per rule or packet
+    """
+    groups = collections.OrderedDict()
+    for stats, rules in stats_and_rules:
+        for pkt_seq, packet_stats in stats.items():
+            original_file, test_title, _ = rules.get(
+                pkt_seq, (None, None, None))
+            if original_file:
+                name = _rule_name(original_file)
+            else:
+                name = packet_stats.name
+            if test_title:
+                packet_stats.tests.add(test_title)
+            groups.setdefault(name, PacketStats(name)).merge(packet_stats)
+    return list(groups.values())
+
+
+def format_rules_report(groups, top):
+    """ Rank the slowest rules and the most blocked rules
+
+    Arguments:
+        - groups: a list of PacketStats, see group_by_rules
+        - top: an integer, the number of rules of each ranking
+
+    Return a list of lines end with '\\n'
+    """
+    groups = [group for group in groups if group.histogram.count]
+    lines = ["\n"]
+    lines.append("Slowest rules (us):\n")
+    lines.append("  %-24s %8s %8s %8s %8s %8s %6s\n" % (
+        "rule", "requests", "mean", "50%", "99%", "max", "tests"))
+    slowest = sorted(
+        groups, key=lambda group: (
+            -group.histogram.mean(), -group.histogram.percentile(99)))
+    for group in slowest[:top]:
+        lines.append("  %-24s %8d %8d %8d %8d %8d %6d\n" % (
+            group.name, group.histogram.count, group.histogram.mean(),
+            group.histogram.percentile(50), group.histogram.percentile(99),
+            group.histogram.max, len(group.tests)))
+    lines.append("\n")
+    lines.append("Most blocked rules:\n")
+    lines.append("  %-24s %8s %8s %8s %8s %8s %8s\n" % (
+        "rule", "requests", "blocked", "4xx", "5xx", "2xx", "no_resp"))
+    blocked = sorted(
+        groups, key=lambda group: (
+            -group.blocked_ratio(), -group.blocked()))
+    for group in blocked[:top]:
+        if not group.blocked():
+            break
+        lines.append("  %-24s %8d %7.1f%% %8d %8d %8d %8d\n" % (
+            group.name, group.histogram.count,
+            group.blocked_ratio() * 100,
+            group.outcomes["4xx"], group.outcomes["5xx"],
+            group.outcomes["2xx"], group.outcomes["no_response"]))
+    return lines
@@ -7,26 +7,46 @@
 
 This exports:
     - get_wb_path is a function to get the path of 'wb'
-    - MIME_TYPE_DICT is a dict that save the MIME TYPE
+    - get_temp_dir is a function to get a directory for temporary files,
+        a RAM-backed one is preferred
+    - get_mime_type_dict is a function to get the dict of MIME TYPE,
+        the mime types of system are loaded by the first call
+    - MIME_TYPE_DICT is a dict-like view of get_mime_type_dict,
+        the mime types of system are loaded by the first access
     - accept_iterable is a decorator to make the first argument
         of the func to be iterable.
     - expand_nest_generator is a decorator to
         recursively expand the return values of the func,
         if the return values is generators.
+    - flatten is a function to recursively expand
+        the nested generators of an iterable.
+    - TimedPacket is a class of a packet with its time to send.
+    - parse_rate_profile is a function that parses the target rate
+        profile of the '-M' option of wb into stages.
+    - format_rate_profile is a function that formats stages
+        as the target rate profile of wb.
 """
 
 __all__ = [
     "get_wb_path",
+    "get_temp_dir",
+    "get_mime_type_dict",
     "MIME_TYPE_DICT",
     "accept_iterable",
     "expand_nest_generator",
+    "flatten",
+    "TimedPacket",
+    "parse_rate_profile",
+    "format_rate_profile",
 ]
 
 import os
+import re
 import sys
 import functools
 import types
-import mimetypes
+import tempfile
+import collections
 
 
 def get_wb_path():
@@ -48,8 +68,54 @@ def get_wb_path():
         "No executable under such paths: '%s'" % (search_positions, ))
 
 
-mimetypes.init()  # To load all mime types from system
-MIME_TYPE_DICT = mimetypes.types_map  # The dict of MIME TYPE
+def get_temp_dir():
+    """ Get a directory for temporary files,
+        the RAM-backed directory is preferred to avoid disk I/O
+    """
+    ram_dirs = [
+        "/dev/shm",
+    ]
+    for dir_ in ram_dirs:
+        if os.path.isdir(dir_) and os.access(dir_, os.W_OK | os.X_OK):
+            return dir_
+    return tempfile.gettempdir()
+
+
+def get_mime_type_dict():
+    """ Get the dict of MIME TYPE, the key is the file ext
+        and the value is its MIME TYPE,
+        only -p and -u need them, so they aren't loaded on import
+    """
+    import mimetypes
+    if not mimetypes.inited:
+        mimetypes.init()  # To load all mime types from system
+    return mimetypes.types_map
+
+
+class _MimeTypeDict(collections.MutableMapping):
+    """ The dict of MIME TYPE loaded by the first access,
+        so that MIME_TYPE_DICT is kept without loading it on import
+    """
+    def __getitem__(self, key):
+        return get_mime_type_dict()[key]
+
+    def __setitem__(self, key, value):
+        get_mime_type_dict()[key] = value
+
+    def __delitem__(self, key):
+        del get_mime_type_dict()[key]
+
+    def __iter__(self):
+        return iter(get_mime_type_dict())
+
+    def __len__(self):
+        return len(get_mime_type_dict())
+
+    def __repr__(self):
+        return repr(get_mime_type_dict())
+
+
+MIME_TYPE_DICT = _MimeTypeDict()  # The dict of MIME TYPE
 
 
 def accept_iterable(func):
@@ -79,23 +145,125 @@ def expand_nest_generator(func):
     can generate other generators, this decorator will expand
     all generators util objects aren't generators.
     """
+    def _call(args, kw):
+        # func is called once the first item is requested
+        yield func(*args, **kw)
+
     @functools.wraps(func)
     def _decorator(*args, **kw):
-        ret = func(*args, **kw)
-        if not isinstance(ret, types.GeneratorType):
-            yield ret
-        else:
-            visitor = ret.__iter__()
-            visit_stack = [visitor]
-            while visit_stack:
-                visitor = visit_stack[-1]
-                try:
-                    visitor = next(visitor)
-                    if isinstance(visitor, types.GeneratorType):
-                        visitor = visitor.__iter__()
-                        visit_stack.append(visitor)
-                    else:
-                        yield visitor
-                except StopIteration:
-                    visit_stack.pop()
+        return flatten(_call(args, kw))
     return _decorator
+
+
+def flatten(iterable):
+    """ Recursively expand the generators generated by iterable,
+        the other objects are generated as they are.
+
+    The nested generators are visited by a stack in a single frame,
+    each level is resumed by a for-loop instead of next() and
+    StopIteration, so the cost of an item doesn't grow with the depth.
+    """
+    visit_stack = [iter(iterable)]
+    while visit_stack:
+        for item in visit_stack[-1]:
+            if type(item) is types.GeneratorType:
+                visit_stack.append(item)
+                break
+            yield item
+        else:
+            visit_stack.pop()
+
+
+class TimedPacket(object):
+    """ A packet with the time to send it, e.g. loaded from a capture
+        or a .pkt file of '<size> <sec>.<usec>' packets.
+        wb replays timed packets at their offsets from the first one.
+
+    Arguments:
+        - data: a string or a buffer, the content of packet
+        - time_to_send: an integer, microseconds
+
+    Attributes:
+        - data: a string or a buffer, the content of packet
+        - time_to_send: an integer, microseconds
+    """
+    __slots__ = ["data", "time_to_send"]
+
+    def __init__(self, data, time_to_send):
+        """ Create a timed packet
+        """
+        self.data = data
+        self.time_to_send = time_to_send
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return str(self.data)
+
+
+_RATE_STAGE = re.compile(
+    r"^(\d+(?:\.\d*)?)([kmg]?)(?:-(\d+(?:\.\d*)?)([kmg]?))?"
+    r"(?:@(\d+(?:\.\d*)?))?$", re.I)
+_RATE_SCALES = {"": 1, "k": 1000, "m": 1000000, "g": 1000000000}
+
+
+def parse_rate_profile(profile):
+    """ Parse the target rate profile of '-M' of wb,
+        e.g. '1k' for a constant rate, '100-1k@30' for a ramp in 30 seconds,
+        '100@10,200@10,400' for steps. The last stage lasts to the end.
+
+    Arguments:
+        - profile: a string, stages separated by ','
+            as 'rate[-rate][@seconds]'
+
+    Return a list of (rate_from, rate_to, seconds) of stages,
+        rates are requests per second and the seconds of
+        the last stage may be None
+    """
+    stages = []
+    for stage in profile.split(","):
+        match = _RATE_STAGE.match(stage)
+        if not match:
+            raise ValueError("invalid rate profile: " + profile)
+        rate_from, scale_from, rate_to, scale_to, seconds = match.groups()
+        rate_from = float(rate_from) * _RATE_SCALES[scale_from.lower()]
+        if rate_to is None:
+            rate_to = rate_from
+        else:
+            rate_to = float(rate_to) * _RATE_SCALES[scale_to.lower()]
+        if seconds is not None:
+            seconds = float(seconds)
+            if seconds <= 0:
+                raise ValueError("invalid rate profile: " + profile)
+        stages.append((rate_from, rate_to, seconds))
+    for rate_from, rate_to, seconds in stages[:-1]:
+        if seconds is None:
+            raise ValueError(
+                "only the last stage may last to the end: " + profile)
+    rate_from, rate_to, seconds = stages[-1]
+    if rate_from != rate_to and seconds is None:
+        raise ValueError("a ramp needs @seconds: " + profile)
+    if rate_to <= 0:
+        raise ValueError("the last rate must be positive: " + profile)
+    return stages
+
+
+def format_rate_profile(stages):
+    """ Format stages as the target rate profile of '-M' of wb
+
+    Arguments:
+        - stages: a list of (rate_from, rate_to, seconds),
+            see parse_rate_profile
+
+    Return a string
+    """
+    profile = []
+    for rate_from, rate_to, seconds in stages:
+        stage = "%.10g" % (rate_from, )
+        if rate_to != rate_from:
+            stage += "-%.10g" % (rate_to, )
+        if seconds is not None:
+            stage += "@%.10g" % (seconds, )
+        profile.append(stage)
+    return ",".join(profile)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Verify the responses saved by wb against the expectations of FTW
+
+This exports:
+    - Expectation is a class of the output of a FTW stage,
+        which checks the responses of its packet.
+    - TestVerdict is a class of the checked responses of a test.
+    - verify_responses is a function that streams the responses saved by
+        wb and checks them against the expected outputs of their packets.
+    - format_verification_report is a function that formats
+        the failed tests.
+
+The responses are paired with the stages by the pkt_seq of their packets,
+see packetstats.read_rules. 'status', 'response_contains' and
+'expect_error' are checked. 'log_contains' and 'no_log_contains' need
+the log of the WAF of each request, which a bulk run cannot tell apart,
+so they are reported as unchecked. Each regex is compiled once,
+however many times its packet was sent.
+"""
+
+__all__ = [
+    "Expectation",
+    "TestVerdict",
+    "verify_responses",
+    "format_verification_report",
+]
+
+import re
+import collections
+
+import messagesreader
+
+# The expectations of FTW that cannot be checked by the responses
+UNCHECKED_KEYS = ["log_contains", "no_log_contains"]
+
+
+class Expectation(object):
+    """ The output of a FTW stage
+
+    Arguments:
+        - output: a dict, the output of the stage
+        - regexes: a dict to share the compiled regexes among
+            expectations, the key is the pattern (default = None)
+
+    Attributes:
+        - status: a set of the expected response codes, None means any
+        - response_contains: a compiled regex, None means any
+        - expect_error: a bool, if it's True, no response is expected
+        - unchecked: a list of the keys in UNCHECKED_KEYS of the output
+    """
+    def __init__(self, output, regexes=None):
+        """ Create an expectation
+        """
+        status = output.get("status")
+        if status is None:
+            self.status = None
+        elif isinstance(status, list):
+            self.status = set(status)
+        else:
+            self.status = set([int(status)])
+        pattern = output.get("response_contains")
+        self.response_contains = None
+        if pattern is not None:
+            regexes = {} if regexes is None else regexes
+            if pattern not in regexes:
+                regexes[pattern] = re.compile(pattern)
+            self.response_contains = regexes[pattern]
+        self.expect_error = bool(output.get("expect_error"))
+        self.unchecked = [key for key in UNCHECKED_KEYS if key in output]
+
+    def check(self, response):
+        """ Check a response
+
+        Arguments:
+            - response: a messagesreader.Record of a response
+
+        Return None if it's expected, otherwise a string of the reason
+        """
+        if response.kind == messagesreader.TIMEOUT or not response.status:
+            if self.expect_error:
+                return None
+            return "no response"
+        if self.expect_error:
+            return "expected an error, got status %d" % (response.status, )
+        if self.status is not None and response.status not in self.status:
+            return "status %d, expected %s" % (
+                response.status,
+                "/".join(str(status) for status in sorted(self.status)))
+        if self.response_contains is not None \
+                and not self.response_contains.search(response.data):
+            return "response doesn't contain /%s/" % (
+                self.response_contains.pattern, )
+        return None
+
+
+class TestVerdict(object):
+    """ The checked responses of a test
+
+    Arguments:
+        - name: a string, the test title, or the packet without a title
+
+    Attributes:
+        - name: a string, the test title, or the packet without a title
+        - passed: an integer, the number of expected responses
+        - failed: an integer, the number of unexpected responses
+        - failures: a Counter of the reasons of unexpected responses
+        - unchecked: a set of the keys of the outputs that weren't checked
+    """
+    def __init__(self, name):
+        """ Create an empty verdict
+        """
+        self.name = name
+        self.passed = 0
+        self.failed = 0
+        self.failures = collections.Counter()
+        self.unchecked = set()
+
+
+def verify_responses(runs):
+    """ Check the responses saved by wb against the expected outputs
+
+    Arguments:
+        - runs: a list of (msg file, rules) of each wb, the msg file is
+            saved by the '-o', '-7' and '-K' options of wb, and the rules
+            are the rules of its packets, see packetstats.read_rules
+
+    Return a list of TestVerdict of the tests that had responses,
+        the responses of packets without an expected output are ignored
+    """
+    verdicts = collections.OrderedDict()
+    regexes = {}
+    for msg_file, rules in runs:
+        # pkt_seq: (expectation, verdict)
+        checks = {}
+        for pkt_seq, (_, test_title, output) in rules.items():
+            if not output:
+                continue
+            name = test_title or "packet #%d" % (pkt_seq, )
+            checks[pkt_seq] = (
+                Expectation(output, regexes),
+                verdicts.setdefault(name, TestVerdict(name)))
+        for response in messagesreader.read_responses(msg_file):
+            check = checks.get(response.pkt_seq)
+            if check is None:
+                continue
+            expectation, verdict = check
+            verdict.unchecked.update(expectation.unchecked)
+            reason = expectation.check(response)
+            if reason is None:
+                verdict.passed += 1
+            else:
+                verdict.failed += 1
+                verdict.failures[reason] += 1
+    return [
+        verdict for verdict in verdicts.values()
+        if verdict.passed or verdict.failed]
+
+
+def format_verification_report(verdicts):
+    """ Format the failed tests
+
+    Arguments:
+        - verdicts: a list of TestVerdict, see verify_responses
+
+    Return a list of lines end with '\\n'
+    """
+    failed = [verdict for verdict in verdicts if verdict.failed]
+    lines = ["\n"]
+    lines.append(
+        "FTW verification:       %d responses of %d tests, "
+        "%d tests passed, %d failed\n" % (
+            sum(verdict.passed + verdict.failed for verdict in verdicts),
+            len(verdicts), len(verdicts) - len(failed), len(failed)))
+    for verdict in failed:
+        reason, count = verdict.failures.most_common(1)[0]
+        lines.append("  %-24s %d/%d failed, %s (%d)\n" % (
+            verdict.name, verdict.failed, verdict.passed + verdict.failed,
+            reason, count))
+    unchecked = collections.Counter()
+    for verdict in verdicts:
+        unchecked.update(verdict.unchecked)
+    for key, count in sorted(unchecked.items()):
+        lines.append("  %s of %d tests isn't checked\n" % (key, count))
+    return lines
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Merge the results of multiple wb
+
+This exports:
+    - merge_results is a function that merges the Results of multiple wb,
+        which ran at the same time, into one Result.
+    - merge_intervals is a function that merges the progress heartbeats
+        of multiple wb.
+    - format_result is a function that formats a Result as the report
+        of wb, so that it can be processed by the filters of wb output.
+    - format_interval is a function that formats a progress heartbeat
+        as wb.
+
+The latencies of the merged Result are computed from the merged
+    histograms of all of wb instead of averaging their percentiles.
+"""
+
+__all__ = [
+    "merge_results",
+    "merge_intervals",
+    "format_result",
+    "format_interval",
+]
+
+import collections
+
+import pywbutil
+import resultparser
+
+# The percentages of the report of wb
+PERCENTAGES = [50, 66, 75, 80, 90, 95, 98, 99, 100]
+
+
+def _times(histogram):
+    """ min, mean, sd, median and max as the report of wb """
+    return collections.OrderedDict([
+        ("min", histogram.min),
+        ("mean", histogram.mean()),
+        ("sd", round(histogram.sd(), 1)),
+        ("median", histogram.percentile(50)),
+        ("max", histogram.max),
+    ])
+
+
+def _sum(values):
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+
+def merge_intervals(results):
+    """ Merge the heartbeats of the same sequence number
+
+    Arguments:
+        - results: a list of Result, a Result per wb
+
+    Return a list of the merged intervals
+    """
+    intervals = collections.OrderedDict()
+    for result in results:
+        for interval in result.intervals:
+            merged = intervals.get(interval["heartbeat"])
+            if merged is None:
+                intervals[interval["heartbeat"]] = \
+                    collections.OrderedDict(interval)
+                continue
+            for key, value in interval.items():
+                if key == "heartbeat" or value is None:
+                    continue
+                if key == "latency_min":
+                    merged[key] = min(merged[key], value)
+                elif key == "latency_max":
+                    merged[key] = max(merged[key], value)
+                elif key == "latency_mean":
+                    # weighted by the throughput of each wb
+                    weight = merged["requests_per_second"] + \
+                        interval["requests_per_second"]
+                    if weight:
+                        merged[key] = (
+                            merged[key] * merged["requests_per_second"]
+                            + value * interval["requests_per_second"]) \
+                            // weight
+                elif key == "latency_sd":
+                    merged[key] = None  # cannot be merged without samples
+                else:
+                    merged[key] = (merged[key] or 0) + value
+    return list(intervals.values())
+
+
+def merge_results(results, histograms):
+    """ Merge the Results of multiple wb which ran at the same time
+
+    Arguments:
+        - results: a list of Result, a Result per wb
+        - histograms: the merged histograms of all of wb,
+            see histogram.merge_histograms
+
+    Return a Result, its counters are the sum of all of wb,
+        its rates are computed by the longest time taken,
+        its latencies, including the latencies of intervals and
+        the schedule lag, are computed from the histograms,
+        and its target rate is the sum of all of wb
+    """
+    merged = resultparser.Result()
+    if not results:
+        return merged
+    first = results[0]
+    merged.server_software = first.server_software
+    merged.server_hostname = first.server_hostname
+    merged.server_port = first.server_port
+    merged.document_path = first.document_path
+    if len(set(result.document_length for result in results)) == 1:
+        merged.document_length = first.document_length
+    merged.concurrency = _sum(result.concurrency for result in results)
+    time_takens = [result.time_taken for result in results
+                   if result.time_taken is not None]
+    merged.time_taken = max(time_takens) if time_takens else None
+    merged.complete_requests = _sum(
+        result.complete_requests for result in results)
+    merged.failed_requests = _sum(
+        result.failed_requests for result in results)
+    for failure in resultparser.FAILURES:
+        merged.failures[failure] = sum(
+            result.failures[failure] for result in results)
+    merged.keep_alive_requests = _sum(
+        result.keep_alive_requests for result in results)
+    merged.total_transferred = _sum(
+        result.total_transferred for result in results)
+    merged.html_transferred = _sum(
+        result.html_transferred for result in results)
+    merged.tls_handshakes = _sum(
+        result.tls_handshakes for result in results)
+    merged.tls_resumed = _sum(result.tls_resumed for result in results)
+    for result in results:
+        for name, requests in result.mix.items():
+            merged.mix[name] = merged.mix.get(name, 0) + requests
+    merged.mix_affinity = first.mix_affinity
+
+    if merged.time_taken and merged.complete_requests:
+        merged.requests_per_second = \
+            merged.complete_requests / merged.time_taken
+        merged.time_per_request = merged.concurrency \
+            * merged.time_taken * 1000000 / merged.complete_requests
+        merged.time_per_request_across_concurrency = \
+            merged.time_taken * 1000000 / merged.complete_requests
+        merged.transfer_rate = \
+            (merged.total_transferred or 0) / 1024.0 / merged.time_taken
+
+    whole = histograms.get(0, {})
+    for name in ["connect", "processing", "waiting", "total"]:
+        if name in whole and whole[name].count:
+            merged.connection_times[name] = _times(whole[name])
+    if "total" in whole and whole["total"].count:
+        for percentage in PERCENTAGES:
+            merged.percentiles[percentage] = \
+                whole["total"].percentile(percentage)
+
+    merged.intervals = merge_intervals(results)
+    for interval in merged.intervals:
+        total = histograms.get(interval["heartbeat"], {}).get("total")
+        if "latency_min" in interval and total and total.count:
+            interval["latency_min"] = total.min
+            interval["latency_max"] = total.max
+            interval["latency_mean"] = total.mean()
+            interval["latency_sd"] = round(total.sd(), 1)
+
+    lagged = [result for result in results
+              if result.timed_packets or result.scheduled_requests]
+    if lagged:
+        counts = [result.timed_packets or result.scheduled_requests
+                  for result in lagged]
+        if lagged[0].target_rate is not None:
+            # the target rates of wb are added up stage by stage
+            merged.target_rate = pywbutil.format_rate_profile([
+                (sum(stage[0] for stage in stages),
+                 sum(stage[1] for stage in stages), stages[0][2])
+                for stages in zip(*[
+                    pywbutil.parse_rate_profile(result.target_rate)
+                    for result in lagged])])
+            merged.scheduled_requests = sum(counts)
+        else:
+            merged.timed_packets = sum(counts)
+            merged.replay_speed = lagged[0].replay_speed
+        lag = whole.get("lag")
+        if lag and lag.count:
+            merged.schedule_lag = collections.OrderedDict([
+                ("min", lag.min),
+                ("mean", lag.mean()),
+                ("50", lag.percentile(50)),
+                ("90", lag.percentile(90)),
+                ("99", lag.percentile(99)),
+                ("max", lag.max),
+            ])
+    return merged
+
+
+def format_interval(interval):
+    """ Format a progress heartbeat as wb
+
+    Arguments:
+        - interval: a dict, an interval of Result
+
+    Return a line end with '\\n'
+    """
+    if "completed" in interval:
+        return "%2d: Completed %6d requests, rate is %d #/sec.\n" % (
+            interval["heartbeat"], interval["completed"],
+            interval["requests_per_second"])
+    line = "%-5d%-11d%-11d" % (
+        interval["heartbeat"], interval["requests_per_second"],
+        interval["received_kbps"])
+    if interval["sent_kbps"] is not None:
+        line += "%-11d" % (interval["sent_kbps"], )
+    line += "%-6d/%-8d/%-6d/%-8.1f/%d" % (
+        interval["latency_min"], interval["latency_max"],
+        interval["latency_mean"], interval["latency_sd"] or 0,
+        interval["failed"])
+    if interval["failed"]:
+        line += "(%s)" % ("/".join(
+            str(interval[failure])
+            for failure in resultparser.FAILURES), )
+    return line + "\n"
+
+
+def format_result(result):
+    """ Format a Result as the report of wb, latencies are in microseconds
+
+    Arguments:
+        - result: a Result
+
+    Return a list of lines end with '\\n'
+    """
+    lines = [format_interval(interval) for interval in result.intervals]
+    lines.append("\n")
+    lines.append("Server Software:        %s\n" % (result.server_software, ))
+    lines.append("Server Hostname:        %s\n" % (result.server_hostname, ))
+    lines.append("Server Port:            %s\n" % (result.server_port, ))
+    if result.tls_handshakes:
+        lines.append("TLS handshakes:         %d, %d resumed (%.1f%%)\n" % (
+            result.tls_handshakes, result.tls_resumed or 0,
+            100.0 * (result.tls_resumed or 0) / result.tls_handshakes))
+    lines.append("\n")
+    lines.append("Document Path:          %s\n" % (result.document_path, ))
+    if result.document_length is None:
+        lines.append("Document Length:        Variable\n")
+    else:
+        lines.append("Document Length:        %d bytes\n"
+                     % (result.document_length, ))
+    lines.append("\n")
+    lines.append("Concurrency Level:      %d\n" % (result.concurrency or 0, ))
+    lines.append("Time taken for tests:   %.3f seconds\n"
+                 % (result.time_taken or 0, ))
+    lines.append("Complete requests:      %d\n"
+                 % (result.complete_requests or 0, ))
+    lines.append("Failed requests:        %d\n"
+                 % (result.failed_requests or 0, ))
+    failures = result.failures
+    if result.failed_requests:
+        lines.append(
+            "   (Connect: %d, Receive: %d, Length: %d, Exceptions: %d)\n"
+            % (failures["connect"], failures["receive"],
+               failures["length"], failures["exceptions"]))
+    if failures["write_errors"]:
+        lines.append("Write errors:           %d\n"
+                     % (failures["write_errors"], ))
+    if failures["non_2xx"]:
+        lines.append("Non-2xx responses:      %d\n" % (failures["non_2xx"], ))
+    if result.keep_alive_requests is not None:
+        lines.append("Keep-Alive requests:    %d\n"
+                     % (result.keep_alive_requests, ))
+    lines.append("Total transferred:      %d bytes\n"
+                 % (result.total_transferred or 0, ))
+    lines.append("HTML transferred:       %d bytes\n"
+                 % (result.html_transferred or 0, ))
+    if result.requests_per_second is not None:
+        lines.append("Requests per second:    %.2f [#/sec] (mean)\n"
+                     % (result.requests_per_second, ))
+        lines.append("Time per request:       %.3f [ms] (mean)\n"
+                     % (result.time_per_request / 1000, ))
+        lines.append("Time per request:       %.3f [ms] "
+                     "(mean, across all concurrent requests)\n"
+                     % (result.time_per_request_across_concurrency / 1000, ))
+        lines.append("Transfer rate:          %.2f [Kbytes/sec] received\n"
+                     % (result.transfer_rate, ))
+    if result.connection_times:
+        lines.append("\n")
+        lines.append("Connection Times (us)\n")
+        lines.append("              min  mean[+/-sd] median   max\n")
+        for name, times in result.connection_times.items():
+            lines.append("%-11s %5d %4d %5.1f %6d %7d\n" % (
+                name.capitalize() + ":", times["min"], times["mean"],
+                times["sd"], times["median"], times["max"]))
+    if result.percentiles:
+        lines.append("\n")
+        lines.append("Percentage of the requests served "
+                     "within a certain time (us)\n")
+        for percentage, latency in result.percentiles.items():
+            if percentage >= 100:
+                lines.append(" 100%%  %5d (longest request)\n" % (latency, ))
+            else:
+                lines.append("  %d%%  %5d\n" % (percentage, latency))
+    if result.target_rate is not None:
+        lines.append("\n")
+        lines.append("Target rate:            %s [#/sec]\n"
+                     % (result.target_rate, ))
+        lines.append("Scheduled requests:     %d\n"
+                     % (result.scheduled_requests or 0, ))
+    elif result.timed_packets is not None:
+        lines.append("\n")
+        lines.append("Timed packets:          %d (speed x%.2f)\n"
+                     % (result.timed_packets, result.replay_speed))
+    if result.schedule_lag:
+        lines.append("Schedule lag (us):      min %d, mean %d, 50%% %d, "
+                     "90%% %d, 99%% %d, max %d\n" % tuple(
+                         result.schedule_lag.values()))
+    if result.mix:
+        requests = sum(result.mix.values())
+        lines.append("\n")
+        lines.append("Traffic mix:            %d groups%s\n" % (
+            len(result.mix),
+            ", affinity per connection" if result.mix_affinity else ""))
+        for name, count in result.mix.items():
+            lines.append("Mix group:              %s, %d requests (%.1f%%)\n"
+                         % (name, count, 100.0 * count / (requests or 1)))
+    return lines
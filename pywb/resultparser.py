@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Parse the output of wb into a structured result
+
+This exports:
+    - Result is a class that saves the results of a run of wb,
+        it can be converted into a dict, JSON or CSV.
+    - ResultParser is an OutputFilter that parses the final report
+        and the progress heartbeats of wb into a Result.
+
+All of latencies are normalized to microseconds,
+    whatever granularity wb prints them in.
+"""
+
+__all__ = [
+    "Result",
+    "ResultParser",
+]
+
+import re
+import csv
+import json
+import StringIO
+import collections
+
+import outputfilter
+
+# The colors of the output of wb
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+# The failures of wb, the order is the same as
+#   Failed(C/R/L/E/W/Non-2xx) of the extended progress
+FAILURES = [
+    "connect",
+    "receive",
+    "length",
+    "exceptions",
+    "write_errors",
+    "non_2xx",
+]
+
+_UNIT_TO_US = {
+    "us": 1,
+    "ms": 1000,
+}
+
+
+class Result(object):
+    """ The results of a run of wb
+
+    Attributes:
+        - server_software, server_hostname, document_path: strings
+        - server_port, document_length, concurrency: integers,
+            document_length is None if it's variable
+        - time_taken: a float, seconds of the test
+        - complete_requests, failed_requests, keep_alive_requests,
+            total_transferred, html_transferred: integers,
+            transferred are in bytes
+        - failures: an OrderedDict, the key is one of FAILURES and
+            the value is the number of that failure
+        - requests_per_second: a float, the mean throughput
+        - time_per_request, time_per_request_across_concurrency: floats,
+            microseconds
+        - transfer_rate: a float, Kbytes received per second
+        - connection_times: an OrderedDict, the key is one of
+            'connect', 'processing', 'waiting' and 'total', the value
+            is an OrderedDict of 'min', 'mean', 'sd', 'median' and 'max'
+            in microseconds
+        - percentiles: an OrderedDict, the key is the percent and
+            the value is the latency in microseconds
+        - intervals: a list of OrderedDicts, a progress heartbeat each
+        - timed_packets: an integer, the number of packets sent at
+            their time to send, None if the packets aren't timed
+        - replay_speed: a float, the speed of replaying timed packets
+        - target_rate: a string, the target rate profile of the open loop,
+            None if wb ran in the closed loop
+        - scheduled_requests: an integer, the number of requests started
+            at their intended times of the target rate
+        - schedule_lag: an OrderedDict of 'min', 'mean', '50', '90', '99'
+            and 'max', how late the timed packets or the requests of
+            the target rate were sent in microseconds
+        - tls_handshakes, tls_resumed: integers, the number of TLS
+            handshakes and how many of them resumed a session,
+            None if the target isn't HTTPS
+        - mix: an OrderedDict, the key is the name of a group of the
+            traffic mix and the value is the number of its requests,
+            it's empty if the packets were sent in turn
+        - mix_affinity: a bool, if it's True, each connection kept
+            the group of the mix it picked first
+    """
+    def __init__(self):
+        """ Create an empty result
+        """
+        self.server_software = None
+        self.server_hostname = None
+        self.server_port = None
+        self.document_path = None
+        self.document_length = None
+        self.concurrency = None
+        self.time_taken = None
+        self.complete_requests = None
+        self.failed_requests = None
+        self.failures = collections.OrderedDict(
+            (failure, 0) for failure in FAILURES)
+        self.keep_alive_requests = None
+        self.total_transferred = None
+        self.html_transferred = None
+        self.requests_per_second = None
+        self.time_per_request = None
+        self.time_per_request_across_concurrency = None
+        self.transfer_rate = None
+        self.connection_times = collections.OrderedDict()
+        self.percentiles = collections.OrderedDict()
+        self.intervals = []
+        self.timed_packets = None
+        self.replay_speed = None
+        self.target_rate = None
+        self.scheduled_requests = None
+        self.schedule_lag = collections.OrderedDict()
+        self.tls_handshakes = None
+        self.tls_resumed = None
+        self.mix = collections.OrderedDict()
+        self.mix_affinity = False
+
+    def to_dict(self):
+        """ Return an OrderedDict of all of attributes """
+        return collections.OrderedDict([
+            ("server_software", self.server_software),
+            ("server_hostname", self.server_hostname),
+            ("server_port", self.server_port),
+            ("document_path", self.document_path),
+            ("document_length", self.document_length),
+            ("concurrency", self.concurrency),
+            ("time_taken", self.time_taken),
+            ("complete_requests", self.complete_requests),
+            ("failed_requests", self.failed_requests),
+            ("failures", self.failures),
+            ("keep_alive_requests", self.keep_alive_requests),
+            ("total_transferred", self.total_transferred),
+            ("html_transferred", self.html_transferred),
+            ("requests_per_second", self.requests_per_second),
+            ("time_per_request", self.time_per_request),
+            ("time_per_request_across_concurrency",
+                self.time_per_request_across_concurrency),
+            ("transfer_rate", self.transfer_rate),
+            ("connection_times", self.connection_times),
+            ("percentiles", self.percentiles),
+            ("intervals", self.intervals),
+            ("timed_packets", self.timed_packets),
+            ("replay_speed", self.replay_speed),
+            ("target_rate", self.target_rate),
+            ("scheduled_requests", self.scheduled_requests),
+            ("schedule_lag", self.schedule_lag),
+            ("tls_handshakes", self.tls_handshakes),
+            ("tls_resumed", self.tls_resumed),
+            ("mix", self.mix),
+            ("mix_affinity", self.mix_affinity),
+        ])
+
+    @classmethod
+    def from_dict(cls, dict_):
+        """ Create a Result from the dict of to_dict """
+        result = cls()
+        for key, value in dict_.items():
+            if key == "failures":
+                result.failures.update(value)
+            elif key == "percentiles":
+                result.percentiles = collections.OrderedDict(
+                    (int(percentage), latency)
+                    for percentage, latency in value.items())
+            elif hasattr(result, key):
+                setattr(result, key, value)
+        return result
+
+    def to_json(self, **kw):
+        """ Return a JSON string of to_dict,
+            kw is passed to json.dumps
+        """
+        return json.dumps(self.to_dict(), **kw)
+
+    def to_csv(self, intervals=False):
+        """ Return a CSV string
+
+        Arguments:
+            - intervals: a bool, if it's True, the CSV is the time series
+                of intervals, a row per heartbeat. Otherwise the CSV is
+                a row of the summary, the nested keys are joined by '.'
+                (default = False)
+        """
+        if intervals:
+            rows = self.intervals
+        else:
+            summary = self.to_dict()
+            del summary["intervals"]
+            rows = [_flatten_dict(summary)]
+        output = StringIO.StringIO()
+        if rows:
+            writer = csv.DictWriter(
+                output, fieldnames=list(rows[0].keys()), lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
+        return output.getvalue()
+
+
+def _flatten_dict(dict_, prefix=""):
+    flat_dict = collections.OrderedDict()
+    for key, value in dict_.items():
+        key = "%s%s" % (prefix, key)
+        if isinstance(value, dict):
+            flat_dict.update(_flatten_dict(value, key + "."))
+        else:
+            flat_dict[key] = value
+    return flat_dict
+
+
+class ResultParser(outputfilter.OutputFilter):
+    """ Parse the output of wb into a Result,
+        the lines are passed to the next filter as they are.
+
+    Attributes:
+        - result: the Result of the parsed lines
+    """
+    def __init__(self):
+        """ Create a result parser
+        """
+        self.result = Result()
+        self._unit = "us"  # the default granularity of wb
+        self._parsers = [
+            (re.compile(r"^Server Software:\s*(.*)$"),
+                self._parse_string("server_software")),
+            (re.compile(r"^Server Hostname:\s*(.*)$"),
+                self._parse_string("server_hostname")),
+            (re.compile(r"^Server Port:\s*(\d+)$"),
+                self._parse_number("server_port", int)),
+            (re.compile(r"^TLS handshakes:\s*(\d+), (\d+) resumed"),
+                self._parse_tls_handshakes),
+            (re.compile(r"^Document Path:\s*(.*)$"),
+                self._parse_string("document_path")),
+            (re.compile(r"^Document Length:\s*(\d+) bytes$"),
+                self._parse_number("document_length", int)),
+            (re.compile(r"^Concurrency Level:\s*(\d+)$"),
+                self._parse_number("concurrency", int)),
+            (re.compile(r"^Time taken for tests:\s*([\d.]+) seconds$"),
+                self._parse_number("time_taken", float)),
+            (re.compile(r"^Complete requests:\s*(\d+)$"),
+                self._parse_number("complete_requests", int)),
+            (re.compile(r"^Failed requests:\s*(\d+)$"),
+                self._parse_number("failed_requests", int)),
+            (re.compile(r"^\(Connect: (\d+), Receive: (\d+), "
+                        r"Length: (\d+), Exceptions: (\d+)\)$"),
+                self._parse_failures),
+            (re.compile(r"^Write errors:\s*(\d+)$"),
+                self._parse_failure("write_errors")),
+            (re.compile(r"^Non-2xx responses:\s*(\d+)$"),
+                self._parse_failure("non_2xx")),
+            (re.compile(r"^Keep-Alive requests:\s*(\d+)$"),
+                self._parse_number("keep_alive_requests", int)),
+            (re.compile(r"^Total transferred:\s*(\d+) bytes$"),
+                self._parse_number("total_transferred", int)),
+            (re.compile(r"^HTML transferred:\s*(\d+) bytes$"),
+                self._parse_number("html_transferred", int)),
+            (re.compile(r"^Requests per second:\s*([\d.]+)"),
+                self._parse_number("requests_per_second", float)),
+            (re.compile(r"^Time per request:\s*([\d.]+) \[ms\] \(mean\)$"),
+                self._parse_time_per_request("time_per_request")),
+            (re.compile(r"^Time per request:\s*([\d.]+) \[ms\] "
+                        r"\(mean, across all concurrent requests\)$"),
+                self._parse_time_per_request(
+                    "time_per_request_across_concurrency")),
+            (re.compile(r"^Transfer rate:\s*([\d.]+) \[Kbytes/sec\]"),
+                self._parse_number("transfer_rate", float)),
+            (re.compile(r"^Connection Times \((us|ms)\)$"),
+                self._parse_unit),
+            (re.compile(r"^Percentage of the requests served "
+                        r"within a certain time \((us|ms)\)$"),
+                self._parse_unit),
+            (re.compile(r"^(Connect|Processing|Waiting|Total):"
+                        r"\s+(\d+)\s+(\d+)\s+(?:([\d.]+)\s+(\d+)\s+)?(\d+)$"),
+                self._parse_connection_times),
+            (re.compile(r"^(\d+)%\s+(\d+)(?: \(longest request\))?$"),
+                self._parse_percentile),
+            (re.compile(r"^Timed packets:\s*(\d+) \(speed x([\d.]+)\)$"),
+                self._parse_timed_packets),
+            (re.compile(r"^Target rate:\s*(\S+) \[#/sec\]$"),
+                self._parse_string("target_rate")),
+            (re.compile(r"^Scheduled requests:\s*(\d+)$"),
+                self._parse_number("scheduled_requests", int)),
+            (re.compile(r"^Schedule lag \((us|ms)\):\s*min (\d+), mean (\d+), "
+                        r"50% (\d+), 90% (\d+), 99% (\d+), max (\d+)$"),
+                self._parse_schedule_lag),
+            (re.compile(r"^Traffic mix:\s*\d+ groups"
+                        r"(, affinity per connection)?$"),
+                self._parse_mix),
+            (re.compile(r"^Mix group:\s*(.*), (\d+) requests \("),
+                self._parse_mix_group),
+            (re.compile(r"^(\d+): Completed\s+(\d+) requests, "
+                        r"rate is (\d+) #/sec\.$"),
+                self._parse_progress),
+            (re.compile(r"^(\d+)\s+(\d+)\s+(\d+)\s+(?:(\d+)\s+)?"
+                        r"(\d+)\s*/(\d+)\s*/(\d+)\s*/([\d.]+)\s*/(\d+)"
+                        r"(?:\((\d+)/(\d+)/(\d+)/(\d+)/(\d+)/(\d+)\))?$"),
+                self._parse_extended_progress),
+        ]
+
+    def _latency(self, value):
+        return int(round(float(value) * _UNIT_TO_US[self._unit]))
+
+    def _parse_string(self, attribute):
+        def _parse(match):
+            setattr(self.result, attribute, match.group(1))
+        return _parse
+
+    def _parse_number(self, attribute, type_):
+        def _parse(match):
+            setattr(self.result, attribute, type_(match.group(1)))
+        return _parse
+
+    def _parse_time_per_request(self, attribute):
+        def _parse(match):
+            setattr(self.result, attribute, float(match.group(1)) * 1000)
+        return _parse
+
+    def _parse_failure(self, failure):
+        def _parse(match):
+            self.result.failures[failure] = int(match.group(1))
+        return _parse
+
+    def _parse_failures(self, match):
+        for failure, count in zip(FAILURES, match.groups()):
+            self.result.failures[failure] = int(count)
+
+    def _parse_unit(self, match):
+        unit = match.group(1)
+        if unit != self._unit:
+            # the heartbeats before were printed in the same granularity
+            for interval in self.result.intervals:
+                for key in interval:
+                    if key.startswith("latency_") and interval[key] is not None:
+                        interval[key] = interval[key] * _UNIT_TO_US[unit] \
+                            / _UNIT_TO_US[self._unit]
+            self._unit = unit
+
+    def _parse_connection_times(self, match):
+        name, min_, mean, sd, median, max_ = match.groups()
+        times = collections.OrderedDict([
+            ("min", self._latency(min_)),
+            ("mean", self._latency(mean)),
+            ("sd", None if sd is None else float(sd) * _UNIT_TO_US[self._unit]),
+            ("median", None if median is None else self._latency(median)),
+            ("max", self._latency(max_)),
+        ])
+        self.result.connection_times[name.lower()] = times
+
+    def _parse_percentile(self, match):
+        self.result.percentiles[int(match.group(1))] = \
+            self._latency(match.group(2))
+
+    def _parse_timed_packets(self, match):
+        self.result.timed_packets = int(match.group(1))
+        self.result.replay_speed = float(match.group(2))
+
+    def _parse_tls_handshakes(self, match):
+        self.result.tls_handshakes = int(match.group(1))
+        self.result.tls_resumed = int(match.group(2))
+
+    def _parse_schedule_lag(self, match):
+        scale = _UNIT_TO_US[match.group(1)]
+        self.result.schedule_lag = collections.OrderedDict(
+            (key, int(value) * scale) for key, value in zip(
+                ["min", "mean", "50", "90", "99", "max"], match.groups()[1:]))
+
+    def _parse_mix(self, match):
+        self.result.mix_affinity = match.group(1) is not None
+
+    def _parse_mix_group(self, match):
+        self.result.mix[match.group(1)] = int(match.group(2))
+
+    def _parse_progress(self, match):
+        self.result.intervals.append(collections.OrderedDict([
+            ("heartbeat", int(match.group(1))),
+            ("completed", int(match.group(2))),
+            ("requests_per_second", int(match.group(3))),
+        ]))
+
+    def _parse_extended_progress(self, match):
+        groups = match.groups()
+        interval = collections.OrderedDict([
+            ("heartbeat", int(groups[0])),
+            ("requests_per_second", int(groups[1])),
+            ("received_kbps", int(groups[2])),
+            ("sent_kbps", None if groups[3] is None else int(groups[3])),
+            ("latency_min", self._latency(groups[4])),
+            ("latency_max", self._latency(groups[5])),
+            ("latency_mean", self._latency(groups[6])),
+            ("latency_sd", float(groups[7]) * _UNIT_TO_US[self._unit]),
+            ("failed", int(groups[8])),
+        ])
+        for failure, count in zip(FAILURES, groups[9:]):
+            interval[failure] = 0 if count is None else int(count)
+        self.result.intervals.append(interval)
+
+    def __call__(self, line):
+        if line is None:
+            return None
+        text = _ANSI_ESCAPE.sub("", line).strip()
+        for pattern, parse in self._parsers:
+            match = pattern.match(text)
+            if match:
+                parse(match)
+                break
+        return line
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Publish the progress of wb to monitoring while it runs
+
+This exports:
+    - MetricsPublisher is an OutputFilter that parses the progress
+        heartbeats of wb and publishes them as JSON lines into a file
+        and as Prometheus metrics served over HTTP.
+    - format_metrics is a function that formats the latest intervals
+        in the Prometheus text format.
+
+The heartbeats are printed by wb every '-j' seconds, so nothing is added
+    to wb itself, and the publisher is only put among the filters of pywb
+    if it's enabled. The lines prefixed by '[worker N] ', '[agent host:port] '
+    or '[cluster] ' are published with that source, then the report merged
+    by pywb, which replays the merged intervals, isn't published again.
+A JSON line is an interval of resultparser.Result with the 'time' in
+    the epoch and the 'source' of the interval ('' for a single wb).
+"""
+
+__all__ = [
+    "MetricsPublisher",
+    "format_metrics",
+]
+
+import re
+import json
+import time
+import threading
+import collections
+
+import outputfilter
+import resultparser
+
+_SOURCE = re.compile(r"^\[([^\]]+)\] (.*)$", re.DOTALL)
+
+# name: (type, help, key of interval)
+GAUGES = collections.OrderedDict([
+    ("wb_heartbeat", ("gauge", "Sequence number of the last heartbeat",
+                      "heartbeat")),
+    ("wb_requests_per_second", (
+        "gauge", "Requests completed per second in the last heartbeat",
+        "requests_per_second")),
+    ("wb_received_kbps", (
+        "gauge", "Kbytes received per second in the last heartbeat",
+        "received_kbps")),
+    ("wb_sent_kbps", (
+        "gauge", "Kbytes sent per second in the last heartbeat",
+        "sent_kbps")),
+    ("wb_latency_min_us", (
+        "gauge", "Min latency of the last heartbeat in microseconds",
+        "latency_min")),
+    ("wb_latency_mean_us", (
+        "gauge", "Mean latency of the last heartbeat in microseconds",
+        "latency_mean")),
+    ("wb_latency_max_us", (
+        "gauge", "Max latency of the last heartbeat in microseconds",
+        "latency_max")),
+    ("wb_latency_sd_us", (
+        "gauge", "Standard deviation of latency of the last heartbeat "
+        "in microseconds", "latency_sd")),
+    ("wb_completed_requests", (
+        "gauge", "Requests completed so far", "completed")),
+])
+
+
+def _labels(source, **labels):
+    pairs = ([("source", source)] if source else []) + sorted(labels.items())
+    if not pairs:
+        return ""
+    return "{%s}" % (",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\")
+                     .replace('"', '\\"'))
+        for name, value in pairs), )
+
+
+def format_metrics(latest, failures):
+    """ Format the latest intervals in the Prometheus text format
+
+    Arguments:
+        - latest: a dict, the key is the source and the value is
+            the last interval of the source
+        - failures: a dict, the key is the source and the value is
+            a Counter of the failures of the source, the key is
+            one of resultparser.FAILURES or 'failed'
+
+    Return a string end with '\\n'
+    """
+    lines = []
+    for name, (type_, help_, key) in GAUGES.items():
+        samples = [
+            (source, interval[key])
+            for source, interval in sorted(latest.items())
+            if interval.get(key) is not None]
+        if not samples:
+            continue
+        lines.append("# HELP %s %s\n" % (name, help_))
+        lines.append("# TYPE %s %s\n" % (name, type_))
+        for source, value in samples:
+            lines.append("%s%s %s\n" % (name, _labels(source), value))
+    if failures:
+        lines.append("# HELP wb_failed_requests_total "
+                     "Requests failed so far\n")
+        lines.append("# TYPE wb_failed_requests_total counter\n")
+        for source, counter in sorted(failures.items()):
+            lines.append("wb_failed_requests_total%s %d\n" % (
+                _labels(source), counter["failed"]))
+        lines.append("# HELP wb_failures_total "
+                     "Failures so far by their type\n")
+        lines.append("# TYPE wb_failures_total counter\n")
+        for source, counter in sorted(failures.items()):
+            for failure in resultparser.FAILURES:
+                lines.append("wb_failures_total%s %d\n" % (
+                    _labels(source, type=failure), counter[failure]))
+    return "".join(lines)
+
+
+def _create_server(address, publisher):
+    """ Create a HTTP server of the metrics of publisher on any path,
+        BaseHTTPServer is imported on demand, it slows down the startup
+    """
+    import BaseHTTPServer
+
+    class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = publisher.metrics()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # the output of pywb is the output of wb
+
+    return BaseHTTPServer.HTTPServer(address, _MetricsHandler)
+
+
+class MetricsPublisher(outputfilter.OutputFilter):
+    """ Publish the progress heartbeats of wb,
+        the lines are passed to the next filter as they are
+
+    Arguments:
+        - metrics_file: a string, the file to append a JSON line per
+            interval, None means not to write it (default = None)
+        - address: a tuple of (host, port) to serve the metrics over
+            HTTP, None means not to serve them (default = None)
+
+    Attributes:
+        - metrics_file: a string, the file of JSON lines
+        - address: a tuple of (host, port) of the HTTP server,
+            the port is the bound one once it's started
+    """
+    def __init__(self, metrics_file=None, address=None):
+        """ Create a publisher, it's started by start()
+        """
+        self.metrics_file = metrics_file
+        self.address = address
+        self._parsers = {}
+        self._latest = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._fd = None
+        self._server = None
+
+    def enabled(self):
+        """ Return True if there is anywhere to publish """
+        return bool(self.metrics_file or self.address)
+
+    def start(self):
+        """ Open the metrics file and start the HTTP server """
+        if self.metrics_file and not self._fd:
+            self._fd = open(self.metrics_file, "a")
+        if self.address and not self._server:
+            self._server = _create_server(self.address, self)
+            self.address = self._server.server_address
+            thread = threading.Thread(target=self._server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """ Stop the HTTP server and close the metrics file """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+
+    def metrics(self):
+        """ Return the latest metrics in the Prometheus text format """
+        with self._lock:
+            return format_metrics(self._latest, self._failures)
+
+    def _publish(self, source, interval):
+        with self._lock:
+            self._latest[source] = interval
+            failures = self._failures.setdefault(
+                source, collections.Counter())
+            failures["failed"] += interval.get("failed") or 0
+            for failure in resultparser.FAILURES:
+                failures[failure] += interval.get(failure) or 0
+        if self._fd:
+            record = collections.OrderedDict([
+                ("time", round(time.time(), 3)),
+                ("source", source),
+            ])
+            record.update(interval)
+            self._fd.write(json.dumps(record) + "\n")
+            self._fd.flush()
+
+    def __call__(self, line):
+        if line is None:
+            return None
+        source = ""
+        match = _SOURCE.match(line)
+        if match:
+            source, text = match.groups()
+        elif self._parsers and "" not in self._parsers:
+            return line  # the merged report of sources
+        else:
+            text = line
+        parser = self._parsers.get(source)
+        if parser is None:
+            parser = self._parsers[source] = resultparser.ResultParser()
+        intervals = len(parser.result.intervals)
+        parser(text)
+        for interval in parser.result.intervals[intervals:]:
+            self._publish(source, interval)
+        return line
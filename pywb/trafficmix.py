@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Weighted mix of the packets of -F
+
+This exports:
+    - MIX_SUFFIX is the suffix of the mix file beside a .pkt file.
+    - MixGroup is a class of a group of packets and its weight.
+    - TrafficMix is a class of the groups of a mix, it parses a mix
+        spec, splits the files of packets into groups and writes
+        the alias table of groups read by the '-9' option of wb.
+    - build_alias_table is a function that builds the alias table
+        of weights, so that a weighted pick takes O(1).
+
+A mix spec is 'selector=weight[,selector=weight...]', e.g.
+    'benign/=95,attacks/=5'. A selector is 'rule:<glob>' to match
+    the rule of a FTW file by its name, e.g. 'rule:9201*' for 920100.yaml,
+    otherwise a path of a file or directory, or a glob of paths,
+    a glob without '/' matches the names of files, e.g. '*'.
+    A file belongs to the first group it matches, the files matching
+    no group aren't sent. A weight is a positive number, or a target
+    rate as 'rate/s', e.g. '950/s' or '1k/s', then every group needs
+    a rate, and the open loop runs at their sum.
+The packets of a group are put together in the packets file, so a mix
+    file has a line per group after a header '# wb mix: groups=<n>
+    affinity=<0|1>', '<threshold> <alias> <first> <count> <name>',
+    wb takes a column at random and keeps its group if another random
+    number of 32 bits is less than its threshold, otherwise it takes
+    its alias. Then the packets of the group are sent in turn.
+"""
+
+__all__ = [
+    "MIX_SUFFIX",
+    "MixGroup",
+    "TrafficMix",
+    "build_alias_table",
+]
+
+import os
+import fnmatch
+
+import pywbutil
+
+MIX_SUFFIX = ".mix"
+
+# The thresholds of the alias table are of 2^32
+_THRESHOLD_ONE = 1 << 32
+
+_RULE_PREFIX = "rule:"
+_RATE_SUFFIX = "/s"
+
+
+def build_alias_table(weights):
+    """ Build the alias table of weights by the method of Vose
+
+    Arguments:
+        - weights: a list of positive numbers
+
+    Return a list of (threshold, alias) of each column, a column
+        keeps its own index if a random number of 32 bits is
+        less than its threshold, otherwise it's the alias
+    """
+    count = len(weights)
+    total = float(sum(weights))
+    scaled = [weight * count / total for weight in weights]
+    table = [(_THRESHOLD_ONE, column) for column in xrange(count)]
+    small = [column for column in xrange(count) if scaled[column] < 1]
+    large = [column for column in xrange(count) if scaled[column] >= 1]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        table[less] = (int(round(scaled[less] * _THRESHOLD_ONE)), more)
+        scaled[more] += scaled[less] - 1
+        if scaled[more] < 1:
+            small.append(more)
+        else:
+            large.append(more)
+    # the rest are 1 within the rounding errors
+    return table
+
+
+class MixGroup(object):
+    """ A group of packets and its weight
+
+    Arguments:
+        - selector: a string, 'rule:<glob>' or a path or a glob of paths
+        - weight: a positive float, the weight or the rate of the group
+
+    Attributes:
+        - selector: a string, the selector of the group
+        - weight: a float, the weight or the rate of the group
+    """
+    def __init__(self, selector, weight):
+        """ Create a group
+        """
+        self.selector = selector
+        self.weight = weight
+        self._rule = None
+        self._name = None
+        self._path = None
+        if selector.startswith(_RULE_PREFIX):
+            self._rule = selector[len(_RULE_PREFIX):]
+        else:
+            if os.sep not in selector:
+                self._name = selector
+            self._path = os.path.abspath(os.path.expanduser(selector))
+
+    def match(self, file_):
+        """ Return True if the packets of file_ belong to the group """
+        file_ = os.path.abspath(file_)
+        if self._rule is not None:
+            rule = os.path.splitext(os.path.basename(file_))[0]
+            return fnmatch.fnmatchcase(rule, self._rule)
+        if self._name is not None \
+                and fnmatch.fnmatchcase(os.path.basename(file_), self._name):
+            return True
+        return file_ == self._path \
+            or file_.startswith(self._path.rstrip(os.sep) + os.sep) \
+            or fnmatch.fnmatchcase(file_, self._path)
+
+
+class TrafficMix(object):
+    """ The groups of a mix
+
+    Arguments:
+        - spec: a string, 'selector=weight[,selector=weight...]'
+
+    Attributes:
+        - groups: a list of MixGroup
+        - rate: a float, the sum of the rates of groups,
+            None if the groups have weights
+        - affinity: a bool, if it's True, each connection of wb
+            keeps sending the group it picked first
+    """
+    def __init__(self, spec):
+        """ Parse a mix spec
+        """
+        self.groups = []
+        rates = []
+        for item in spec.split(","):
+            selector, _, weight = item.strip().rpartition("=")
+            if not selector or not weight:
+                raise ValueError("invalid mix: " + spec)
+            rates.append(weight.endswith(_RATE_SUFFIX))
+            if rates[-1]:
+                stages = pywbutil.parse_rate_profile(
+                    weight[:-len(_RATE_SUFFIX)])
+                if len(stages) != 1 or stages[0][0] != stages[0][1]:
+                    raise ValueError("the rate of a group is constant: " + item)
+                weight = stages[0][0]
+            else:
+                try:
+                    weight = float(weight)
+                except ValueError:
+                    raise ValueError("invalid weight of mix: " + item)
+            if weight <= 0:
+                raise ValueError("the weight of a group is positive: " + item)
+            self.groups.append(MixGroup(selector, weight))
+        if any(rates) and not all(rates):
+            raise ValueError("either weights or rates of mix: " + spec)
+        self.rate = None
+        if all(rates):
+            self.rate = sum(group.weight for group in self.groups)
+        self.affinity = False
+
+    def group_files(self, files):
+        """ Split the files of packets into groups
+
+        Arguments:
+            - files: an iterable of the paths of files
+
+        Return a list of the files of each group
+        """
+        group_files = [[] for _ in self.groups]
+        for file_ in files:
+            for group, files_ in zip(self.groups, group_files):
+                if group.match(file_):
+                    files_.append(file_)
+                    break
+        for group, files_ in zip(self.groups, group_files):
+            if not files_:
+                raise ValueError(
+                    "no packets of -F in the group " + group.selector)
+        return group_files
+
+    def split(self, limit):
+        """ Split the number of packets among groups by their weights,
+            each group has a packet at least
+
+        Arguments:
+            - limit: an integer, the number of packets
+
+        Return a list of the number of packets of each group
+        """
+        if limit < len(self.groups):
+            raise ValueError("-Q is less than the groups of mix")
+        total = sum(group.weight for group in self.groups)
+        shares = [
+            max(1, int(limit * group.weight / total))
+            for group in self.groups]
+        # the rest of packets go to the largest groups
+        order = sorted(
+            xrange(len(self.groups)),
+            key=lambda index: -self.groups[index].weight)
+        for i in xrange(limit - sum(shares)):
+            shares[order[i % len(order)]] += 1
+        for i in xrange(sum(shares) - limit):
+            index = max(order, key=lambda index: shares[index])
+            shares[index] -= 1
+        return shares
+
+    def write(self, packets_file, counts):
+        """ Write the alias table of groups beside a .pkt file
+
+        Arguments:
+            - packets_file: a string, the path of the .pkt file
+            - counts: a list of the number of packets of each group,
+                the packets of groups are put together in the order
+                of groups
+        """
+        with open(packets_file + MIX_SUFFIX, "w") as fd:
+            fd.write("# wb mix: groups=%d affinity=%d\n" % (
+                len(self.groups), 1 if self.affinity else 0))
+            fd.write("# threshold alias first count name\n")
+            first = 0
+            table = build_alias_table(
+                [group.weight for group in self.groups])
+            for group, count, (threshold, alias) in zip(
+                    self.groups, counts, table):
+                fd.write("%d %d %d %d %s\n" % (
+                    threshold, alias, first, count,
+                    "".join(group.selector.split())))
+                first += count
@@ -150,6 +150,9 @@
 #include "apr_poll.h"
 
 #define APR_WANT_STRFUNC
+#ifdef _WAF_BENCH_ // struct iovec of the request templates
+#define APR_WANT_IOVEC
+#endif // _WAF_BENCH_ // struct iovec of the request templates
 #include "apr_want.h"
 
 #include "apr_base64.h"
@@ -255,6 +258,18 @@ typedef enum {
 
 #define CBUFFSIZE (8192)
 
+#ifdef _WAF_BENCH_ // "-N", a request waiting for its response
+struct pipelined_request {
+    int pkt_id;                 /* the packet of the request */
+    int head;                   /* non-zero if it's a HEAD request, no body */
+    int resent;                 /* non-zero if it's written again as the server closed
+                                 * the connection without answering or telling */
+    apr_time_t start,           /* Start of the request */
+               connect,         /* Connected, start writing */
+               endwrite;        /* Request written */
+};
+#endif // _WAF_BENCH_ // "-N", a request waiting for its response
+
 struct connection {
     apr_pool_t *ctx;
     apr_socket_t *aprsock;
@@ -280,6 +295,31 @@ struct connection {
 #ifdef USE_SSL
     SSL *ssl;
 #endif
+#ifdef _WAF_BENCH_ // a timed packet waiting for its time to send
+    int pkt_scheduled;          /* non-zero if it's in the replay heap */
+    int pkt_id;                 /* the packet to send when it's released */
+    apr_time_t pkt_due,         /* the time to send the packet */
+               pkt_wait;        /* the time it started waiting */
+#endif // _WAF_BENCH_ // a timed packet waiting for its time to send
+#ifdef _WAF_BENCH_ // the request written from a template
+    const struct pkt_template *tmpl;    /* NULL: the request is written as is */
+    apr_size_t tmpl_len;        /* length of the request from the template */
+    int pkt_status;             /* response code of the request, 0: no response */
+    int seq_len;                /* length of seq */
+    char seq[24];               /* <seq#> of the request, filled in the slots */
+#endif // _WAF_BENCH_ // the request written from a template
+#ifdef _WAF_BENCH_ // "-N", requests in flight of a persistent connection
+    struct pipelined_request *pipeline; /* ring of the requests waiting for responses */
+    int pipe_head;              /* the oldest request in the ring */
+    int pipe_len;               /* number of requests in the ring */
+    int pipe_resend;            /* number of the latest requests to write again */
+    int pipe_done;              /* number of responses on this TCP connection */
+    int pipe_closing;           /* non-zero if no more requests are written */
+    int chunk_state;            /* CHUNK_NONE, or where the chunked body is at */
+    apr_size_t chunk_left;      /* bytes left of the current chunk */
+    int resp_close;             /* the server closes after the response */
+    int resp_until_close;       /* the body ends when the server closes */
+#endif // _WAF_BENCH_ // "-N", requests in flight of a persistent connection
 };
 
 struct data {
@@ -308,25 +348,115 @@ struct data {
 // Global variables
 int g_us_granularity = 1;           /* microsec-granularity in output-results           */
 int g_extended_progress = 0;        /* printout additional progress report              */
-int g_stats_window = MAX_REQUESTS;  /* how many stats results, "-W" option              */
+int g_stats_window = MAX_REQUESTS;  /* how many samples saved by -g, "-W" option         */
 int g_enable_ini = 0;               /* "-0", enable read/write ini for wb's options     */
 int g_add_localhost = 1;            /* "-1", add header host:localhost if not present   */
 int g_add_connection_close = 1;     /* '-2', add header connection:close if not present */
 int g_save_body = 0;                /* '-K', keep body when save                        */
 apr_file_t *g_save_file_fd = NULL;  /* save received messages to output file            */
 ulong g_MAX_FILE_SIZE = 0;          /* default output file size, unlimited              */
-ulong g_saved_bytes = 0;            /* how many bytes saved to file                     */
+ulong g_saved_bytes = 0;            /* how many bytes saved to the current segment      */
+int g_save_binary = 0;              /* '-7', save received messages as binary records   */
+char *g_save_buf = NULL;            /* buffered writes to output file                   */
+apr_size_t g_save_buf_len = 0;      /* bytes waiting in g_save_buf                      */
+#define SAVE_BUFFER_SIZE    (256 * 1024) /* bytes buffered before writing output file  */
+// the binary output file of "-7" starts with CAPTURE_MAGIC, followed by records,
+// each record is a header of big-endian fields then the received bytes:
+// data length (4), kind (1), reserved (1), status (2), pkt_seq (4),
+// connection (4), microseconds since the start of test (8)
+#define CAPTURE_MAGIC       "WBCAP001"
+#define CAPTURE_MAGIC_LEN   8
+#define CAPTURE_HEADER_LEN  24
+#define CAPTURE_FIRST       1       /* the first received bytes of a response           */
+#define CAPTURE_NEXT        2       /* the following received bytes of a response       */
+#define CAPTURE_TIMEOUT     3       /* the response timed out, no data                  */
 apr_size_t g_pkt_length = 0;        /* length of file for packets to be sent            */
 char *g_pkt_data;                   /* global buffer containing data from pktfile       */
+struct _tmpl_segment_               /* a segment of a request template                  */
+{
+    const char *data;               /* NULL: a slot of <seq#>                           */
+    apr_size_t len;
+};
+#define TEMPLATE_MAX_IOVEC  64      /* max # of segments of a scatter write             */
+struct pkt_template                 /* a request pre-split by "-U", "-J" and "-2"       */
+{
+    struct _tmpl_segment_ *segments;
+    int segment_count;
+    int slot_count;                 /* # of slots of <seq#>                             */
+    apr_size_t literal_len;         /* total length of the segments except slots        */
+};
 struct _g_pkt_array_                /* save the starting pointer of those sent packets  */
 {
     char    *pkt_data;
     int     pkt_length;
 	apr_time_t pkt_time_to_send;
+    struct pkt_template *pkt_template; /* NULL: sent as is                          */
+    ulong   pkt_seq;                /* sequence number of the packet in packets file    */
 } *g_pkt_array;
 ulong g_pkt_count = 0;              /* number of packets which have been sent           */
 ulong g_MAX_PKT_COUNT = 0;          /* max # of packets , default: 0 means all packets  */
 ulong g_RPS_NUMBER = 0;             /* RPS for rate limiting, default: 0 means no limit */
+int g_pkt_timed = 0;                /* whether packets have different time to send      */
+double g_replay_speed = 1.0;        /* "-L", speed of replaying timed packets, 0: ignore*/
+struct connection **g_replay_heap;  /* connections waiting for their time to send      */
+int g_replay_heap_len = 0;          /* number of connections in the replay heap         */
+#define MAX_RATE_STAGES     64      /* max # of stages of a rate profile                */
+struct _g_rate_stages_              /* "-M", the stages of the target rate              */
+{
+    double  rate_from, rate_to;     /* requests per second at the start and end         */
+    double  duration;               /* seconds, 0: the last stage lasts to the end      */
+} g_rate_stages[MAX_RATE_STAGES];
+int g_rate_stage_count = 0;         /* # of rate stages, 0: closed loop (default)       */
+const char *g_rate_profile;         /* "-M", the target rate profile as it's given      */
+ulong g_rate_scheduled = 0;         /* number of requests given an intended start time  */
+#define HIST_SUB_BITS       7       /* 2^7 sub-buckets per power of 2, error < 1%       */
+#define HIST_MAX_BITS       40      /* latencies up to 2^40 us, longer ones are clamped */
+#define HIST_BUCKETS        ((HIST_MAX_BITS - HIST_SUB_BITS + 1) << HIST_SUB_BITS)
+enum { HIST_CONNECT, HIST_PROCESSING, HIST_WAITING, HIST_TOTAL, HIST_KINDS };
+const char *g_hist_names[HIST_KINDS] = {"connect", "processing", "waiting", "total"};
+struct histogram                    /* log-bucketed latencies in constant memory        */
+{
+    ulong   count;
+    apr_interval_time_t min, max;
+    apr_int64_t sum;                /* for the mean                                     */
+    double  sum_squares;            /* for the standard deviation                       */
+    ulong   buckets[HIST_BUCKETS];
+};
+struct histogram g_hists[HIST_KINDS];           /* latencies of all of requests         */
+struct histogram g_interval_hists[HIST_KINDS];  /* latencies of the progress interval   */
+struct histogram g_lag_hist;        /* schedule lags of timed packets or "-M" requests  */
+const char *g_hist_filename;        /* "-D", save the histograms to this file           */
+const char *g_pkt_stats_filename;   /* "-6", save the stats of each packet to this file */
+FILE *g_hist_file;
+#define PKT_HIST_SUB_BITS   2       /* sub bits of the latency histogram of a packet    */
+#define PKT_HIST_BUCKETS    (HIST_BUCKETS >> (HIST_SUB_BITS - PKT_HIST_SUB_BITS))
+#define PKT_STATUS_CLASSES  6       /* no response, 1xx, 2xx, 3xx, 4xx, 5xx             */
+struct pkt_stats                    /* "-6", latencies and response codes of a packet   */
+{
+    ulong   count;
+    apr_interval_time_t min, max;
+    apr_int64_t sum;
+    double  sum_squares;
+    ulong   status[PKT_STATUS_CLASSES];
+    apr_uint32_t buckets[PKT_HIST_BUCKETS];
+};
+struct pkt_stats *g_pkt_stats;      /* "-6", stats of each packet of g_pkt_array        */
+FILE *g_pkt_stats_file;             /* "-6", save the stats of each packet to this file */
+#define MIX_THRESHOLD_ONE   ((apr_uint64_t)1 << 32) /* thresholds of the mix are of 2^32 */
+struct mix_group                    /* "-9", a group of packets of the traffic mix      */
+{
+    apr_uint64_t threshold;         /* the column keeps its group if random < threshold */
+    int     alias;                  /* the group picked by the column otherwise         */
+    ulong   first, count;           /* the packets [first, first + count) of the group  */
+    ulong   next;                   /* the next packet of the group, in turn            */
+    ulong   picked;                 /* number of requests of the group                  */
+    char    *name;
+} *g_mix_groups;
+int g_mix_group_count = 0;          /* "-9", # of groups, 0: all packets in turn        */
+int g_mix_affinity = 0;             /* whether a connection keeps the group it picked   */
+int *g_mix_connection_groups;       /* the group + 1 of each connection, 0: not picked  */
+apr_uint64_t g_mix_random;          /* state of the generator picking the groups        */
+const char *g_mix_filename;         /* "-9", read the alias table of the mix from file  */
 
 int g_interval_print = 1;           /* Interval (in secs) of printing progress report   */
 int g_set_requests = 0;             /* whether requests is specified with "-n" option   */
@@ -339,10 +469,7 @@ const char *opt_file_in;            /* input options file
 const char *opt_file_out;           /* output options file                              */
 const char *g_opt_prefix;           /* Add prefix("/prefix<seq#>/" to each request      */
 char *g_header_to_sent;             /* to store the generated header to be sent         */
-char *g_new_header;                 /* to store the generated prefix                    */
-char *g_request_end = NULL;         /* store the end position of request header         */
-apr_size_t g_new_header_len = 0;    /* length of generated new header                   */
-apr_size_t g_header_len_MAX = 8192; /* max length of generated new header               */
+struct pkt_template *g_request_template; /* template of the request without "-F"       */
 char **g_sub_string;                /* to store the sub_string that's to be replaced    */
 apr_size_t g_sub_string_num = 0;    /* number of sub strings                            */
 apr_size_t g_sub_string_num_MAX=128;/* maximum number of sub strings                    */
@@ -354,6 +481,12 @@ char **g_argv_ini;                  /* argv from ini file
 int g_argc_ini;                     /* argc from ini file                               */
 int g_opt_string_len = 8192;        /* option string length from ini file               */
 int g_keepalive_for_real_traffic=0; /* keep alive option for real traffic testing       */
+#define PIPELINE_MAX_DEPTH  256     /* max # of requests in flight per connection       */
+int g_pipeline_depth = 0;           /* "-N", requests in flight per connection, 0: off  */
+ulong g_pipeline_reconnects = 0;    /* "-N", connections closed by the server           */
+ulong g_pipeline_resent = 0;        /* "-N", requests written again after reconnecting  */
+enum { CHUNK_NONE, CHUNK_SIZE, CHUNK_EXT, CHUNK_DATA, CHUNK_DATA_END,
+       CHUNK_TRAILER, CHUNK_TRAILER_LINE };
 #endif //_WAF_BENCH_  // globals and definitions for WAF_BENCH
 
 int verbosity = 0;      /* no verbosity by default */
@@ -432,6 +565,13 @@ BIO *bio_out,*bio_err;
 int tls_use_sni = 1;         /* used by default, -I disables it */
 const char *tls_sni = NULL; /* 'opt_host' if any, 'hostname' otherwise */
 #endif
+#ifdef _WAF_BENCH_ // "-8", resume TLS sessions
+const char *g_tls_session_filename; /* "-8", load and save the session to resume    */
+SSL_SESSION *g_tls_session = NULL;  /* the latest session of the server, for all    */
+                                    /* of connections to resume                      */
+ulong g_tls_handshakes = 0;         /* # of TLS handshakes done                      */
+ulong g_tls_resumed = 0;            /* # of TLS handshakes that resumed a session    */
+#endif // _WAF_BENCH_ // "-8", resume TLS sessions
 #endif
 
 apr_time_t start, lasttime, stoptime;
@@ -577,6 +717,9 @@ static void set_polled_events(struct connection *c, apr_int16_t new_reqevents)
             if (rv != APR_SUCCESS) {
                 apr_err("apr_pollset_remove()", rv);
             }
+#ifdef _WAF_BENCH_ // it's not in the pollset now, add it again when polled
+            c->pollfd.reqevents = 0;
+#endif // _WAF_BENCH_ // it's not in the pollset now, add it again when polled
         }
 
         if (new_reqevents != 0) {
@@ -785,6 +928,11 @@ static void ssl_proceed_handshake(struct connection *c)
 
         switch (ecode) {
         case SSL_ERROR_NONE:
+#ifdef _WAF_BENCH_ // "-8", count the resumed sessions
+            g_tls_handshakes++;
+            if (SSL_session_reused(c->ssl))
+                g_tls_resumed++;
+#endif // _WAF_BENCH_ // "-8", count the resumed sessions
             if (verbosity >= 2)
                 ssl_print_info(c);
             if (ssl_info == NULL) {
@@ -870,12 +1018,50 @@ static void ssl_proceed_handshake(struct connection *c)
 /* ------------------------------------------------------- */
 #ifdef _WAF_BENCH_ // functions definitions
 
+// xorshift64*, picking the groups of the mix needs a fast generator,
+// not a good one
+static apr_uint64_t mix_random(void)
+{
+    g_mix_random ^= g_mix_random >> 12;
+    g_mix_random ^= g_mix_random << 25;
+    g_mix_random ^= g_mix_random >> 27;
+    return g_mix_random * 2685821657736338717ULL;
+} // end of mix_random
+
+// pick a group of the mix by the alias method in O(1), a column is taken
+// at random, then the low 32 bits decide its group or the alias of it
+static int mix_pick_group(void)
+{
+    apr_uint64_t r = mix_random();
+    struct mix_group *column = &g_mix_groups[(r >> 32) % g_mix_group_count];
+
+    if ((r & 0xffffffff) < column->threshold)
+        return column - g_mix_groups;
+    return column->alias;
+} // end of mix_pick_group
+
 //  assign pkt id for each connection
 int get_write_pkt_id(int connection_socket_id)
 {
     int return_id;
     static int cur_id = 0;
 
+    // "-9", the packets of the picked group are sent in turn,
+    // with affinity, the connection keeps the group it picked first
+    if (g_mix_group_count) {
+        int *affinity = g_mix_affinity ? &g_mix_connection_groups[connection_socket_id] : NULL;
+        struct mix_group *group;
+
+        if (affinity && !*affinity)
+            *affinity = mix_pick_group() + 1;
+        group = &g_mix_groups[affinity ? *affinity - 1 : mix_pick_group()];
+        group->picked++;
+        return_id = group->first + group->next;
+        if (++group->next == group->count)
+            group->next = 0;
+        return return_id;
+    }
+
     return_id = cur_id;
 
     // the simplest way is round-robin (cur_id ++)
@@ -887,6 +1073,479 @@ int get_write_pkt_id(int connection_socket_id)
     return return_id;
 } // end of get_write_pkt_id
 
+// the bucket of a latency, the latencies below 2^(HIST_SUB_BITS+1) have
+// their own buckets, above that each power of 2 is split into
+// 2^HIST_SUB_BITS buckets, so the error is less than 2^-HIST_SUB_BITS
+static int hist_index(apr_interval_time_t value)
+{
+    int shift = 0;
+
+    if (value <= 0)
+        return 0;
+    if (value >> HIST_MAX_BITS)
+        value = ((apr_interval_time_t)1 << HIST_MAX_BITS) - 1;
+    while ((value >> shift) >= (2 << HIST_SUB_BITS))
+        shift++;
+    return (shift << HIST_SUB_BITS) + (int)(value >> shift);
+} // end of hist_index
+
+// the highest latency of a bucket
+static apr_interval_time_t hist_highest(int index)
+{
+    int shift = (index >> HIST_SUB_BITS) - 1;
+
+    if (shift <= 0)
+        return index;
+    return ((apr_interval_time_t)(index - (shift << HIST_SUB_BITS)) << shift)
+        + ((apr_interval_time_t)1 << shift) - 1;
+} // end of hist_highest
+
+static void hist_record(struct histogram *h, apr_interval_time_t value)
+{
+    value = ap_max(0, value);
+    if (!h->count || value < h->min)
+        h->min = value;
+    if (!h->count || value > h->max)
+        h->max = value;
+    h->count++;
+    h->sum += value;
+    h->sum_squares += (double)value * value;
+    h->buckets[hist_index(value)]++;
+} // end of hist_record
+
+static void hist_reset(struct histogram *h)
+{
+    memset(h, 0, sizeof(struct histogram));
+} // end of hist_reset
+
+static apr_interval_time_t hist_mean(struct histogram *h)
+{
+    return h->count ? h->sum / (apr_int64_t)h->count : 0;
+} // end of hist_mean
+
+// the sample standard deviation
+static double hist_sd(struct histogram *h)
+{
+    double mean, variance;
+
+    if (h->count < 2)
+        return 0;
+    mean = (double)h->sum / h->count;
+    variance = (h->sum_squares - mean * h->sum) / (h->count - 1);
+    return variance > 0 ? sqrt(variance) : 0;
+} // end of hist_sd
+
+// the latency that perc% of requests are within, as the sorted samples
+// of ab, the (count * perc / 100)-th one counted from 0
+static apr_interval_time_t hist_percentile(struct histogram *h, int perc)
+{
+    ulong rank, seen = 0;
+    int i;
+
+    if (!h->count)
+        return 0;
+    if (perc >= 100)
+        return h->max;
+    rank = (ulong)((double)h->count * perc / 100) + 1;
+    for (i = 0; i < HIST_BUCKETS; i++) {
+        seen += h->buckets[i];
+        if (seen >= rank)
+            return ap_max(h->min, ap_min(h->max, hist_highest(i)));
+    }
+    return h->max;
+} // end of hist_percentile
+
+// record the latencies of a finished request
+static void record_latencies(struct data *s)
+{
+    apr_interval_time_t values[HIST_KINDS];
+    int i;
+
+    values[HIST_CONNECT] = s->ctime;
+    values[HIST_PROCESSING] = s->time - s->ctime;
+    values[HIST_WAITING] = s->waittime;
+    values[HIST_TOTAL] = s->time;
+    for (i = 0; i < HIST_KINDS; i++) {
+        hist_record(&g_hists[i], values[i]);
+        hist_record(&g_interval_hists[i], values[i]);
+    }
+} // end of record_latencies
+
+// record the latency and the response code of the packet of a finished request
+static void record_pkt_stats(struct connection *c, apr_interval_time_t value)
+{
+    struct pkt_stats *p;
+
+    if (!g_pkt_stats)
+        return;
+    p = &g_pkt_stats[g_pkt_length ? c->pkt_id : 0];
+    value = ap_max(0, value);
+    if (!p->count || value < p->min)
+        p->min = value;
+    if (!p->count || value > p->max)
+        p->max = value;
+    p->count++;
+    p->sum += value;
+    p->sum_squares += (double)value * value;
+    p->status[ap_min(c->pkt_status / 100, PKT_STATUS_CLASSES - 1)]++;
+    p->buckets[hist_index(value) >> (HIST_SUB_BITS - PKT_HIST_SUB_BITS)]++;
+} // end of record_pkt_stats
+
+// open the file of "-6" and allocate the stats of packets, after loading packets
+static apr_status_t open_pkt_stats_file(const char *sfile)
+{
+    g_pkt_stats_file = fopen(sfile, "w");
+    if (!g_pkt_stats_file) {
+        perror("Cannot open packet stats file");
+        return APR_EGENERAL;
+    }
+    // the request without -F is the packet 0
+    g_pkt_stats = xcalloc(ap_max(g_pkt_count, 1), sizeof(struct pkt_stats));
+    return APR_SUCCESS;
+} // end of open_pkt_stats_file
+
+// save the stats of the sent packets to the file of "-6", a line per packet,
+// the buckets are saved as the highest bucket index of histograms of "-D"
+static void save_pkt_stats(void)
+{
+    ulong i;
+    int j;
+
+    fprintf(g_pkt_stats_file, "# pkt_seq count min max sum sum_squares "
+            "no_response 1xx 2xx 3xx 4xx 5xx index:count... (us, sub_bits=%d)\n", HIST_SUB_BITS);
+    for (i = 0; i < ap_max(g_pkt_count, 1); i++) {
+        struct pkt_stats *p = &g_pkt_stats[i];
+        if (!p->count)
+            continue;
+        fprintf(g_pkt_stats_file, "%lu %lu %" APR_TIME_T_FMT " %" APR_TIME_T_FMT " %" APR_INT64_T_FMT " %.0f",
+                g_pkt_length ? g_pkt_array[i].pkt_seq : 0, p->count, p->min, p->max, p->sum, p->sum_squares);
+        for (j = 0; j < PKT_STATUS_CLASSES; j++)
+            fprintf(g_pkt_stats_file, " %lu", p->status[j]);
+        for (j = 0; j < PKT_HIST_BUCKETS; j++)
+            if (p->buckets[j])
+                fprintf(g_pkt_stats_file, " %d:%u",
+                        ((j + 1) << (HIST_SUB_BITS - PKT_HIST_SUB_BITS)) - 1, p->buckets[j]);
+        fprintf(g_pkt_stats_file, "\n");
+    }
+    fclose(g_pkt_stats_file);
+    g_pkt_stats_file = NULL;
+} // end of save_pkt_stats
+
+// read the alias table of the mix from the file of "-9", after loading packets,
+// '# wb mix: groups=<n> affinity=<0|1>', then a line per group,
+// '<threshold> <alias> <first> <count> <name>', the threshold is of 2^32,
+// the packets of a group are numbered as "-6" and end at "-Q"
+static apr_status_t open_mix_file(const char *mfile)
+{
+    FILE *fd;
+    char line[1024];
+    int i = 0;
+
+    if (!g_pkt_length) {
+        fprintf(stderr, "-9 needs the packets of -F\n");
+        return APR_EGENERAL;
+    }
+    if (g_pkt_timed && g_replay_speed > 0) {
+        fprintf(stderr, "The timed packets cannot be mixed by -9, use -L 0 to ignore their time\n");
+        return APR_EGENERAL;
+    }
+    fd = fopen(mfile, "r");
+    if (!fd) {
+        perror("Cannot open mix file");
+        return APR_EGENERAL;
+    }
+    if (!fgets(line, sizeof line, fd)
+        || sscanf(line, "# wb mix: groups=%d affinity=%d", &g_mix_group_count, &g_mix_affinity) != 2
+        || g_mix_group_count <= 0) {
+        fprintf(stderr, "%s isn't a mix file of wb\n", mfile);
+        fclose(fd);
+        return APR_EGENERAL;
+    }
+    g_mix_groups = xcalloc(g_mix_group_count, sizeof(struct mix_group));
+    while (i < g_mix_group_count && fgets(line, sizeof line, fd)) {
+        struct mix_group *group = &g_mix_groups[i];
+        int name_offset = 0;
+
+        if (line[0] == '#')
+            continue;
+        line[strcspn(line, "\r\n")] = '\0';
+        if (sscanf(line, "%" APR_UINT64_T_FMT " %d %lu %lu %n", &group->threshold,
+                   &group->alias, &group->first, &group->count, &name_offset) < 4
+            || group->threshold > MIX_THRESHOLD_ONE
+            || group->alias < 0 || group->alias >= g_mix_group_count)
+            break;
+        group->name = apr_pstrdup(cntxt, line + name_offset);
+        if (group->first >= g_pkt_count || !group->count) {
+            fprintf(stderr, "The group %s of the mix has no packets within -Q\n", group->name);
+            fclose(fd);
+            return APR_EGENERAL;
+        }
+        group->count = ap_min(group->count, g_pkt_count - group->first);
+        i++;
+    }
+    fclose(fd);
+    if (i < g_mix_group_count) {
+        fprintf(stderr, "Invalid group %d of the mix in %s\n", i, mfile);
+        return APR_EGENERAL;
+    }
+    if (g_mix_affinity)
+        g_mix_connection_groups = xcalloc(concurrency, sizeof(int));
+    g_mix_random = ((apr_uint64_t)apr_time_now() << 16 ^ getpid()) | 1;
+    return APR_SUCCESS;
+} // end of open_mix_file
+
+// print out the requests picked from each group of the mix
+static void output_mix(void)
+{
+    ulong picked = 0;
+    int i;
+
+    for (i = 0; i < g_mix_group_count; i++)
+        picked += g_mix_groups[i].picked;
+    printf("Traffic mix:            %d groups%s\n", g_mix_group_count,
+           g_mix_affinity ? ", affinity per connection" : "");
+    for (i = 0; i < g_mix_group_count; i++)
+        printf("Mix group:              %s, %lu requests (%.1f%%)\n", g_mix_groups[i].name,
+               g_mix_groups[i].picked, picked ? 100.0 * g_mix_groups[i].picked / picked : 0.0);
+} // end of output_mix
+
+// open the file of "-D" and write its header
+static apr_status_t open_histfile(const char *hfile)
+{
+    g_hist_file = fopen(hfile, "w");
+    if (!g_hist_file) {
+        perror("Cannot open histogram file");
+        return APR_EGENERAL;
+    }
+    fprintf(g_hist_file, "# heartbeat name count min max sum sum_squares index:count... "
+            "(us, sub_bits=%d)\n", HIST_SUB_BITS);
+    return APR_SUCCESS;
+} // end of open_histfile
+
+// save a histogram to the file of "-D" as a line, only non-empty buckets are saved,
+// the heartbeat is 0 for the whole test
+static void save_histogram(int heartbeat, const char *name, struct histogram *h)
+{
+    int i;
+
+    if (!g_hist_file)
+        return;
+    fprintf(g_hist_file, "%d %s %lu %" APR_TIME_T_FMT " %" APR_TIME_T_FMT " %" APR_INT64_T_FMT " %.0f",
+            heartbeat, name, h->count, h->min, h->max, h->sum, h->sum_squares);
+    for (i = 0; i < HIST_BUCKETS; i++)
+        if (h->buckets[i])
+            fprintf(g_hist_file, " %d:%lu", i, h->buckets[i]);
+    fprintf(g_hist_file, "\n");
+} // end of save_histogram
+
+// the offset of a timed packet from the start of its round, scaled by -L
+static apr_interval_time_t replay_offset(apr_time_t time_to_send)
+{
+    return (apr_interval_time_t)((time_to_send - g_pkt_array[0].pkt_time_to_send) / g_replay_speed);
+} // end of replay_offset
+
+static void replay_heap_swap(int i, int j)
+{
+    struct connection *c = g_replay_heap[i];
+    g_replay_heap[i] = g_replay_heap[j];
+    g_replay_heap[j] = c;
+} // end of replay_heap_swap
+
+// a connection waits in a min-heap ordered by the time to send its packet,
+// instead of sleeping in write_request, so that other connections go on
+static void replay_schedule(struct connection *c, int pkt_id, apr_time_t due)
+{
+    int i;
+
+    if (!g_replay_heap)
+        g_replay_heap = xcalloc(concurrency, sizeof(struct connection *));
+    c->pkt_scheduled = 1;
+    c->pkt_id = pkt_id;
+    c->pkt_due = due;
+    c->pkt_wait = apr_time_now();
+    // nothing to poll until its packet is sent
+    set_polled_events(c, 0);
+
+    i = g_replay_heap_len++;
+    g_replay_heap[i] = c;
+    while (i > 0 && g_replay_heap[(i - 1) / 2]->pkt_due > g_replay_heap[i]->pkt_due) {
+        replay_heap_swap(i, (i - 1) / 2);
+        i = (i - 1) / 2;
+    }
+} // end of replay_schedule
+
+// the timeout of polling, which wakes up for the earliest scheduled packet
+static apr_interval_time_t replay_timeout(apr_interval_time_t timeout)
+{
+    apr_interval_time_t wait;
+
+    if (!g_replay_heap_len)
+        return timeout;
+    wait = g_replay_heap[0]->pkt_due - apr_time_now();
+    return ap_max(0, ap_min(wait, timeout));
+} // end of replay_timeout
+
+// send the scheduled packets whose time has come
+static void replay_release(void)
+{
+    apr_time_t now = lasttime = apr_time_now();
+
+    while (g_replay_heap_len && g_replay_heap[0]->pkt_due <= now) {
+        struct connection *c = g_replay_heap[0];
+        int i = 0;
+
+        g_replay_heap[0] = g_replay_heap[--g_replay_heap_len];
+        while (1) {
+            int smallest = i, left = 2 * i + 1, right = 2 * i + 2;
+            if (left < g_replay_heap_len && g_replay_heap[left]->pkt_due < g_replay_heap[smallest]->pkt_due)
+                smallest = left;
+            if (right < g_replay_heap_len && g_replay_heap[right]->pkt_due < g_replay_heap[smallest]->pkt_due)
+                smallest = right;
+            if (smallest == i)
+                break;
+            replay_heap_swap(i, smallest);
+            i = smallest;
+        }
+        // the waiting isn't a part of the latency of the timed packet,
+        // the latency of "-M" is measured from the intended start time
+        c->start += now - c->pkt_wait;
+        write_request(c);
+    }
+} // end of replay_release
+
+// record how late a timed packet or a request of "-M" was sent
+static void replay_record_lag(apr_interval_time_t lag)
+{
+    hist_record(&g_lag_hist, lag);
+} // end of replay_record_lag
+
+// print out the schedule lag of timed packets or requests of "-M"
+static void output_replay_lags(void)
+{
+    apr_interval_time_t lags[6];
+    int lag_percs[] = {50, 90, 99};
+    int i;
+
+    if (!g_lag_hist.count)
+        return;
+    lags[0] = g_lag_hist.min;
+    lags[1] = hist_mean(&g_lag_hist);
+    for (i = 0; i < 3; i++)
+        lags[i + 2] = hist_percentile(&g_lag_hist, lag_percs[i]);
+    lags[5] = g_lag_hist.max;
+    if (!g_us_granularity)
+        for (i = 0; i < 6; i++)
+            lags[i] = ap_round_ms(lags[i]);
+
+    if (g_rate_stage_count) {
+        printf("Target rate:            %s [#/sec]\n", g_rate_profile);
+        printf("Scheduled requests:     %lu\n", g_lag_hist.count);
+    } else
+        printf("Timed packets:          %lu (speed x%.2f)\n", g_lag_hist.count, g_replay_speed);
+    printf("Schedule lag (%s):      min %" APR_TIME_T_FMT ", mean %" APR_TIME_T_FMT
+           ", 50%% %" APR_TIME_T_FMT ", 90%% %" APR_TIME_T_FMT ", 99%% %" APR_TIME_T_FMT
+           ", max %" APR_TIME_T_FMT "\n", g_us_granularity ? "us" : "ms",
+           lags[0], lags[1], lags[2], lags[3], lags[4], lags[5]);
+} // end of output_replay_lags
+
+// parse a rate of "-M" as "-R", e.g. 10k, return the end of the rate
+static const char *parse_rate(const char *rate_string, double *rate)
+{
+    char *end;
+
+    *rate = strtod(rate_string, &end);
+    if (end == rate_string || *rate < 0)
+        err("Invalid rate of -M\n");
+    if (*end == 'k' || *end == 'K')
+        *rate *= 1000, end++;
+    else if (*end == 'm' || *end == 'M')
+        *rate *= 1000000, end++;
+    else if (*end == 'g' || *end == 'G')
+        *rate *= 1000000000, end++;
+    return end;
+} // end of parse_rate
+
+// parse the target rate profile of "-M", stages are separated by ',',
+// e.g. "1k" for a constant rate, "100-1k@30" for a ramp in 30 seconds,
+// "100@10,200@10,400" for steps. The last stage lasts to the end
+static void parse_rate_profile(const char *profile)
+{
+    const char *position = profile;
+
+    g_rate_profile = profile;
+    g_rate_stage_count = 0;
+    while (1) {
+        struct _g_rate_stages_ *stage;
+
+        if (g_rate_stage_count == MAX_RATE_STAGES)
+            err("Too many stages of -M\n");
+        stage = &g_rate_stages[g_rate_stage_count++];
+        position = parse_rate(position, &stage->rate_from);
+        stage->rate_to = stage->rate_from;
+        if (*position == '-')
+            position = parse_rate(position + 1, &stage->rate_to);
+        stage->duration = 0;
+        if (*position == '@') {
+            char *end;
+            stage->duration = strtod(position + 1, &end);
+            if (end == position + 1 || stage->duration <= 0)
+                err("Invalid duration of -M\n");
+            position = end;
+        }
+        if (*position != ',')
+            break;
+        // only the last stage may last to the end
+        if (!stage->duration)
+            err("Invalid rate profile of -M, a stage needs @seconds\n");
+        position++;
+    }
+    if (*position)
+        err("Invalid rate profile of -M\n");
+    if (g_rate_stages[g_rate_stage_count - 1].rate_from != g_rate_stages[g_rate_stage_count - 1].rate_to
+        && !g_rate_stages[g_rate_stage_count - 1].duration)
+        err("Invalid rate profile of -M, a ramp needs @seconds\n");
+    if (g_rate_stages[g_rate_stage_count - 1].rate_to <= 0)
+        err("Invalid rate profile of -M, the last rate must be positive\n");
+} // end of parse_rate_profile
+
+// the intended start time of the n-th request from the start of test,
+// it's where the number of requests integrated over the rate profile
+// reaches n, n never decreases between calls
+static apr_interval_time_t rate_offset(ulong n)
+{
+    static int i = 0;                   // the current stage
+    static double stage_start = 0;      // seconds before the current stage
+    static double stage_requests = 0;   // requests before the current stage
+    double a, b, requests, seconds;
+
+    while (i < g_rate_stage_count && g_rate_stages[i].duration) {
+        requests = (g_rate_stages[i].rate_from + g_rate_stages[i].rate_to) / 2 * g_rate_stages[i].duration;
+        if (n < stage_requests + requests)
+            break;
+        stage_requests += requests;
+        stage_start += g_rate_stages[i].duration;
+        i++;
+    }
+    requests = n - stage_requests;
+    if (i == g_rate_stage_count) {
+        // hold the end rate of the last stage
+        seconds = requests / g_rate_stages[i - 1].rate_to;
+    } else {
+        a = g_rate_stages[i].rate_from;
+        b = g_rate_stages[i].rate_to;
+        if (a == b)
+            seconds = requests / a;
+        else if (requests <= 0)
+            seconds = 0;
+        else {
+            // solve a*t + (b-a)/duration*t^2/2 = requests
+            double slope = (b - a) / g_rate_stages[i].duration;
+            seconds = 2 * requests / (a + sqrt(a * a + 2 * slope * requests));
+        }
+    }
+    return (apr_interval_time_t)((stage_start + seconds) * APR_USEC_PER_SEC);
+} // end of rate_offset
+
 // write a string (end with '\0') to file with apr_file_write
 static  apr_status_t apr_fprintf(apr_file_t *fd, char *string)
 {
@@ -925,8 +1584,7 @@ void print_progress(int forced_print )
 	static int prev_bad, prev_err_conn, prev_err_recv, prev_err_length, prev_err_except;
 	static int prev_epipe, prev_err_response;
 	static apr_int64_t prev_totalbread, prev_totalposted, prev_totalread;
-	static int sample_start = 0;
-	
+    int i;
 
     time_now = apr_time_now();
     if (forced_print || (time_now - prev_heartbeat_time >= g_interval_print)) {
@@ -946,87 +1604,21 @@ void print_progress(int forced_print )
             fprintf(stderr, "%2d: Completed %6d requests, rate is %lld #/sec.\n", 
                 ++heartbeats_num, done, (long long int)(APR_USEC_PER_SEC * (done - prev_done)/delta_t));
 			else { 	// print out additional info
-		        apr_time_t totalcon = 0, total = 0, totald = 0, totalwait = 0;
-		        apr_time_t meancon, meantot, meand, meanwait;
-		        apr_interval_time_t mincon = AB_MAX, mintot = AB_MAX, mind = AB_MAX,
-		                            minwait = AB_MAX;
-		        apr_interval_time_t maxcon = 0, maxtot = 0, maxd = 0, maxwait = 0;
-		        apr_interval_time_t mediancon = 0, mediantot = 0, mediand = 0, medianwait = 0;
-		        double sdtot = 0, sdcon = 0, sdd = 0, sdwait = 0;
-				int req_num = done - prev_done;	
-				
-				if (req_num > 0){
-			        /* work out connection times */
-			        int i;
-
-			        for (i = 0; i < req_num; i++) {
-			            struct data *s = &stats[(i+sample_start)%g_stats_window];
-			            mincon = ap_min(mincon, s->ctime);
-			            mintot = ap_min(mintot, s->time);
-			            mind = ap_min(mind, s->time - s->ctime);
-			            minwait = ap_min(minwait, s->waittime);
-
-			            maxcon = ap_max(maxcon, s->ctime);
-			            maxtot = ap_max(maxtot, s->time);
-			            maxd = ap_max(maxd, s->time - s->ctime);
-			            maxwait = ap_max(maxwait, s->waittime);
-
-			            totalcon += s->ctime;
-			            total += s->time;
-			            totald += s->time - s->ctime;
-			            totalwait += s->waittime;
-			        }
-			        meancon = totalcon / req_num;
-			        meantot = total / req_num;
-			        meand = totald / req_num;
-			        meanwait = totalwait / req_num;
-
-			        /* calculating the sample variance: the sum of the squared deviations, divided by n-1 */
-			        for (i = 0; i < req_num; i++) {
-			            struct data *s = &stats[(i+sample_start)%g_stats_window];
-			            double a;
-			            a = ((double)s->time - meantot);
-			            sdtot += a * a;
-			            a = ((double)s->ctime - meancon);
-			            sdcon += a * a;
-			            a = ((double)s->time - (double)s->ctime - meand);
-			            sdd += a * a;
-			            a = ((double)s->waittime - meanwait);
-			            sdwait += a * a;
-			        }
-
-			        sdtot = (req_num > 1) ? sqrt(sdtot / (req_num - 1)) : 0;
-			        sdcon = (req_num > 1) ? sqrt(sdcon / (req_num - 1)) : 0;
-			        sdd = (req_num > 1) ? sqrt(sdd / (req_num - 1)) : 0;
-			        sdwait = (req_num > 1) ? sqrt(sdwait / (req_num - 1)) : 0;
-
-			        if (!g_us_granularity) {
-						/*
-						 * Reduce stats from apr time to milliseconds
-						 */
-						mincon     = ap_round_ms(mincon);
-						mind       = ap_round_ms(mind);
-						minwait    = ap_round_ms(minwait);
-						mintot     = ap_round_ms(mintot);
-						meancon    = ap_round_ms(meancon);
-						meand      = ap_round_ms(meand);
-						meanwait   = ap_round_ms(meanwait);
-						meantot    = ap_round_ms(meantot);
-						mediancon  = ap_round_ms(mediancon);
-						mediand    = ap_round_ms(mediand);
-						medianwait = ap_round_ms(medianwait);
-						mediantot  = ap_round_ms(mediantot);
-						maxcon     = ap_round_ms(maxcon);
-						maxd       = ap_round_ms(maxd);
-						maxwait    = ap_round_ms(maxwait);
-						maxtot     = ap_round_ms(maxtot);
-						sdcon      = ap_double_ms(sdcon);
-						sdd        = ap_double_ms(sdd);
-						sdwait     = ap_double_ms(sdwait);
-						sdtot      = ap_double_ms(sdtot);
-			       }
-			    }			
-				sample_start = (sample_start + req_num)%g_stats_window;
+				// the latencies of this interval are in its own histogram,
+				// so the cost doesn't depend on the number of requests
+				struct histogram *h = &g_interval_hists[HIST_TOTAL];
+				apr_interval_time_t mintot = h->min, maxtot = h->max, meantot = hist_mean(h);
+				double sdtot = hist_sd(h);
+
+				if (!g_us_granularity) {
+					/*
+					 * Reduce stats from apr time to milliseconds
+					 */
+					mintot = ap_round_ms(mintot);
+					maxtot = ap_round_ms(maxtot);
+					meantot = ap_round_ms(meantot);
+					sdtot = ap_double_ms(sdtot);
+				}
 				
 				//fprintf(stderr, "\nTime Req(#/sec) Recv(kBps) Failed(C/R/L/E/W/Non-2xx)");
 				fprintf(stderr, "%-5d%-11lld%-11lld", 
@@ -1067,6 +1659,12 @@ void print_progress(int forced_print )
 
             fflush(stderr);
             prev_done = done;
+
+            // save the snapshot of this interval, then start the next one
+            for (i = 0; i < HIST_KINDS; i++) {
+                save_histogram(heartbeats_num, g_hist_names[i], &g_interval_hists[i]);
+                hist_reset(&g_interval_hists[i]);
+            }
         }
         prev_heartbeat_time = time_now;
 
@@ -1085,15 +1683,121 @@ int compare_pkt_by_time_to_send(const void * pkt1,const void * pkt2) {
         return -1;
     } else if (ppkt1->pkt_time_to_send > ppkt2->pkt_time_to_send) {
         return 1;
-    } else if (ppkt1->pkt_data < ppkt2->pkt_data) {
+#ifdef _WAF_BENCH_ // keep the order of packets file, the same bytes may be shared by its index
+    } else if (ppkt1->pkt_seq < ppkt2->pkt_seq) {
         return -1;
-    } else if (ppkt1->pkt_data > ppkt2->pkt_data) {
+    } else if (ppkt1->pkt_seq > ppkt2->pkt_seq) {
         return 1;
+#endif
     } else {
         return 0;
     }
 }
 
+/* the sidecar index of packets file, see pywb/packetsindex.py */
+#define PKT_INDEX_SUFFIX        ".idx"
+#define PKT_INDEX_MAGIC         "WBPKTIDX"
+#define PKT_INDEX_VERSION       1
+#define PKT_INDEX_HEADER_SIZE   32  /* magic, version, reserved, count, size */
+#define PKT_INDEX_ENTRY_SIZE    24  /* offset, length, time to send         */
+
+/* decode a little endian integer of the packets index */
+static apr_uint64_t pkt_index_integer(const unsigned char *p, int bytes)
+{
+    apr_uint64_t value = 0;
+    while (bytes-- > 0)
+        value = (value << 8) | p[bytes];
+    return value;
+}
+
+/* load packets by the index (<pfile>.idx) of a regular packets file,
+ * so the packets aren't parsed, and only the packets within -Q are read.
+ * return the number of loaded packets, 0 if there isn't a valid index */
+static ulong open_pktindex(const char *pfile, apr_file_t *pktfd, const apr_finfo_t *pkt_finfo)
+{
+    apr_file_t *idxfd;
+    apr_finfo_t finfo;
+    apr_status_t rv;
+    unsigned char header[PKT_INDEX_HEADER_SIZE];
+    unsigned char *entries = NULL, *entry;
+    apr_uint64_t count, data_size, offset, length, end = 0;
+    ulong i, pkt_count = 0;
+    char errmsg[120];
+
+    rv = apr_file_open(&idxfd, apr_pstrcat(cntxt, pfile, PKT_INDEX_SUFFIX, NULL),
+                       APR_READ, APR_OS_DEFAULT, cntxt);
+    if (rv != APR_SUCCESS)
+        return 0;
+    // an index older than the packets file is stale
+    if (apr_file_info_get(&finfo, APR_FINFO_NORM, idxfd) != APR_SUCCESS
+        || finfo.mtime < pkt_finfo->mtime
+        || apr_file_read_full(idxfd, header, sizeof header, NULL) != APR_SUCCESS
+        || memcmp(header, PKT_INDEX_MAGIC, 8) != 0
+        || pkt_index_integer(header + 8, 4) != PKT_INDEX_VERSION)
+        goto no_index;
+
+    count = pkt_index_integer(header + 16, 8);
+    data_size = pkt_index_integer(header + 24, 8);
+    if (data_size != (apr_uint64_t)pkt_finfo->size || count == 0
+        || (apr_uint64_t)finfo.size < PKT_INDEX_HEADER_SIZE + count * PKT_INDEX_ENTRY_SIZE)
+        goto no_index;
+    if (g_MAX_PKT_COUNT && count > g_MAX_PKT_COUNT)
+        count = g_MAX_PKT_COUNT;
+
+    entries = xmalloc(count * PKT_INDEX_ENTRY_SIZE);
+    if (apr_file_read_full(idxfd, entries, count * PKT_INDEX_ENTRY_SIZE, NULL) != APR_SUCCESS)
+        goto no_index;
+    for (i = 0, entry = entries; i < count; i++, entry += PKT_INDEX_ENTRY_SIZE) {
+        offset = pkt_index_integer(entry, 8);
+        length = pkt_index_integer(entry + 8, 8);
+        if (offset + length > data_size || length > INT_MAX)
+            goto no_index;
+        if (offset + length > end)
+            end = offset + length;
+    }
+    apr_file_close(idxfd);
+
+    // read the packets file up to the end of the last loaded packet
+    g_pkt_length = (apr_size_t)end;
+    g_pkt_data = xmalloc(g_pkt_length + 1);
+    g_pkt_data[g_pkt_length] = '\0';
+    rv = apr_file_read_full(pktfd, g_pkt_data, g_pkt_length, NULL);
+    if (rv != APR_SUCCESS) {
+        fprintf(stderr, "wb: Could not read PKT data file: %s\n",
+                apr_strerror(rv, errmsg, sizeof errmsg));
+        exit(1);
+    }
+
+    g_pkt_array = xcalloc((size_t)count, sizeof(struct _g_pkt_array_));
+    for (i = 0, entry = entries; i < count; i++, entry += PKT_INDEX_ENTRY_SIZE) {
+        length = pkt_index_integer(entry + 8, 8);
+        // ignore the packets that parse_pktfile ignores
+        if (length < 4)
+            continue;
+        g_pkt_array[pkt_count].pkt_data = g_pkt_data + pkt_index_integer(entry, 8);
+        g_pkt_array[pkt_count].pkt_length = (int)length;
+        g_pkt_array[pkt_count].pkt_time_to_send = (apr_time_t)pkt_index_integer(entry + 16, 8);
+        g_pkt_array[pkt_count].pkt_seq = i;
+        pkt_count++;
+    }
+    free(entries);
+    if (pkt_count == 0) {
+        // no valid packet is indexed, let parse_pktfile report it
+        apr_off_t start = 0;
+        free(g_pkt_array);
+        free(g_pkt_data);
+        g_pkt_array = NULL;
+        g_pkt_data = NULL;
+        apr_file_seek(pktfd, APR_SET, &start);
+    }
+    return pkt_count;
+
+no_index:
+    if (entries) free(entries);
+    apr_file_close(idxfd);
+    return 0;
+} // end of open_pktindex
+
 /* read packets from file, save contents and length to global variables */
 static apr_status_t open_pktfile(const char *pfile)
 {
@@ -1116,43 +1820,93 @@ static apr_status_t open_pktfile(const char *pfile)
         return rv;
     }
 
-    // allocate memeory for g_pkt_data to hold the entire file
-    g_pkt_length = (apr_size_t)finfo.size;
-    if (g_pkt_length <= 0) {
-        fprintf(stderr, "wb: packets file(%s) is empty!\n", pfile);
-        apr_file_close(pktfd);
-        goto err_exit;
-    }
-    
     if (g_pkt_data) free(g_pkt_data);
-    g_pkt_data = xmalloc(g_pkt_length);
-    memset(g_pkt_data, 0, g_pkt_length);
+    g_pkt_data = NULL;
+    if (finfo.filetype == APR_REG
+        && (g_pkt_count = open_pktindex(pfile, pktfd, &finfo)) > 0) {
+        // the packets have been located by the index
+    } else if (finfo.filetype == APR_REG) {
+        // allocate memeory for g_pkt_data to hold the entire file
+        // and one more '\0' to terminate the last packet
+        g_pkt_length = (apr_size_t)finfo.size;
+        g_pkt_data = xmalloc(g_pkt_length + 1);
+        memset(g_pkt_data, 0, g_pkt_length + 1);
+
+        // read pkt file entirely into memory (g_pkt_data) and then close
+        rv = apr_file_read_full(pktfd, g_pkt_data, g_pkt_length, NULL);
+        if (rv != APR_SUCCESS) {
+            fprintf(stderr, "wb: Could not read PKT data file: %s\n",
+                    apr_strerror(rv, errmsg, sizeof errmsg));
+            return rv;
+        }
+    } else {
+        // a pipe or FIFO (e.g. streamed by pywb) has no size,
+        // so read it until EOF with a growing buffer
+        apr_size_t buffer_size = 1 << 20;
+        apr_size_t read_bytes;
 
-    // read pkt file entirely into memory (g_pkt_data) and then close
-    rv = apr_file_read_full(pktfd, g_pkt_data, g_pkt_length, NULL);
-    if (rv != APR_SUCCESS) {
-        fprintf(stderr, "wb: Could not read PKT data file: %s\n",
-                apr_strerror(rv, errmsg, sizeof errmsg));
-        return rv;
+        g_pkt_length = 0;
+        g_pkt_data = xmalloc(buffer_size + 1);
+        do {
+            if (g_pkt_length == buffer_size) {
+                char *new_data;
+                buffer_size <<= 1;
+                new_data = xmalloc(buffer_size + 1);
+                memcpy(new_data, g_pkt_data, g_pkt_length);
+                free(g_pkt_data);
+                g_pkt_data = new_data;
+            }
+            read_bytes = buffer_size - g_pkt_length;
+            rv = apr_file_read(pktfd, g_pkt_data + g_pkt_length, &read_bytes);
+            g_pkt_length += read_bytes;
+        } while (rv == APR_SUCCESS);
+        if (!APR_STATUS_IS_EOF(rv)) {
+            fprintf(stderr, "wb: Could not read PKT data stream: %s\n",
+                    apr_strerror(rv, errmsg, sizeof errmsg));
+            return rv;
+        }
+        g_pkt_data[g_pkt_length] = '\0';
     }
     apr_file_close(pktfd);
 
-    // now processing those packets, and get the packets number 
-    // First, malloc space for pkt array to save the starting pointer of those sent packets
-    if (g_MAX_PKT_COUNT == 0) // parse the packets string to get their count
-        g_MAX_PKT_COUNT = parse_pktfile(g_pkt_data, NULL);
-    
-    if (g_MAX_PKT_COUNT == 0) {
-        fprintf(stderr, "wb: packets file(%s) is invalid!\n", pfile);
+    if (g_pkt_length <= 0) {
+        fprintf(stderr, "wb: packets file(%s) is empty!\n", pfile);
         goto err_exit;
     }
 
-    // allocate packet array memory and parse the packets again to save them
-    g_pkt_array = xcalloc(g_MAX_PKT_COUNT, sizeof(struct _g_pkt_array_));
-    g_pkt_count = parse_pktfile(g_pkt_data, g_pkt_array);
+    if (g_pkt_count == 0) {
+        // now processing those packets, and get the packets number 
+        // First, malloc space for pkt array to save the starting pointer of those sent packets
+        if (g_MAX_PKT_COUNT == 0) // parse the packets string to get their count
+            g_MAX_PKT_COUNT = parse_pktfile(g_pkt_data, NULL);
+    
+        if (g_MAX_PKT_COUNT == 0) {
+            fprintf(stderr, "wb: packets file(%s) is invalid!\n", pfile);
+            goto err_exit;
+        }
+
+        // allocate packet array memory and parse the packets again to save them
+        g_pkt_array = xcalloc(g_MAX_PKT_COUNT, sizeof(struct _g_pkt_array_));
+        g_pkt_count = parse_pktfile(g_pkt_data, g_pkt_array);
+    }
     //sort pkt by time
     if (g_pkt_count > 1) {
+#ifdef _WAF_BENCH_ // the groups of "-9" are ranges of packets file, so their order is kept
+        if (g_mix_filename) {
+            ulong i;
+            for (i = 1; i < g_pkt_count; i++)
+                if (g_pkt_array[i].pkt_time_to_send != g_pkt_array[0].pkt_time_to_send)
+                    g_pkt_timed = !g_rate_stage_count;
+        } else {
+#endif
         qsort(g_pkt_array, g_pkt_count, sizeof(struct _g_pkt_array_), compare_pkt_by_time_to_send);
+        // packets are sent at their time only if they have different times,
+        // and the target rate of "-M" overrides their time
+        g_pkt_timed = g_pkt_array[g_pkt_count - 1].pkt_time_to_send > g_pkt_array[0].pkt_time_to_send
+            && !g_rate_stage_count;
+#ifdef _WAF_BENCH_ // the groups of "-9" are ranges of packets file, so their order is kept
+        }
+#endif
     }
     if (g_pkt_count > 1)
         nolength = 1; // no constant packet length if g_pkt_count >= 2
@@ -1169,6 +1923,7 @@ err_exit:
 static ulong parse_pktfile(char *pkt_data, struct _g_pkt_array_ *pkt_array)
 {
     ulong pkt_count = 0;
+    ulong pkt_seq = 0; // the empty packets aren't counted, as pywb does
     apr_size_t parsed_bytes = 0;
     char *p = pkt_data, *p2 = pkt_data, *p_digits;
     struct _g_pkt_array_ _pkt, *pkt;
@@ -1192,6 +1947,9 @@ static ulong parse_pktfile(char *pkt_data, struct _g_pkt_array_ *pkt_array)
             // move to next packet by increment pkt_count
             // '\0' is seperator, use strlen to get the position of next packet
             pkt->pkt_length = strlen(pkt->pkt_data);
+            pkt->pkt_seq = pkt_seq;
+            if (pkt->pkt_length > 0)
+                pkt_seq++;
 
             // remove '\0' by +1
             parsed_bytes += pkt->pkt_length + 1;
@@ -1256,7 +2014,8 @@ static ulong parse_pktfile(char *pkt_data, struct _g_pkt_array_ *pkt_array)
 				break;
 			c = *p2; 
 			*p2 = 0;
-			// use string scanf to fetch numbers
+			// use string scanf to fetch numbers, the time to send is optional
+			time_sec = time_usec = 0;
 			sscanf(p,"%lu %lu.%lu",&l_pkt_size, &time_sec, &time_usec);
 			*p2 = c;
 
@@ -1271,6 +2030,7 @@ static ulong parse_pktfile(char *pkt_data, struct _g_pkt_array_ *pkt_array)
 	            pkt->pkt_data = p;
 	            pkt->pkt_length = l_pkt_size;
 				pkt->pkt_time_to_send = time_sec * 1000000 + time_usec;
+				pkt->pkt_seq = pkt_count;
 
 				parsed_bytes = p - g_pkt_data;
 
@@ -1421,28 +2181,91 @@ static apr_status_t write_inifile(const char *pfile,  int argc, char **argv)
     return APR_SUCCESS;
 } // end of write_inifile
 
-// save received http messages to log file
-void save_logfile (char * buf, apr_size_t buflen)   
+// write all of len bytes of buf to output file
+static void write_save_file_fully(const char *buf, apr_size_t len)
 {
     apr_status_t rv;
     char errmsg[120];
-    char size_str[128];
-    static int need_add_LN = 0;
-    
-    apr_size_t need_save_length = buflen;
     apr_size_t saved_len = 0;
     apr_size_t next_save_length;
 
-    if (!g_save_file_fd) {
+    while (saved_len < len) {
+        next_save_length = len - saved_len;
+        rv = apr_file_write(g_save_file_fd, buf + saved_len, &next_save_length);
+        if (rv != APR_SUCCESS) {
+            fprintf(stderr, "wb: Could not write output file: %s\n",
+                    apr_strerror(rv, errmsg, sizeof errmsg));
+            g_save_file_fd = NULL; // don't flush again at exit
+            exit(1);
+        }
+        saved_len += next_save_length;
+    }
+} // end of write_save_file_fully
+
+// write the buffered bytes to output file
+static void flush_save_file(void)
+{
+    write_save_file_fully(g_save_buf, g_save_buf_len);
+    g_save_buf_len = 0;
+} // end of flush_save_file
+
+// append len bytes to output file through the buffer
+static void write_save_file(const char *buf, apr_size_t len)
+{
+    if (!len)
         return;
+    if (g_save_buf_len + len > SAVE_BUFFER_SIZE)
+        flush_save_file();
+    if (len > SAVE_BUFFER_SIZE)
+        write_save_file_fully(buf, len);
+    else {
+        memcpy(g_save_buf + g_save_buf_len, buf, len);
+        g_save_buf_len += len;
     }
+    g_saved_bytes += len;
+} // end of write_save_file
+
+// if len more bytes exceed "-G", keep the full segment as <msg_file>.1
+// and start a new segment, so that a record is never split or overwritten.
+// return 1 if a new segment is started
+static int rotate_save_file(apr_size_t len)
+{
+    apr_status_t rv;
+    char errmsg[120];
+    apr_size_t empty_len = g_save_binary ? CAPTURE_MAGIC_LEN : 0;
+    char *old_filename;
+
+    if (!g_MAX_FILE_SIZE || g_saved_bytes + len <= g_MAX_FILE_SIZE
+        || g_saved_bytes <= empty_len)
+        return 0;
+    flush_save_file();
+    apr_file_close(g_save_file_fd);
+    old_filename = apr_pstrcat(cntxt, g_save_filename, ".1", NULL);
+    rv = apr_file_rename(g_save_filename, old_filename, cntxt);
+    if (rv != APR_SUCCESS) {
+        fprintf(stderr, "wb: Could not rotate output file to %s: %s\n", old_filename,
+                apr_strerror(rv, errmsg, sizeof errmsg));
+        g_save_file_fd = NULL;
+        exit(1);
+    }
+    if (open_file_for_write(g_save_filename, &g_save_file_fd) != APR_SUCCESS) {
+        g_save_file_fd = NULL;
+        exit(1);
+    }
+    g_saved_bytes = 0;
+    if (g_save_binary)
+        write_save_file(CAPTURE_MAGIC, CAPTURE_MAGIC_LEN);
+    return 1;
+} // end of rotate_save_file
+
+// save received http messages to log file
+void save_logfile (char * buf, apr_size_t buflen)   
+{
+    char size_str[128];
+    static int need_add_LN = 0;
 
-    // if exceeding max file size, rewind it to the beginning
-    g_saved_bytes += need_save_length;
-    if (g_MAX_FILE_SIZE > 0 && g_saved_bytes >= g_MAX_FILE_SIZE) {
-        apr_off_t pos = 0;
-        apr_file_seek(g_save_file_fd, APR_SET, &pos);
-        g_saved_bytes = need_save_length;
+    if (!g_save_file_fd) {
+        return;
     }
 
     // buf == NULL means writing the ending "0" to log file
@@ -1454,44 +2277,420 @@ void save_logfile (char * buf, apr_size_t buflen)
     } else
         buflen = 0;
     
+    // a new segment starts without the line end of the last message
+    if (rotate_save_file(buflen + need_add_LN + 24))
+        need_add_LN = 0;
     if (need_add_LN) {
         sprintf(size_str,"\n%zu\n",buflen);
     } else 
         sprintf(size_str,"%zu\n",buflen);
     
-    next_save_length = strlen(size_str);
-    rv = apr_file_write(g_save_file_fd, size_str, &next_save_length);
-    if (rv != APR_SUCCESS) {
-        fprintf(stderr, "wb: Could not write response size to output file: %s\n", 
-                apr_strerror(rv, errmsg, sizeof errmsg));
-        exit(1);
-    }
-    
-    // make sure we save all need_save_length to output file
-    need_save_length = buflen;
-    saved_len = 0;  
-    do {
-        next_save_length = need_save_length - saved_len;
-        rv = apr_file_write(g_save_file_fd, buf + saved_len, &next_save_length);
-        if (rv != APR_SUCCESS) {
-            fprintf(stderr, "wb: Could not write output file: %s\n", 
-                    apr_strerror(rv, errmsg, sizeof errmsg));
-            exit(1);
-        }
-        saved_len += next_save_length;
-    }while (saved_len < need_save_length);
+    write_save_file(size_str, strlen(size_str));
+    write_save_file(buf, buflen);
 
     if (buf && buflen > 0)
         need_add_LN = !(buf[buflen - 1] == '\n');
 } // end of save_logfile: file to save received http messages
 
+// the response code of the status line at the beginning of buf, 0 if it's absent
+static int parse_status(const char *buf, apr_size_t len)
+{
+    const char *p = buf + strlen("HTTP/1.x_");
+
+    if (len < strlen("HTTP/1.x_") + 3 || strncmp(buf, "HTTP/", 5)
+        || !apr_isdigit(p[0]) || !apr_isdigit(p[1]) || !apr_isdigit(p[2]))
+        return 0;
+    return (p[0] - '0') * 100 + (p[1] - '0') * 10 + (p[2] - '0');
+} // end of parse_status
+
+// save the bytes received by c as a binary record of "-7"
+static void save_capture(struct connection *c, int kind, const char *buf, apr_size_t len)
+{
+    unsigned char header[CAPTURE_HEADER_LEN];
+    apr_uint32_t pkt_seq = g_pkt_length ? g_pkt_array[c->pkt_id].pkt_seq : 0;
+    apr_uint32_t connection = (apr_uint32_t)(c - con);
+    apr_uint64_t now = (apr_uint64_t)ap_max(0, apr_time_now() - start);
+    int status = kind == CAPTURE_FIRST ? parse_status(buf, len) : c->pkt_status;
+    int i;
+
+    if (!g_save_file_fd)
+        return;
+    rotate_save_file(CAPTURE_HEADER_LEN + len);
+    for (i = 0; i < 4; i++) {
+        header[i] = (unsigned char)(len >> (24 - i * 8));
+        header[8 + i] = (unsigned char)(pkt_seq >> (24 - i * 8));
+        header[12 + i] = (unsigned char)(connection >> (24 - i * 8));
+    }
+    header[4] = (unsigned char)kind;
+    header[5] = 0;
+    header[6] = (unsigned char)(status >> 8);
+    header[7] = (unsigned char)status;
+    for (i = 0; i < 8; i++)
+        header[16 + i] = (unsigned char)(now >> (56 - i * 8));
+    write_save_file((const char *)header, CAPTURE_HEADER_LEN);
+    write_save_file(buf, len);
+} // end of save_capture
+
+// flush and close output file, it's also called at exit
+static void close_save_file(void)
+{
+    if (!g_save_file_fd)
+        return;
+    if (!g_save_binary)
+        save_logfile(NULL, 0);
+    flush_save_file();
+    apr_file_close(g_save_file_fd);
+    g_save_file_fd = NULL;
+} // end of close_save_file
+
+// open output file of "-o" and its buffer
+static apr_status_t open_save_file(const char *filename)
+{
+    apr_status_t rv;
+
+    rv = open_file_for_write(filename, &g_save_file_fd);
+    if (rv != APR_SUCCESS)
+        return rv;
+    g_save_buf = xmalloc(SAVE_BUFFER_SIZE);
+    if (g_save_binary)
+        write_save_file(CAPTURE_MAGIC, CAPTURE_MAGIC_LEN);
+    // the buffered messages are saved even if wb exits early
+    atexit(close_save_file);
+    return APR_SUCCESS;
+} // end of open_save_file
+
+// find needle in the len bytes of haystack, the packets aren't '\0' terminated
+static const char *find_bytes(const char *haystack, apr_size_t len,
+                              const char *needle, apr_size_t needle_len, int nocase)
+{
+    const char *end = haystack + len;
+    for (; (apr_size_t)(end - haystack) >= needle_len; haystack++) {
+        if (nocase ? !strncasecmp(haystack, needle, needle_len)
+                   : !memcmp(haystack, needle, needle_len))
+            return haystack;
+    }
+    return NULL;
+}
+
+// append a segment to the template, data NULL is a slot of <seq#>
+static void template_append(struct pkt_template *tmpl, const char *data, apr_size_t len)
+{
+    if (data && !len)
+        return;
+    if (tmpl->segment_count % 16 == 0) {
+        struct _tmpl_segment_ *segments;
+        segments = xmalloc((tmpl->segment_count + 16) * sizeof(struct _tmpl_segment_));
+        if (tmpl->segments) {
+            memcpy(segments, tmpl->segments, tmpl->segment_count * sizeof(struct _tmpl_segment_));
+            free(tmpl->segments);
+        }
+        tmpl->segments = segments;
+    }
+    tmpl->segments[tmpl->segment_count].data = data;
+    tmpl->segments[tmpl->segment_count].len = len;
+    tmpl->segment_count++;
+    if (data)
+        tmpl->literal_len += len;
+    else
+        tmpl->slot_count++;
+}
+
+// append the bytes of a packet, split by the sub_strings of "-J" into slots
+static void template_append_literal(struct pkt_template *tmpl, const char *data, apr_size_t len)
+{
+    const char *end = data + len;
+    while (data < end) {
+        const char *sub = NULL;
+        apr_size_t sub_len = 0;
+        int i;
+        // the first sub_string in the remaining bytes wins
+        for (i = 0; i < g_sub_string_num; i++) {
+            apr_size_t len_i = strlen(g_sub_string[i]);
+            const char *found;
+            if (!len_i)
+                continue;
+            found = find_bytes(data, (sub ? sub : end) - data, g_sub_string[i], len_i, 0);
+            if (found && (!sub || found < sub))
+                sub = found, sub_len = len_i;
+        }
+        if (!sub) {
+            template_append(tmpl, data, end - data);
+            return;
+        }
+        template_append(tmpl, data, sub - data);
+        template_append(tmpl, NULL, 0);
+        data = sub + sub_len;
+    }
+}
+
+// pre-split a request into literal segments and slots of <seq#> once,
+// so that sending it needs neither parsing nor copying:
+// "-U" inserts "/URL_prefix<seq#>/" before the URL, "-J" replaces
+// the sub_strings by <seq#>, and "-2" removes or adds "Connection: Close"
+static struct pkt_template *compile_template(const char *request, apr_size_t len)
+{
+    static const char conn_str[] = "\r\nConnection: Close";
+    struct pkt_template *tmpl = xcalloc(1, sizeof(struct pkt_template));
+    const char *end = request + len;
+    const char *request_pos = request;
+    const char *header_end, *conn_hdr = NULL, *conn_hdr_end = NULL;
+
+    if (g_opt_prefix) { // prepare the URL prefix, URL:[SPACE]*METHOD[SPACE]+URL
+        // skip leading space
+        while (request_pos < end && isspace(*request_pos)) request_pos++;
+        // skip the leading HTTP methods string
+        while (request_pos < end && !isspace(*request_pos)) request_pos++;
+        // skip remaining space again
+        while (request_pos < end && isspace(*request_pos)) request_pos++;
+        if (request_pos == end && request_pos - request < 4)
+            fprintf(stderr, "Error! Request does not have a valid method:\n%.*s", (int)len, request), exit(1);
+        template_append_literal(tmpl, request, request_pos - request);
+        template_append(tmpl, "/", 1);
+        template_append(tmpl, g_opt_prefix, strlen(g_opt_prefix));
+        template_append(tmpl, NULL, 0);
+        if (request_pos == end || *request_pos != '/')
+            template_append(tmpl, "/", 1);
+    } // end of URL prefix
+
+    // the end of the header, before its 2 LNs
+    if (!(header_end = find_bytes(request_pos, end - request_pos, "\r\n\r\n", 4, 0))
+        /*
+         * this next line is so that we talk to NCSA 1.5 which blatantly
+         * breaks the http specifaction
+         */
+        && !(header_end = find_bytes(request_pos, end - request_pos, "\n\n", 2, 0))
+        && !(header_end = find_bytes(request_pos, end - request_pos, "\r\r", 2, 0))) {
+        fprintf(stderr, "Error! Request does not have a valid header(end with 2 LNs):\n%.*s", (int)len, request);
+        exit(1);
+    }
+
+    if (g_add_connection_close) {
+        conn_hdr = find_bytes(request_pos, header_end - request_pos, "\nConnection:", 12, 1);
+        if (conn_hdr && conn_hdr > request_pos && conn_hdr[-1] == '\r')
+            conn_hdr--;
+    }
+    //if always connection:close, remove old connection:type
+    if (conn_hdr && g_add_connection_close == 2) {
+        conn_hdr_end = memchr(conn_hdr + 2, '\n', header_end + 1 - (conn_hdr + 2));
+        if (!conn_hdr_end)
+            conn_hdr_end = header_end;
+        else if (conn_hdr_end[-1] == '\r')
+            conn_hdr_end--;
+        template_append_literal(tmpl, request_pos, conn_hdr - request_pos);
+        request_pos = conn_hdr_end;
+        conn_hdr = NULL;
+    }
+    template_append_literal(tmpl, request_pos, header_end - request_pos);
+    // add connection:close header to the request
+    if (g_add_connection_close && !conn_hdr)
+        template_append(tmpl, conn_str, sizeof(conn_str) - 1);
+    template_append_literal(tmpl, header_end, end - header_end);
+    return tmpl;
+}
+
+// compile the templates of all of requests, if they need to be modified
+static void compile_templates(void)
+{
+    ulong i;
+    if (!g_add_connection_close && !g_opt_prefix && !g_sub_string_num)
+        return;
+    if (!g_pkt_length) {
+        g_request_template = compile_template(request, reqlen);
+        return;
+    }
+    for (i = 0; i < g_pkt_count; i++)
+        g_pkt_array[i].pkt_template = compile_template(g_pkt_array[i].pkt_data, g_pkt_array[i].pkt_length);
+}
+
+// copy the segments in vec into a buffer, for SSL_write
+static char *template_flatten(const struct iovec *vec, int nvec, apr_size_t *len)
+{
+    static char *buffer = NULL;
+    static apr_size_t buffer_size = 0;
+    int i;
+
+    for (*len = 0, i = 0; i < nvec; i++)
+        *len += vec[i].iov_len;
+    if (*len > buffer_size) {
+        if (buffer)
+            free(buffer);
+        buffer_size = *len * 2;
+        buffer = xmalloc(buffer_size);
+    }
+    for (*len = 0, i = 0; i < nvec; i++) {
+        memcpy(buffer + *len, vec[i].iov_base, vec[i].iov_len);
+        *len += vec[i].iov_len;
+    }
+    return buffer;
+}
+
+// fill vec with the remaining bytes of the request of c, return # of vec
+static int template_iovec(struct connection *c, struct iovec *vec, int max_vec)
+{
+    const struct _tmpl_segment_ *segment = c->tmpl->segments;
+    const struct _tmpl_segment_ *segment_end = segment + c->tmpl->segment_count;
+    apr_size_t skip = c->rwrote;
+    int nvec = 0;
+
+    for (; segment < segment_end && nvec < max_vec; segment++) {
+        const char *data = segment->data ? segment->data : c->seq;
+        apr_size_t len = segment->data ? segment->len : c->seq_len;
+        if (skip >= len) {
+            skip -= len;
+            continue;
+        }
+        vec[nvec].iov_base = (void *)(data + skip);
+        vec[nvec].iov_len = len - skip;
+        nvec++;
+        skip = 0;
+    }
+    if (send_body && nvec < max_vec && skip < postlen) {
+        vec[nvec].iov_base = postdata + skip;
+        vec[nvec].iov_len = postlen - skip;
+        nvec++;
+    }
+    return nvec;
+}
+
+#ifdef USE_SSL
+// "-8", the server sent a new session, a session ID or a ticket, it's kept
+// as the latest session for the next connections to resume
+static int tls_session_new(SSL *ssl, SSL_SESSION *session)
+{
+    if (g_tls_session)
+        SSL_SESSION_free(g_tls_session);
+    g_tls_session = session;
+    return 1; // the session is kept
+} // end of tls_session_new
+
+// "-8", load the session saved by a previous run, a full handshake is done
+// if the file is absent or the session is expired
+static void tls_session_load(const char *sfile)
+{
+    FILE *f = fopen(sfile, "r");
+
+    if (!f)
+        return;
+    g_tls_session = PEM_read_SSL_SESSION(f, NULL, NULL, NULL);
+    fclose(f);
+} // end of tls_session_load
+
+// "-8", save the latest session for the next run, a regular file is replaced
+// at once, so concurrent runs never leave a truncated session
+static void tls_session_save(const char *sfile)
+{
+    apr_finfo_t finfo;
+    char *tmp = NULL;
+    FILE *f;
+
+    if (!g_tls_session)
+        return;
+    if (apr_stat(&finfo, sfile, APR_FINFO_TYPE, cntxt) != APR_SUCCESS
+        || finfo.filetype == APR_REG)
+        tmp = apr_psprintf(cntxt, "%s.%d.tmp", sfile, (int)getpid());
+    f = fopen(tmp ? tmp : sfile, "w");
+    if (!f) {
+        perror("Cannot save TLS session");
+        return;
+    }
+    PEM_write_SSL_SESSION(f, g_tls_session);
+    fclose(f);
+    if (tmp && rename(tmp, sfile)) {
+        perror("Cannot save TLS session");
+        remove(tmp);
+    }
+} // end of tls_session_save
+#endif // USE_SSL
+
+// the max # of requests in flight of a connection, a timed packet or a request
+// of "-M" is sent alone, or it would wait for the responses before it
+static int pipeline_depth(void)
+{
+    if (g_rate_stage_count || (g_pkt_timed && g_replay_speed > 0))
+        return 1;
+    return g_pipeline_depth;
+} // end of pipeline_depth
+
+// "-N", write the next request of c unless its pipeline is full
+static void pipeline_fill(struct connection *c)
+{
+    if (c->pipe_closing || c->rwrite || c->pkt_scheduled
+        || c->pipe_len - c->pipe_resend >= pipeline_depth()
+        || (!c->pipe_resend && started >= requests))
+        return;
+    // zero connect time with keep-alive
+    c->start = c->connect = lasttime = apr_time_now();
+    write_request(c);
+} // end of pipeline_fill
+
+// "-N", no more requests are written to c, e.g. the server closed it after
+// blocking a request, the responses in flight are read until it's closed
+static void pipeline_stop_writing(struct connection *c)
+{
+    c->pipe_closing = 1;
+    c->rwrite = 0;
+    set_polled_events(c, APR_POLLIN);
+} // end of pipeline_stop_writing
+
+// "-N", whether the request of c is a HEAD request, whose response has no body,
+// told by the bytes written first: the first segment of its template, or its
+// packet, rather than the buffer of the request of the command line
+static int pipeline_is_head(const struct connection *c)
+{
+    const char *data = request;
+    apr_size_t len = reqlen;
+
+    if (g_pkt_length) {
+        data = g_pkt_array[c->pkt_id].pkt_data;
+        len = g_pkt_array[c->pkt_id].pkt_length;
+    }
+    if (c->tmpl && c->tmpl->segment_count && c->tmpl->segments[0].data
+        && c->tmpl->segments[0].len >= 5) {
+        data = c->tmpl->segments[0].data;
+        len = c->tmpl->segments[0].len;
+    }
+    while (len && apr_isspace(*data)) {
+        data++;
+        len--;
+    }
+    return len >= 5 && !strncmp(data, "HEAD ", 5);
+} // end of pipeline_is_head
+
+// "-N", a request of c is written, it waits for its response in the pipeline
+static void pipeline_written(struct connection *c)
+{
+    struct pipelined_request *p;
+
+    if (c->pipe_resend) {
+        p = &c->pipeline[(c->pipe_head + c->pipe_len - c->pipe_resend--) % g_pipeline_depth];
+        g_pipeline_resent++;
+    } else {
+        p = &c->pipeline[(c->pipe_head + c->pipe_len++) % g_pipeline_depth];
+        p->pkt_id = c->pkt_id;
+        p->head = pipeline_is_head(c);
+        p->resent = 0;
+        p->start = c->start;
+        p->connect = c->connect;
+        started++;
+    }
+    p->endwrite = c->endwrite;
+    set_conn_state(c, STATE_READ);
+    pipeline_fill(c);
+} // end of pipeline_written
+
 #endif //_WAF_BENCH_ // functions definitions
 
 static void write_request(struct connection * c)
 {
+#ifdef _WAF_BENCH_ // "-N", the unanswered requests are written again
+    if (started >= requests && !c->pipe_resend) {
+        return;
+    }
+#else // original code goes here
     if (started >= requests) {
         return;
     }
+#endif // _WAF_BENCH_ // "-N", the unanswered requests are written again
 
     do {
         apr_time_t tnow;
@@ -1504,6 +2703,25 @@ static void write_request(struct connection * c)
          * First time round ?
          */
         if (c->rwrite == 0) {
+#ifdef _WAF_BENCH_ // "-M", start the request at its intended time
+            // the intended start times are scheduled by the target rate
+            // regardless of responses, the latency is measured from
+            // the intended start time, even if all connections were busy
+            if (g_rate_stage_count && !c->pipe_resend) {
+                if (c->pkt_scheduled) // released by replay_release
+                    c->pkt_scheduled = 0;
+                else {
+                    apr_time_t due = start + rate_offset(g_rate_scheduled++);
+                    if (tnow < due) {
+                        replay_schedule(c, 0, due);
+                        return;
+                    }
+                    c->pkt_due = due;
+                }
+                replay_record_lag(tnow - c->pkt_due);
+                c->start = c->pkt_due;
+            }
+#endif // _WAF_BENCH_ // "-M", start the request at its intended time
 #ifdef _WAF_BENCH_ //  "-F" a packet file to be sent, 
             // Need write request, get the packet to be sent
             // g_pkt_length > 0 means the packet file is loaded
@@ -1511,204 +2729,55 @@ static void write_request(struct connection * c)
             // might be merged to connection's members to support multi-thread
             if (g_pkt_length) {
 		        static apr_time_t start_time_new_round;
-                int pkt_id = get_write_pkt_id(c->socknum);
-				if (pkt_id == 0)
-					start_time_new_round = apr_time_now() - g_pkt_array[0].pkt_time_to_send;
+                int pkt_id;
+                if (c->pkt_scheduled) { // released by replay_release
+                    c->pkt_scheduled = 0;
+                    pkt_id = c->pkt_id;
+                } else if (c->pipe_resend) { // "-N", written again as it was
+                    pkt_id = c->pipeline[(c->pipe_head + c->pipe_len
+                        - c->pipe_resend) % g_pipeline_depth].pkt_id;
+                } else {
+                    pkt_id = get_write_pkt_id(c->socknum);
+                    if (pkt_id == 0)
+                        start_time_new_round = tnow;
+                    if (g_pkt_timed && g_replay_speed > 0) {
+                        apr_time_t due = start_time_new_round + replay_offset(g_pkt_array[pkt_id].pkt_time_to_send);
+                        if (tnow < due) {
+                            replay_schedule(c, pkt_id, due);
+                            return;
+                        }
+                        c->pkt_due = due;
+                    }
+                }
+                if (g_pkt_timed && g_replay_speed > 0 && !c->pipe_resend)
+                    replay_record_lag(tnow - c->pkt_due);
                 request = g_pkt_array[pkt_id].pkt_data;
                 reqlen = g_pkt_array[pkt_id].pkt_length;
-				while  (apr_time_now() < start_time_new_round+ g_pkt_array[pkt_id].pkt_time_to_send)
-	                 apr_sleep(1);
+                c->tmpl = g_pkt_array[pkt_id].pkt_template;
+                c->pkt_id = pkt_id;
             } 
-
-            int hdr_delim = 0;
-            int header_len = 0;
-            
-            if (g_add_connection_close || g_opt_prefix || g_sub_string_num) {  // packet need to be modify
+            // "-N", the response being read is of an earlier request
+            if (!g_pipeline_depth)
+                c->pkt_status = 0;
+
+            // the request is written from its template, see compile_template
+            if (!g_pkt_length)
+                c->tmpl = g_request_template;
+            if (c->tmpl) {
                 static ulong req_sent = 0;
-
-                // keep original request length when adding seq#
-                // since later on reqlen will be changed
-                if (!g_pkt_length) { 
-                    static int original_reqlen;
-                    if (!req_sent) 
-                        original_reqlen = reqlen;
-                    else
-                        reqlen = original_reqlen;
-                }
-
-                char req_id_string[1024]; // normally len of id string < 1024
-                int req_id_string_len = 0;
-                sprintf(req_id_string, "%lu",req_sent++);
-                req_id_string_len = strlen(req_id_string);
-
-                g_new_header_len = 0;
-                g_new_header[0] = '\0';
-                g_request_end = NULL;
-
-                char *request_pos; // use this as processing position of request
-                char *new_pos = NULL;
-
-                request_pos = request; // start position of request
-                if (g_opt_prefix) {// prepare the URL prefix string and its length
-                    int method_length = 0;
-                    // find the position in request header for URL:[SPACE]*METHOD[SPACE]+URL
-                    // skip leading space
-                    while (*request_pos && isspace(*request_pos)) request_pos++;
-                    // skip the leading HTTP methods string
-                    while (*request_pos && !isspace(*request_pos)) request_pos++;
-                    // skip remaining space again
-                    while (*request_pos && isspace(*request_pos))request_pos++;
-
-                    method_length = request_pos - request;
-                    if (!*request_pos && method_length < 4) 
-                        fprintf(stderr, "Error! Request does not have a valid method:\n%s", request), exit(1);
-                    
-                    memcpy(g_new_header, request, method_length);
-                    g_new_header[method_length] = 0;
-                    strcat(g_new_header,"/");
-                    strcat(g_new_header,g_opt_prefix);
-                    strcat(g_new_header,req_id_string);
-                    if (*request_pos != '/')
-                        strcat(g_new_header,"/");
-                    
-                } // end of URL prefix
-
-                // duplicate the whole request header
-                // starting from URL position
-                if (g_request_end = strstr(request_pos, "\r\n\r\n"))
-                    hdr_delim = 4;
-                /*
-                 * this next line is so that we talk to NCSA 1.5 which blatantly
-                 * breaks the http specifaction
-                 */
-                else if (g_request_end = strstr(request_pos, "\n\n")) 
-                    hdr_delim = 2;
-                else if (g_request_end = strstr(request_pos, "\r\r")) 
-                    hdr_delim = 2;
-                else {
-                    fprintf(stderr, "Error! Request does not have a valid header(end with 2 LNs):\n%s", request);
-                    exit(1);
-                }
-                    
-                g_request_end += hdr_delim;
-
-
-                // prepare the new header buffer
-                int new_estimated_len;
-                g_new_header_len = strlen(g_new_header);
-                // assume each sub_string appears no than 10 times with less than 10-digits seq
-                new_estimated_len = g_new_header_len + (g_request_end - request_pos) + reqlen + g_sub_string_num * 10 * 10 + 1;
-                if (new_estimated_len > g_header_len_MAX) {
-                    g_header_len_MAX = new_estimated_len; 
-                    char *new_header;
-                    new_header = xmalloc(g_header_len_MAX);
-                    if (g_new_header) {
-                        memcpy(new_header, g_new_header, g_new_header_len);
-                        free(g_new_header);
-                    }
-                    g_new_header = new_header;
-                }
-                // copy the remaining header bytes  
-                //memcpy(g_new_header + g_new_header_len, request_pos, g_request_end - request_pos );
-                //g_new_header_len += g_request_end - request_pos ;
-
-                // copy the remaining request bytes 
-                header_len = g_new_header_len + g_request_end - request_pos - hdr_delim;
-                memcpy(g_new_header + g_new_header_len, request_pos, request+reqlen - request_pos );
-                g_new_header_len += (request + reqlen - request_pos) ;
-
-
-
-                // mark its end so that we can use strstr
-                g_new_header[g_new_header_len] = 0;
-                char * new_request_end = g_new_header + g_new_header_len;
-
-                // enumerate to process all sub_strings
-                int i;
-                for (i = 0; i < g_sub_string_num; i ++) {
-                    char *sub;
-                    while (sub = strstr(g_new_header, g_sub_string[i])) { 
-                        if (sub - new_request_end > 0)
-                            break;
-
-                        char *copy_pos;
-                        int copy_bytes;
-                        int sub_len, j;
-
-                        sub_len = strlen(g_sub_string[i]);
-                        copy_pos = sub + sub_len;
-                        copy_bytes = g_new_header_len-(copy_pos-g_new_header)+1;
-
-                        if (sub_len > req_id_string_len)
-                            for (j = 0; j < copy_bytes; j ++)
-                                *(sub+req_id_string_len+j) = *(sub+sub_len+j);
-                        else if (sub_len < req_id_string_len)
-                            for (j = 0; j < copy_bytes; j ++)
-                                *(sub+sub_len+j) = *(sub+req_id_string_len+j);
-                        //memmove(sub+req_id_string_len, copy_pos, 
-                        memcpy(sub, req_id_string, req_id_string_len);
-                    }
-                }
-                g_new_header_len = strlen(g_new_header);
-                //reqlen += g_new_header_len - (g_request_end - request);
-                reqlen = g_new_header_len;
-
-	            char *connection_hdr;
-	            connection_hdr = strcasestr(g_new_header,"\r\nConnection:");
-                if (connection_hdr == NULL) {
-                    connection_hdr = strcasestr(g_new_header,"\n\nConnection:");
-                }
-                
-                //if always connection:close, remove old connection:type
-                if (g_add_connection_close == 2 && connection_hdr != NULL ) {
-                    char * connection_hdr_end = strstr(connection_hdr + sizeof("\r\nConnection:") - 1, "\r\n");
-                    if (connection_hdr_end == NULL) {
-                        connection_hdr_end = strstr(connection_hdr + sizeof("\n\nConnection:") - 1, "\n\n");
-                    }
-                    
-                    if (connection_hdr_end == NULL || connection_hdr_end > new_request_end) {
-                        break;
-                    }
-
-                    int moved_bytes = g_new_header_len - (connection_hdr - g_new_header);
-                    int j;
-
-                    g_new_header_len = g_new_header_len - (connection_hdr_end - connection_hdr);
-                    header_len = header_len - (connection_hdr_end - connection_hdr);
-
-                    for (j = 0; j < moved_bytes; j++) {
-                        *connection_hdr++ = *connection_hdr_end ++;
-                    }
-                    connection_hdr = NULL;
-                }
-
-	            // add connection:close header to the request
-	            if (g_add_connection_close && (connection_hdr == NULL || connection_hdr >= new_request_end)) {
-	                char conn_str[]="\r\nConnection: Close";
-	                int conn_str_len = sizeof(conn_str) - 1;
-	                char *dst = g_new_header+g_new_header_len+conn_str_len;
-	                char *src = g_new_header+g_new_header_len;
-	                int moved_bytes = g_new_header_len + 1 - header_len;
-	                int j;
-
-	                // move the data to get the space for connection string
-	                for (j = 0; j < moved_bytes; j ++)
-	                    *dst-- = *src --;
-
-	                // now copy the connection string
-	                memcpy(g_new_header + header_len, conn_str, conn_str_len);              
-	                g_new_header_len = strlen(g_new_header);
-	                //reqlen += g_new_header_len - (g_request_end - request);
-	                reqlen = g_new_header_len;
-	           }
-
-            } // end of all prefix adding
+                c->seq_len = sprintf(c->seq, "%lu", req_sent++);
+                c->tmpl_len = c->tmpl->literal_len + c->tmpl->slot_count * c->seq_len;
+            }
 #endif // _WAF_BENCH_ , "-F" a packet file to be sent, 
 
             apr_socket_timeout_set(c->aprsock, 0);
             c->connect = tnow;
             c->rwrote = 0;
+#ifdef _WAF_BENCH_ // the request written from a template
+            c->rwrite = c->tmpl ? c->tmpl_len : reqlen;
+#else // original code goes here
             c->rwrite = reqlen;
+#endif // _WAF_BENCH_ // the request written from a template
             if (send_body)
                 c->rwrite += postlen;
             l = c->rwrite;
@@ -1725,30 +2794,36 @@ static void write_request(struct connection * c)
         // if c->rwrote <= reqlen, meaning it's header (request)
         // Otherwise, it's in body, so send postdata
         char *sendbuf; // point to the buffer to be sent
+        struct iovec vec[TEMPLATE_MAX_IOVEC];
+        int nvec = 0; // > 0: send the segments of template in vec
 
-        if (c->rwrote < g_new_header_len) { // send prefix only
-            sendbuf = g_new_header + c->rwrote;
-            if (l > g_new_header_len - c->rwrote) 
-                l = g_new_header_len - c->rwrote; 
+        if (c->tmpl) { // the segments of template and postdata, from c->rwrote
+            nvec = template_iovec(c, vec, TEMPLATE_MAX_IOVEC);
+            sendbuf = vec[0].iov_base;
+            l = vec[0].iov_len;
         } else if (c->rwrote < reqlen) { // send request header
             // c->rwrote is the sent bytes, so start from there
-            if (g_new_header_len && g_request_end)
-                sendbuf = g_request_end + c->rwrote - g_new_header_len; 
-            else
-                sendbuf = request + c->rwrote;
+            sendbuf = request + c->rwrote;
             // and make sure it's not exceeding request buffer
             // because the remaining bytes are in body part
             if (l > reqlen - c->rwrote) 
                 l = reqlen - c->rwrote; 
         } else  // send postdata, reqlen is already sent
             sendbuf = postdata + c->rwrote - reqlen;
-        if (verbosity >= 2)
-            printf("writing request(%zu bytes)=>[%s]\n",l, sendbuf);
+        if (verbosity >= 2) {
+            int i;
+            printf("writing request(%zu bytes)=>[", c->rwrite);
+            for (i = 0; i < nvec; i++)
+                printf("%.*s", (int)vec[i].iov_len, (char *)vec[i].iov_base);
+            printf("%.*s]\n", nvec ? 0 : (int)l, sendbuf);
+        }
 #endif // _WAF_BENCH_ // avoid copying post data to request
 
 #ifdef USE_SSL
         if (c->ssl) {
 #ifdef _WAF_BENCH_ // avoid copying post data to request
+            if (nvec > 1) // SSL has no scatter write, send them at once
+                sendbuf = template_flatten(vec, nvec, &l);
             e = SSL_write(c->ssl, sendbuf, l);
 #else
             e = SSL_write(c->ssl, request + c->rwrote, l);
@@ -1764,6 +2839,12 @@ static void write_request(struct connection * c)
                 default:
                     BIO_printf(bio_err, "SSL write failed - closing connection\n");
                     ERR_print_errors(bio_err);
+#ifdef _WAF_BENCH_ // "-N", read the responses before reconnecting
+                    if (g_pipeline_depth && c->pipe_len) {
+                        pipeline_stop_writing(c);
+                        break;
+                    }
+#endif // _WAF_BENCH_ // "-N", read the responses before reconnecting
                     close_connection (c);
                     break;
                 }
@@ -1775,7 +2856,10 @@ static void write_request(struct connection * c)
 #endif
         {
 #ifdef _WAF_BENCH_ // avoid copying post data to request
-            e = apr_socket_send(c->aprsock, sendbuf, &l);
+            if (nvec > 1) // a scatter write of the segments of template
+                e = apr_socket_sendv(c->aprsock, vec, nvec, &l);
+            else
+                e = apr_socket_send(c->aprsock, sendbuf, &l);
 #else
             e = apr_socket_send(c->aprsock, request + c->rwrote, &l);
 #endif // _WAF_BENCH_ // avoid copying post data to request
@@ -1783,10 +2867,23 @@ static void write_request(struct connection * c)
                 if (!APR_STATUS_IS_EAGAIN(e)) {
                     epipe++;
                     printf("Send request failed!\n");
+#ifdef _WAF_BENCH_ // "-N", read the responses before reconnecting
+                    // e.g. the server closed the connection after blocking
+                    // a request, its response is still to be read
+                    if (g_pipeline_depth && c->pipe_len) {
+                        pipeline_stop_writing(c);
+                        return;
+                    }
+#endif // _WAF_BENCH_ // "-N", read the responses before reconnecting
                     close_connection(c);
                 }
                 else {
+#ifdef _WAF_BENCH_ // "-N", the responses are read while writing
+                    set_polled_events(c, c->pipe_len ? APR_POLLIN | APR_POLLOUT
+                                                     : APR_POLLOUT);
+#else // original code goes here
                     set_polled_events(c, APR_POLLOUT);
+#endif // _WAF_BENCH_ // "-N", the responses are read while writing
                 }
                 return;
             }
@@ -1797,6 +2894,12 @@ static void write_request(struct connection * c)
     } while (c->rwrite);
 
     c->endwrite = lasttime = apr_time_now();
+#ifdef _WAF_BENCH_ // "-N", keep writing requests to fill the pipeline
+    if (g_pipeline_depth) {
+        pipeline_written(c);
+        return;
+    }
+#endif // _WAF_BENCH_ // "-N", keep writing requests to fill the pipeline
     started++;
     set_conn_state(c, STATE_READ);
 }
@@ -1868,6 +2971,13 @@ static void output_results(int sig)
         printf("TLS Server Name:        %s\n", tls_sni);
     }
 #endif
+#ifdef _WAF_BENCH_ // "-8", the hit rate of resumed sessions
+    if (is_ssl && g_tls_handshakes) {
+        printf("TLS handshakes:         %lu, %lu resumed (%.1f%%)\n",
+               g_tls_handshakes, g_tls_resumed,
+               100.0 * g_tls_resumed / g_tls_handshakes);
+    }
+#endif // _WAF_BENCH_ // "-8", the hit rate of resumed sessions
 #endif
     printf("\n");
     printf("Document Path:          %s\n", path);
@@ -1899,6 +3009,11 @@ static void output_results(int sig)
 #endif //_WAF_BENCH_ return to no-color
     if (keepalive)
         printf("Keep-Alive requests:    %d\n", doneka);
+#ifdef _WAF_BENCH_ // "-N", the persistent connections
+    if (g_pipeline_depth)
+        printf("Pipelined requests:     depth %d, %lu reconnects, %lu sent again\n",
+               pipeline_depth(), g_pipeline_reconnects, g_pipeline_resent);
+#endif // _WAF_BENCH_ // "-N", the persistent connections
     printf("Total transferred:      %" APR_INT64_T_FMT " bytes\n", totalread);
     if (send_body)
         printf("Total body sent:        %" APR_INT64_T_FMT "\n",
@@ -1936,11 +3051,23 @@ static void output_results(int sig)
         }
     }
 
-#ifdef _WAF_BENCH_ // real sent# might be greater than g_stats_window;
-    done = ap_min(done, g_stats_window);
+#ifdef _WAF_BENCH_ // work out connection times from histograms of all of requests
     printf("Total samples of stats: %d",done);
-#endif //_WAF_BENCH_ real sent# might be greater than g_stats_window;
 
+    if (done > 0) {
+        int i;
+        struct histogram *hcon = &g_hists[HIST_CONNECT], *hd = &g_hists[HIST_PROCESSING],
+                         *hwait = &g_hists[HIST_WAITING], *htot = &g_hists[HIST_TOTAL];
+        apr_time_t meancon = hist_mean(hcon), meantot = hist_mean(htot),
+                   meand = hist_mean(hd), meanwait = hist_mean(hwait);
+        apr_interval_time_t mincon = hcon->min, mintot = htot->min, mind = hd->min,
+                            minwait = hwait->min;
+        apr_interval_time_t maxcon = hcon->max, maxtot = htot->max, maxd = hd->max,
+                            maxwait = hwait->max;
+        apr_interval_time_t mediancon = hist_percentile(hcon, 50), mediantot = hist_percentile(htot, 50),
+                            mediand = hist_percentile(hd, 50), medianwait = hist_percentile(hwait, 50);
+        double sdtot = hist_sd(htot), sdcon = hist_sd(hcon), sdd = hist_sd(hd), sdwait = hist_sd(hwait);
+#else // original code goes here
     if (done > 0) {
         /* work out connection times */
         int i;
@@ -2026,6 +3153,7 @@ static void output_results(int sig)
             mediantot = (stats[done / 2].time + stats[done / 2 + 1].time) / 2;
         else
             mediantot = stats[done / 2].time;
+#endif // _WAF_BENCH_ // work out connection times from histograms of all of requests
 #ifdef _WAF_BENCH_ // microsec-granularity in output-results
         if (g_us_granularity)
             printf("\nConnection Times (us)\n");            
@@ -2111,20 +3239,38 @@ static void output_results(int sig)
             for (i = 0; i < sizeof(percs) / sizeof(int); i++) {
                 if (percs[i] <= 0)
                     printf(" 0%%  <0> (never)\n");
+#ifdef _WAF_BENCH_ // percentiles from the histogram of total times
+                else {
+                    apr_interval_time_t t = hist_percentile(htot, percs[i]);
+                    if (!g_us_granularity)
+                        t = ap_round_ms(t);
+                    if (percs[i] >= 100)
+                        printf(" 100%%  %5" APR_TIME_T_FMT " (longest request)\n", t);
+                    else
+                        printf("  %d%%  %5" APR_TIME_T_FMT "\n", percs[i], t);
+                }
+#else // original code goes here
                 else if (percs[i] >= 100)
                     printf(" 100%%  %5" APR_TIME_T_FMT " (longest request)\n",
-#ifdef _WAF_BENCH_ // microsec-granularity in output-results
-                    g_us_granularity?stats[done - 1].time:
-#endif // _WAF_BENCH_ // microsec-granularity in output-results
                            ap_round_ms(stats[done - 1].time));
                 else
                     printf("  %d%%  %5" APR_TIME_T_FMT "\n", percs[i],
-#ifdef _WAF_BENCH_ // microsec-granularity in output-results
-                        g_us_granularity?stats[(unsigned long)done * percs[i] / 100].time:
-#endif // _WAF_BENCH_ // microsec-granularity in output-results
                            ap_round_ms(stats[(unsigned long)done * percs[i] / 100].time));
+#endif // _WAF_BENCH_ // percentiles from the histogram of total times
             }
         }
+#ifdef _WAF_BENCH_ // schedule lag of timed packets
+        if (g_lag_hist.count) {
+            printf("\n");
+            output_replay_lags();
+        }
+#endif // _WAF_BENCH_ // schedule lag of timed packets
+#ifdef _WAF_BENCH_ // "-9", the requests of each group of the mix
+        if (g_mix_group_count) {
+            printf("\n");
+            output_mix();
+        }
+#endif // _WAF_BENCH_ // "-9", the requests of each group of the mix
         if (csvperc) {
             FILE *out = fopen(csvperc, "w");
             if (!out) {
@@ -2139,12 +3285,16 @@ static void output_results(int sig)
             fprintf(out, "" "Percentage served" "," "Time in ms" "\n");             
             for (i = 0; i <= 100; i++) {
                 double t;
+#ifdef _WAF_BENCH_ // percentiles from the histogram of total times
+                t = ap_double_ms(hist_percentile(htot, i));
+#else // original code goes here
                 if (i == 0)
                     t = ap_double_ms(stats[0].time);
                 else if (i == 100)
                     t = ap_double_ms(stats[done - 1].time);
                 else
                     t = ap_double_ms(stats[(unsigned long) (0.5 + (double)done * i / 100.0)].time);
+#endif // _WAF_BENCH_ // percentiles from the histogram of total times
 #ifdef _WAF_BENCH_ // microsec-granularity in output-results
             if (g_us_granularity)
                 t = t * 1000; // convert back to us             
@@ -2161,7 +3311,11 @@ static void output_results(int sig)
                 exit(1);
             }
             fprintf(out, "starttime\tseconds\tctime\tdtime\tttime\twait\n");
+#ifdef _WAF_BENCH_ // the samples of the last g_stats_window requests
+            for (i = 0; i < ap_min(done, g_stats_window); i++) {
+#else // original code goes here
             for (i = 0; i < done; i++) {
+#endif // _WAF_BENCH_ // the samples of the last g_stats_window requests
                 (void) apr_ctime(tmstring, stats[i].starttime);
                 fprintf(out, "%s\t%" APR_TIME_T_FMT "\t%" APR_TIME_T_FMT
                                "\t%" APR_TIME_T_FMT "\t%" APR_TIME_T_FMT
@@ -2188,6 +3342,20 @@ static void output_results(int sig)
         }
     }
 
+#ifdef _WAF_BENCH_ // save the histograms of the whole test as heartbeat 0
+    if (g_hist_file) {
+        int i;
+        for (i = 0; i < HIST_KINDS; i++)
+            save_histogram(0, g_hist_names[i], &g_hists[i]);
+        if (g_lag_hist.count)
+            save_histogram(0, "lag", &g_lag_hist);
+        fclose(g_hist_file);
+        g_hist_file = NULL;
+    }
+    if (g_pkt_stats_file)
+        save_pkt_stats();
+#endif // _WAF_BENCH_ // save the histograms of the whole test as heartbeat 0
+
     if (sig) {
         exit(1);
     }
@@ -2277,10 +3445,11 @@ static void output_html_results(void)
         }
     }
     {
-#ifdef _WAF_BENCH_ // real sent# might be greater than MAX_REQUEST;
-        done = ap_min(done, g_stats_window);
-#endif //_WAF_BENCH_ real sent# might be greater than MAX_REQUEST;
-
+#ifdef _WAF_BENCH_ // work out connection times from histograms of all of requests
+        apr_interval_time_t totalcon = g_hists[HIST_CONNECT].sum, total = g_hists[HIST_TOTAL].sum;
+        apr_interval_time_t mincon = g_hists[HIST_CONNECT].min, mintot = g_hists[HIST_TOTAL].min;
+        apr_interval_time_t maxcon = g_hists[HIST_CONNECT].max, maxtot = g_hists[HIST_TOTAL].max;
+#else // original code goes here
         /* work out connection times */
         int i;
         apr_interval_time_t totalcon = 0, total = 0;
@@ -2296,6 +3465,7 @@ static void output_html_results(void)
             totalcon += s->ctime;
             total    += s->time;
         }
+#endif // _WAF_BENCH_ // work out connection times from histograms of all of requests
         /*
          * Reduce stats from apr time to milliseconds
          */
@@ -2340,8 +3510,20 @@ static void start_connect(struct connection * c)
 {
     apr_status_t rv;
 
+#ifdef _WAF_BENCH_ // "-N", reconnect to write the unanswered requests again
+    if (!(started < requests) && !c->pipe_resend)
+        return;
+    if (g_pipeline_depth && !c->pipeline)
+        c->pipeline = xcalloc(g_pipeline_depth, sizeof(struct pipelined_request));
+#else // original code goes here
     if (!(started < requests))
         return;
+#endif // _WAF_BENCH_ // "-N", reconnect to write the unanswered requests again
+
+#ifdef _WAF_BENCH_ // a connection waiting for its timed packet is kept
+    if (c->pkt_scheduled)
+        return;
+#endif // _WAF_BENCH_ // a connection waiting for its timed packet is kept
 
 #ifdef _WAF_BENCH_ // make sure not exceeding RPS limit
 	static int connection_rps_banned = 0;
@@ -2426,6 +3608,19 @@ static void start_connect(struct connection * c)
         BIO_set_nbio(bio, 1);
         SSL_set_bio(c->ssl, bio, bio);
         SSL_set_connect_state(c->ssl);
+#ifdef _WAF_BENCH_ // "-8", resume the latest session
+        if (g_tls_session) {
+#if OPENSSL_VERSION_NUMBER >= 0x10101000L
+            // a copy each, a connection failed uncleanly makes its session
+            // not resumable, which shouldn't stop the other connections
+            SSL_SESSION *session = SSL_SESSION_dup(g_tls_session);
+            SSL_set_session(c->ssl, session);
+            SSL_SESSION_free(session);
+#else
+            SSL_set_session(c->ssl, g_tls_session);
+#endif
+        }
+#endif // _WAF_BENCH_ // "-8", resume the latest session
         if (verbosity >= 4) {
             BIO_set_callback(bio, ssl_print_cb);
             BIO_set_callback_arg(bio, (void *)bio_err);
@@ -2478,12 +3673,416 @@ static void start_connect(struct connection * c)
     }
 }
 
+#ifdef _WAF_BENCH_ // "-N", the responses of persistent connections
+
+// the value of the header field name in the response header hdr, NULL if it's
+// absent, name is like "\nContent-Length:" to match the beginning of a line
+static const char *header_value(const char *hdr, const char *name)
+{
+    const char *p = xstrcasestr(hdr, name);
+
+    if (!p)
+        return NULL;
+    for (p += strlen(name); *p == ' ' || *p == '\t'; p++);
+    return p;
+} // end of header_value
+
+// whether the header value has token, the value ends at the end of its line
+static int header_has_token(const char *value, const char *token)
+{
+    apr_size_t len = strlen(token);
+
+    for (; value && *value && *value != '\r' && *value != '\n'; value++)
+        if (!strncasecmp(value, token, len))
+            return 1;
+    return 0;
+} // end of header_has_token
+
+// how the response of c ends once its header is received, by Content-Length,
+// by the last chunk, without a body, or by the server closing the connection
+static void pipeline_framing(struct connection *c)
+{
+    const char *value = header_value(c->cbuff, "\nConnection:");
+
+    c->length = 0;
+    c->chunk_state = CHUNK_NONE;
+    c->chunk_left = 0;
+    c->resp_until_close = 0;
+    if (!strncmp(c->cbuff, "HTTP/1.0", 8))
+        c->resp_close = !header_has_token(value, "keep-alive");
+    else
+        c->resp_close = header_has_token(value, "close");
+    if (c->pkt_status == 101) {
+        c->resp_until_close = c->resp_close = 1;
+        return;
+    }
+    // the responses to HEAD, 204 and 304 don't have entity body
+    if (c->pipeline[c->pipe_head].head || c->pkt_status == 204 || c->pkt_status == 304)
+        return;
+    if (header_has_token(header_value(c->cbuff, "\nTransfer-Encoding:"), "chunked"))
+        c->chunk_state = CHUNK_SIZE;
+    else if ((value = header_value(c->cbuff, "\nContent-Length:")))
+        c->length = (apr_size_t)apr_atoi64(value);
+    else
+        c->resp_until_close = c->resp_close = 1;
+} // end of pipeline_framing
+
+// consume the chunked body in buf, return # of bytes consumed,
+// *done is set at the empty line after the last chunk and its trailer
+static apr_size_t pipeline_chunks(struct connection *c, const char *buf, apr_size_t len, int *done)
+{
+    apr_size_t i = 0, n;
+
+    while (i < len && !*done) {
+        char ch = buf[i];
+
+        switch (c->chunk_state) {
+        case CHUNK_SIZE:        // the hex digits of the chunk size
+            if (apr_isxdigit(ch)) {
+                c->chunk_left = c->chunk_left * 16
+                    + (apr_isdigit(ch) ? ch - '0' : apr_tolower(ch) - 'a' + 10);
+                i++;
+                break;
+            }
+            c->chunk_state = CHUNK_EXT;
+            /* fall through */
+        case CHUNK_EXT:         // the chunk extensions up to the end of line
+            if (buf[i++] == '\n')
+                c->chunk_state = c->chunk_left ? CHUNK_DATA : CHUNK_TRAILER;
+            break;
+        case CHUNK_DATA:
+            n = ap_min(len - i, c->chunk_left);
+            i += n;
+            c->chunk_left -= n;
+            if (!c->chunk_left)
+                c->chunk_state = CHUNK_DATA_END;
+            break;
+        case CHUNK_DATA_END:    // the CRLF after the chunk data
+            if (buf[i++] == '\n')
+                c->chunk_state = CHUNK_SIZE;
+            break;
+        case CHUNK_TRAILER:     // the beginning of a trailer line, or the end
+            i++;
+            if (ch == '\n')
+                *done = 1;
+            else if (ch != '\r')
+                c->chunk_state = CHUNK_TRAILER_LINE;
+            break;
+        case CHUNK_TRAILER_LINE:
+            if (buf[i++] == '\n')
+                c->chunk_state = CHUNK_TRAILER;
+            break;
+        }
+    }
+    return i;
+} // end of pipeline_chunks
+
+// the bytes of the response of c are received, the body is saved only with "-K"
+static void pipeline_save(struct connection *c, const char *buf, apr_size_t len)
+{
+    if (len && g_save_file_fd && (!c->gotheader || g_save_body)) {
+        if (g_save_binary)
+            save_capture(c, c->read ? CAPTURE_NEXT : CAPTURE_FIRST, buf, len);
+        else
+            save_logfile((char *)buf, len);
+    }
+    c->read += len;
+} // end of pipeline_save
+
+// consume the response of the oldest request of c in buf, return # of bytes
+// consumed, *done is 1 once the response ends, -1 if its header is invalid
+static apr_size_t pipeline_consume(struct connection *c, const char *buf, apr_size_t len, int *done)
+{
+    apr_size_t used = 0, body;
+    int i;
+
+    if (!c->gotheader) {
+        apr_size_t space = CBUFFSIZE - c->cbx - 1; /* -1 allows for \0 term */
+        apr_size_t tocopy;
+        char *s;
+        int l = 4;
+
+        // skip the empty lines between responses
+        if (!c->cbx) {
+            for (; used < len && (buf[used] == '\r' || buf[used] == '\n'); used++);
+            if (used == len)
+                return used;
+        }
+        if (!c->read)
+            c->beginread = apr_time_now();
+        tocopy = ap_min(space, len - used);
+        memcpy(c->cbuff + c->cbx, buf + used, tocopy);
+        c->cbuff[c->cbx + tocopy] = 0;
+        s = strstr(c->cbuff, "\r\n\r\n");
+        if (!s) {
+            s = strstr(c->cbuff, "\n\n");
+            l = 2;
+        }
+        if (!s) {
+            pipeline_save(c, buf + used, tocopy);
+            c->cbx += tocopy;
+            if (tocopy == space) {
+                /* header is in invalid or too big */
+                err_response++;
+                bad++;
+                *done = -1;
+                return len;
+            }
+            return used + tocopy;
+        }
+        // the bytes of buf up to the end of header
+        tocopy = s + l - c->cbuff - c->cbx;
+        pipeline_save(c, buf + used, tocopy);
+        used += tocopy;
+        c->cbx += tocopy;
+        c->gotheader = 1;
+        *s = 0;     /* terminate at end of header */
+        if (verbosity >= 2)
+            printf("LOG: header received:\n%s\n", c->cbuff);
+
+        c->pkt_status = parse_status(c->cbuff, strlen(c->cbuff));
+        if (c->pkt_status / 100 == 1 && c->pkt_status != 101) {
+            // an interim response, the final one follows
+            c->cbx = 0;
+            c->gotheader = 0;
+            return used;
+        }
+        if (!c->pkt_status)
+            c->pkt_status = 500;
+        if (c->pkt_status / 100 != 2) {
+            err_response++;
+            if (verbosity >= 2)
+                printf("WARNING: Response code not 2xx (%d)\n", c->pkt_status);
+        }
+        if (!good && !*servername) {
+            const char *p = header_value(c->cbuff, "\nServer:");
+            apr_size_t n = 0;
+
+            /* -1 to not overwrite last '\0' byte */
+            while (p && p[n] > 32 && n < sizeof(servername) - 1) {
+                servername[n] = p[n];
+                n++;
+            }
+            servername[n] = 0;
+        }
+        pipeline_framing(c);
+
+        /* We have received the header, so we know this destination socket
+         * address is working, so initialize all remaining requests. */
+        if (!requests_initialized) {
+            for (i = 1; i < concurrency; i++) {
+                con[i].socknum = i;
+                start_connect(&con[i]);
+            }
+            requests_initialized = 1;
+        }
+        if (!c->chunk_state && !c->length && !c->resp_until_close) {
+            *done = 1;
+            return used;
+        }
+    }
+
+    buf += used;
+    len -= used;
+    if (c->chunk_state)
+        body = pipeline_chunks(c, buf, len, done);
+    else if (c->resp_until_close)
+        body = len;
+    else {
+        body = ap_min(len, c->length - c->bread);
+        *done = c->bread + body >= c->length;
+    }
+    pipeline_save(c, buf, body);
+    c->bread += body;
+    totalbread += body;
+    return used + body;
+} // end of pipeline_consume
+
+// save out time of the request p of c
+static void pipeline_record(struct connection *c, const struct pipelined_request *p)
+{
+    if (done < requests) {
+        struct data sample, *s = stats ? &stats[done % g_stats_window] : &sample;
+        done++;
+        if (c->pipe_done)
+            doneka++;
+        c->done      = lasttime = apr_time_now();
+        s->starttime = p->start;
+        s->ctime     = ap_max(0, p->connect - p->start);
+        s->time      = ap_max(0, c->done - p->start);
+        s->waittime  = ap_max(0, c->beginread - p->endwrite);
+        record_latencies(s);
+        record_pkt_stats(c, s->time);
+        if (heartbeatres && !(done % heartbeatres)) {
+            fprintf(stderr, "Completed %d requests\n", done);
+            fflush(stderr);
+        }
+    }
+} // end of pipeline_record
+
+// the response of the oldest request of c is received or failed,
+// then the next response is of the next request
+static void pipeline_finish(struct connection *c, int failed)
+{
+    if (!failed) {
+        good++;
+        if (good == 1) {
+            /* first time here */
+            doclen = c->bread;
+        }
+        else if ((c->bread != doclen) && !nolength) {
+            bad++;
+            err_length++;
+        }
+    }
+    c->pkt_id = c->pipeline[c->pipe_head].pkt_id;
+    pipeline_record(c, &c->pipeline[c->pipe_head]);
+    c->pipe_head = (c->pipe_head + 1) % g_pipeline_depth;
+    c->pipe_len--;
+    c->pipe_done++;
+    c->pkt_status = 0;
+    c->read = c->bread = 0;
+    c->cbx = 0;
+    c->gotheader = 0;
+    c->length = 0;
+    c->chunk_state = CHUNK_NONE;
+    c->resp_until_close = 0;
+} // end of pipeline_finish
+
+// c is closed by the server, or failed if failed is set, the unanswered
+// requests are written again on a new connection. If the server closed it
+// without telling, the oldest request may be the cause, so it fails if its
+// response is broken, it's the first request of the connection, or it has
+// been written again for the same reason. A connection closed before any
+// request is written again counts as the first request of it too, or wb
+// would reconnect forever to a server dropping its clients at accept
+static void pipeline_close(struct connection *c, int failed)
+{
+    if (c->pipe_len && (failed || c->pipe_len > c->pipe_resend || !c->pipe_done)) {
+        struct pipelined_request *p = &c->pipeline[c->pipe_head];
+        if (!failed && c->gotheader && c->resp_until_close)
+            pipeline_finish(c, 0);
+        else if (!failed && c->resp_close && !c->read)
+            ;   /* the last response told the server closes */
+        else if (failed || c->read || !c->pipe_done || p->resent) {
+            if (!failed) {
+                err_recv++;
+                bad++;
+            }
+            pipeline_finish(c, 1);
+        }
+        else
+            p->resent = 1;
+    } else if (failed) {
+        // e.g. the handshake failed, it's a failed request as without "-N"
+        struct pipelined_request p;
+        p.start = c->start;
+        p.connect = c->connect;
+        p.endwrite = c->endwrite;
+        pipeline_record(c, &p);
+    }
+    c->pipe_resend = c->pipe_len;
+    c->pipe_closing = 0;
+    c->pipe_done = 0;
+    c->resp_close = 0;
+    g_pipeline_reconnects++;
+
+    set_conn_state(c, STATE_UNCONNECTED);
+#ifdef USE_SSL
+    if (c->ssl) {
+        SSL_shutdown(c->ssl);
+        SSL_free(c->ssl);
+        c->ssl = NULL;
+    }
+#endif
+    apr_socket_close(c->aprsock);
+
+    /* connect again */
+    start_connect(c);
+} // end of pipeline_close
+
+// read the responses of the requests in flight of c, a read may have
+// the ends and beginnings of several responses
+static void pipeline_read(struct connection *c)
+{
+    apr_size_t r = sizeof(buffer), used;
+    apr_status_t status;
+    int done;
+
+#ifdef USE_SSL
+    if (c->ssl) {
+        status = SSL_read(c->ssl, buffer, r);
+        if (status <= 0) {
+            int scode = SSL_get_error(c->ssl, status);
+
+            if (scode == SSL_ERROR_WANT_READ)
+                set_polled_events(c, c->rwrite ? APR_POLLIN | APR_POLLOUT : APR_POLLIN);
+            else if (scode == SSL_ERROR_WANT_WRITE)
+                set_polled_events(c, APR_POLLOUT);
+            else    /* closed, cleanly or not */
+                pipeline_close(c, 0);
+            return;
+        }
+        r = status;
+    }
+    else
+#endif
+    {
+        status = apr_socket_recv(c->aprsock, buffer, &r);
+        if (APR_STATUS_IS_EAGAIN(status))
+            return;
+        if (status != APR_SUCCESS || !r) {
+            // e.g. reset after the server blocked a request
+            if (!APR_STATUS_IS_EOF(status) && verbosity >= 1) {
+                char buf[120];
+                fprintf(stderr,"%s: %s (%d)\n", "apr_socket_recv", apr_strerror(status, buf, sizeof buf), status);
+            }
+            pipeline_close(c, 0);
+            return;
+        }
+    }
+
+    totalread += r;
+    for (used = 0; used < r && c->pipe_len > c->pipe_resend; ) {
+        // the response is of the oldest request, see save_capture
+        c->pkt_id = c->pipeline[c->pipe_head].pkt_id;
+        done = 0;
+        used += pipeline_consume(c, buffer + used, r - used, &done);
+        if (done < 0) {
+            pipeline_close(c, 1);
+            return;
+        }
+        if (done) {
+            int resp_close = c->resp_close;
+            pipeline_finish(c, 0);
+            if (resp_close) {
+                pipeline_close(c, 0);
+                return;
+            }
+        }
+    }
+    if (c->pipe_closing && c->pipe_len == c->pipe_resend) {
+        // all of the responses are read
+        pipeline_close(c, 0);
+        return;
+    }
+    pipeline_fill(c);
+} // end of pipeline_read
+
+#endif // _WAF_BENCH_ // "-N", the responses of persistent connections
+
 /* --------------------------------------------------------- */
 
 /* close down connection and save stats */
 
 static void close_connection(struct connection * c)
 {
+#ifdef _WAF_BENCH_ // "-N", the requests in flight are written again
+    if (g_pipeline_depth) {
+        pipeline_close(c, 1);
+        return;
+    }
+#endif // _WAF_BENCH_ // "-N", the requests in flight are written again
     if (c->read == 0 && c->keepalive) {
         /*
          * server has legitimately shut down an idle keep alive request
@@ -2502,16 +4101,21 @@ static void close_connection(struct connection * c)
         }
         /* save out time */
         if (done < requests) {
-#ifdef _WAF_BENCH_ // make sure not exceeding stats size
-           struct data *s = &stats[(done++)%g_stats_window]; 
+#ifdef _WAF_BENCH_ // latencies are kept in histograms, the samples are kept for -g only
+            struct data sample, *s = stats ? &stats[done % g_stats_window] : &sample;
+            done++;
 #else // original code goes here
             struct data *s = &stats[done++];
-#endif //_WAF_BENCH_ // // make sure not exceeding stats size
+#endif //_WAF_BENCH_ // latencies are kept in histograms, the samples are kept for -g only
             c->done      = lasttime = apr_time_now();
             s->starttime = c->start;
             s->ctime     = ap_max(0, c->connect - c->start);
             s->time      = ap_max(0, c->done - c->start);
             s->waittime  = ap_max(0, c->beginread - c->endwrite);
+#ifdef _WAF_BENCH_ // record latencies into histograms
+            record_latencies(s);
+            record_pkt_stats(c, s->time);
+#endif // _WAF_BENCH_ // record latencies into histograms
             if (heartbeatres && !(done % heartbeatres)) {
                 fprintf(stderr, "Completed %d requests\n", done);
                 fflush(stderr);
@@ -2546,6 +4150,12 @@ static void read_connection(struct connection * c)
     char respcode[4];       /* 3 digits and null */
     int i;
 
+#ifdef _WAF_BENCH_ // "-N", the responses of persistent connections
+    if (g_pipeline_depth) {
+        pipeline_read(c);
+        return;
+    }
+#endif // _WAF_BENCH_ // "-N", the responses of persistent connections
     r = sizeof(buffer);
 read_more:
 #ifdef USE_SSL
@@ -2637,7 +4247,10 @@ read_more:
         //  apr_fprintf(g_save_file_fd, "\n\n");
         
         // if it's header, or we need save body, save it.
-        if (!c->gotheader || g_save_body)
+        if (g_save_binary) {
+            if (!c->gotheader || g_save_body)
+                save_capture(c, c->read ? CAPTURE_NEXT : CAPTURE_FIRST, buffer, r);
+        } else if (!c->gotheader || g_save_body)
             save_logfile(buffer, r);
         if (verbosity >= 2) {
             printf("LOG: http packet received(%zu bytes):\n%s\n", r,buffer);
@@ -2732,6 +4345,9 @@ read_more:
                 strcpy(respcode, "500");
             }
 
+#ifdef _WAF_BENCH_ // "-6", the response code of the packet
+            c->pkt_status = atoi(respcode);
+#endif // _WAF_BENCH_ // "-6", the response code of the packet
             if (respcode[0] != '2') {
                 err_response++;
                 if (verbosity >= 2)
@@ -2747,7 +4363,7 @@ read_more:
             if (g_keepalive_for_real_traffic || (keepalive && xstrcasestr(c->cbuff, "Keep-Alive"))) {
 #else // original code goes here
             if (keepalive && xstrcasestr(c->cbuff, "Keep-Alive")) {
-#endif //_WAF_BENCH_ // // make sure not exceeding stats size
+#endif //_WAF_BENCH_ // latencies are kept in histograms, the samples are kept for -g only
                 char *cl;
                 c->keepalive = 1;
                 cl = xstrcasestr(c->cbuff, "Content-Length:");
@@ -2796,17 +4412,22 @@ read_more:
             err_length++;
         }
         if (done < requests) {
-#ifdef _WAF_BENCH_ // make sure not exceeding stats size
-            struct data *s = &stats[(done++)%g_stats_window]; 
+#ifdef _WAF_BENCH_ // latencies are kept in histograms, the samples are kept for -g only
+            struct data sample, *s = stats ? &stats[done % g_stats_window] : &sample;
+            done++;
 #else // original code goes here
             struct data *s = &stats[done++];
-#endif //_WAF_BENCH_ // // make sure not exceeding stats size
+#endif //_WAF_BENCH_ // latencies are kept in histograms, the samples are kept for -g only
             doneka++;
             c->done      = apr_time_now();
             s->starttime = c->start;
             s->ctime     = ap_max(0, c->connect - c->start);
             s->time      = ap_max(0, c->done - c->start);
             s->waittime  = ap_max(0, c->beginread - c->endwrite);
+#ifdef _WAF_BENCH_ // record latencies into histograms
+            record_latencies(s);
+            record_pkt_stats(c, s->time);
+#endif // _WAF_BENCH_ // record latencies into histograms
             if (heartbeatres && !(done % heartbeatres)) {
                 fprintf(stderr, "Completed %d requests\n", done);
                 fflush(stderr);
@@ -2868,7 +4489,10 @@ static void test(void)
      * XXX: would be nice.
      */
 #ifdef _WAF_BENCH_  // fixed stats window, <= g_stats_window
-    stats = xcalloc(ap_min(requests, g_stats_window), sizeof(struct data));
+    // the results are worked out from histograms in constant memory,
+    // the samples of the last g_stats_window requests are for -g only
+    if (gnuplot)
+        stats = xcalloc(ap_min(requests, g_stats_window), sizeof(struct data));
 #else // orginal code goes here
     stats = xcalloc(requests, sizeof(struct data));
 #endif // _WAF_BENCH_  , fixed stats window, <= g_stats_window
@@ -2979,7 +4603,8 @@ static void test(void)
 // wb uses seperate buffers to hold them, and send them seperately
     if (g_pkt_length > 0)
         fprintf(stderr, "\n read %zu packets from file with total length(%zu).\n", 
-            g_MAX_PKT_COUNT, g_pkt_length);
+            g_pkt_count, g_pkt_length);
+    compile_templates();
 #else // original code goes here
     if (send_body) {
         char *buff = xmalloc(postlen + reqlen + 1);
@@ -3041,13 +4666,26 @@ static void test(void)
         const apr_pollfd_t *pollresults, *pollfd;
 
         n = concurrency;
+#ifdef _WAF_BENCH_ // wake up for the timed packets
+        apr_interval_time_t timeout = replay_timeout(aprtimeout);
+#endif // _WAF_BENCH_ // wake up for the timed packets
         do {
+#ifdef _WAF_BENCH_ // wake up for the timed packets
+            status = apr_pollset_poll(readbits, timeout, &n, &pollresults);
+#else // original code goes here
             status = apr_pollset_poll(readbits, aprtimeout, &n, &pollresults);
+#endif // _WAF_BENCH_ // wake up for the timed packets
 #ifdef _WAF_BENCH_ // print out the progress
             print_progress(0); 
 #endif // _WAF_BENCH_, // print out the progress
         } while (APR_STATUS_IS_EINTR(status));
 #ifdef _WAF_BENCH_ // wb will not quit when there's a timeout
+        if (g_replay_heap_len && (status == APR_TIMEUP || status == APR_SUCCESS)) {
+            // send the timed packets before handling the events
+            replay_release();
+            if (status == APR_TIMEUP && timeout < aprtimeout)
+                continue;
+        }
        if (status == APR_TIMEUP) {
             struct connection *c = &con[0];
             if  (c->state != STATE_READ) 
@@ -3058,7 +4696,12 @@ static void test(void)
                 if (recverrok) {
                     if (verbosity > 1)
                         fprintf(stderr, "WARNING: READ TIMEOUT!\n");
-                    save_logfile("TIMEOUT: READ ERROR\n",0);
+                    if (c->pipe_len > c->pipe_resend) // "-N", the oldest request
+                        c->pkt_id = c->pipeline[c->pipe_head].pkt_id;
+                    if (g_save_binary)
+                        save_capture(c, CAPTURE_TIMEOUT, NULL, 0);
+                    else
+                        save_logfile("TIMEOUT: READ ERROR\n",0);
                     close_connection(c);
                     continue;
                 } else {
@@ -3102,8 +4745,23 @@ static void test(void)
              * connection is done and we loop here endlessly calling
              * apr_poll().
              */
+#ifdef _WAF_BENCH_ // "-N", the events of a reconnected socket are stale
+            if ((rtnev & APR_POLLIN) || (rtnev & APR_POLLPRI) || (rtnev & APR_POLLHUP)) {
+                int state = c->state;
+                read_connection(c);
+                if (g_pipeline_depth && c->state != state)
+                    continue;
+            }
+            if (g_pipeline_depth && c->state != STATE_CONNECTING
+                && ((rtnev & APR_POLLERR) || (rtnev & APR_POLLNVAL))) {
+                // e.g. reset after the server blocked a request
+                pipeline_close(c, 0);
+                continue;
+            }
+#else // original code goes here
             if ((rtnev & APR_POLLIN) || (rtnev & APR_POLLPRI) || (rtnev & APR_POLLHUP))
                 read_connection(c);
+#endif // _WAF_BENCH_ // "-N", the events of a reconnected socket are stale
             if ((rtnev & APR_POLLERR) || (rtnev & APR_POLLNVAL)) {
                 if (destsa->next && c->state == STATE_CONNECTING && good == 0) {
                     destsa = destsa->next;
@@ -3151,7 +4809,11 @@ static void test(void)
                 else {
                     /* POLLOUT is one shot */
                     set_polled_events(c, APR_POLLIN);
+#ifdef _WAF_BENCH_ // "-N", a request is being written while reading
+                    if (c->state == STATE_READ && !(g_pipeline_depth && c->rwrite)) {
+#else // original code goes here
                     if (c->state == STATE_READ) {
+#endif // _WAF_BENCH_ // "-N", a request is being written while reading
                         read_connection(c);
                     }
                     else {
@@ -3305,16 +4967,28 @@ static void usage(const char *progname)
     fprintf(stderr,"\033[1;33m\n"); // Yellow
     fprintf(stderr, "New options for wb:\n");
     fprintf(stderr,"\033[0m\n"); // no color
+    fprintf(stderr, "    -D hist_file    Save the latency histograms of each progress interval and\n");
+    fprintf(stderr, "                    the whole test to hist_file\n");
     fprintf(stderr, "    -F pkt_file     File of packet seperated by \\0 or a leading size\n");
     fprintf(stderr, "                    note: \"-n\" now is the total times to be sent for pkt_file\n");
-    fprintf(stderr, "    -G max_size     Maximum output file size (in MB, default=0:unlimited)\n");
+    fprintf(stderr, "    -G max_size     Maximum output file size (in MB, default=0:unlimited),\n");
+    fprintf(stderr, "                    the full file is kept as msg_file.1\n");
     fprintf(stderr, "    -j interval     Progress report interval (set 0 to disable, default=1)\n");
     fprintf(stderr, "    -J sub_string   Replace the sub_string in pkt content with <seq#> of wb\n");
     fprintf(stderr, "    -K              Keep body during save (default: save header only)\n");
+    fprintf(stderr, "    -L speed        Speed of replaying timed packets of pkt_file, e.g. 2 for\n");
+    fprintf(stderr, "                    twice as fast (default=1, 0: ignore the time to send)\n");
+    fprintf(stderr, "    -M profile      Target rate of the open loop, requests start at their intended\n");
+    fprintf(stderr, "                    time regardless of responses, e.g. 1k, 100-1k@30 (ramp in 30s),\n");
+    fprintf(stderr, "                    100@10,200@10,400 (steps), the last stage lasts to the end\n");
+    fprintf(stderr, "    -N depth        Keep connections alive, each has up to depth requests in\n");
+    fprintf(stderr, "                    flight (1: keep-alive only, max=%d), the responses are\n", PIPELINE_MAX_DEPTH);
+    fprintf(stderr, "                    told apart by Content-Length or chunks, and the requests\n");
+    fprintf(stderr, "                    without responses are sent again once the server closes\n");
     fprintf(stderr, "    -o msg_file     Save received http messages to filename\n");
     fprintf(stderr, "    -Q max_count    # of packets in packet file (default=0:all pkts in file)\n");
     fprintf(stderr, "    -U URL_prefix   Add prefix \"/URL_prefix<seq#>/\" to each request URL\n");
-    fprintf(stderr, "    -W stats_num    Window of stats, number of stats values (default=50000)\n");
+    fprintf(stderr, "    -W stats_num    Number of the last requests saved by -g (default=50000)\n");
     fprintf(stderr, "    -1              (for testing) Don't append Host:localhost if absent (\n");
     fprintf(stderr, "                    default to add)\n");
     fprintf(stderr, "    -2 option       (for testing)  Don't append Connection:close if option is 0, \n");
@@ -3322,10 +4996,19 @@ static void usage(const char *progname)
     fprintf(stderr, "                    Append or replace connection attribution to close for any packets if option is 2\n");
     fprintf(stderr, "    -3              (for testing) Use micro-second granularity in output,\n");
     fprintf(stderr, "                    default disabled\n");
+    fprintf(stderr, "    -6 stats_file   Save the latency histogram and response codes of each packet\n");
+    fprintf(stderr, "    -7              Save the messages of -o as binary records with the packet,\n");
+    fprintf(stderr, "                    connection, time and response code of each, -c isn't limited\n");
+#ifdef USE_SSL
+    fprintf(stderr, "    -8 session_file Resume TLS sessions (IDs or tickets) across connections, the\n");
+    fprintf(stderr, "                    latest session is loaded from and saved to session_file,\n");
+    fprintf(stderr, "                    use /dev/null to resume within the run only\n");
+#endif
+    fprintf(stderr, "    -9 mix_file     Pick the packets of pkt_file by the weights of groups, the\n");
+    fprintf(stderr, "                    alias table of groups is written by pywb --mix\n");
 /*
     fprintf(stderr, "    -D min_time     Lower bound of stats histogram(us) (default: 0 us)\n");
     fprintf(stderr, "    -U max_time     Upper bound of stats histogram(us) (default: 10000 us)\n");
-    fprintf(stderr, "    -N              (TBD) Number of threads\n");
     fprintf(stderr, "    -3-9            (TBD)\n");
 */
 #endif //_WAF_BENCH_ // print waf-bench new usage
@@ -3506,7 +5189,6 @@ int main(int argc, const char * const argv[])
 #endif
 
 #ifdef _WAF_BENCH_ // loop for parse args
-    g_new_header = xmalloc(g_header_len_MAX);
     g_sub_string = (char **)xcalloc(g_sub_string_num_MAX, sizeof(char *));
     if (argv[0][strlen(argv[0]) - 1] == '0')
         g_enable_ini = 1; // if progname = "wb0" then enable ini
@@ -3526,7 +5208,7 @@ PARSE_ARGS:
             "Z:f:"
 #endif
 #ifdef _WAF_BENCH_ // adding more options 0-9,aFINRDUYWEGKQ 
-            "Y:a:o:F:j:J:O:R:D:U:Y:W:E:G:Q:K012:3456789"
+            "Y:a:o:F:j:J:O:R:D:U:Y:W:E:G:Q:L:M:N:K012:3456:78:9:"
 #endif // _WAF_BENCH_, adding more options 0-9,aFINRDUYWEGKQ 
             ,&c, &opt_arg)) == APR_SUCCESS) {
         switch (c) {
@@ -3558,6 +5240,17 @@ PARSE_ARGS:
                 if (g_MAX_PKT_COUNT < 0) 
                     err("Invalid max packet count\n");
                 break;
+            case 'L': // speed of replaying timed packets
+                g_replay_speed = atof(opt_arg);
+                if (g_replay_speed < 0)
+                    err("Invalid replay speed\n");
+                break;
+            case 'D': // save the latency histograms
+                g_hist_filename = opt_arg;
+                break;
+            case 'M': // target rate of the open loop
+                parse_rate_profile(opt_arg);
+                break;
             case 'R': // RPS number for rate limiting
                 {
                 int rps_scale = 1;
@@ -3618,12 +5311,37 @@ PARSE_ARGS:
                 if (g_stats_window <= 0) 
                     err("Invalid stats size\n");
                 break;
+            case 'N': // requests in flight per persistent connection
+                g_pipeline_depth = atoi(opt_arg);
+                if (g_pipeline_depth <= 0 || g_pipeline_depth > PIPELINE_MAX_DEPTH)
+                    err("Invalid pipeline depth\n");
+                keepalive = 1;
+                g_add_connection_close = 0;
+                break;
             case '4': // keepalive_for_real_traffic
                 g_keepalive_for_real_traffic  = 1;
                 break;
             case '5': // print out additional progress info
                 g_extended_progress = 1;
                 break;
+            case '6': // save the stats of each packet
+                g_pkt_stats_filename = opt_arg;
+                break;
+            case '7': // save received messages as binary records
+                g_save_binary = 1;
+                break;
+#ifdef USE_SSL
+            case '8': // resume TLS sessions, load and save the session
+                g_tls_session_filename = opt_arg;
+                break;
+#else
+            case '8': // the TLS sessions need SSL, fail instead of the usage
+                err("-8 needs TLS, but wb isn't compiled with SSL\n");
+                break;
+#endif // USE_SSL
+            case '9': // pick the packets by the weights of the mix
+                g_mix_filename = opt_arg;
+                break;
 #endif // _WAF_BENCH_ end of new arguments processing
 
             case 'n':
@@ -3920,9 +5638,12 @@ PARSE_ARGS:
     }
     
     // open those files after parsing all arguments
-    if ((g_save_filename && open_file_for_write(g_save_filename, &g_save_file_fd) != APR_SUCCESS) // -R option 
+    if ((g_save_filename && open_save_file(g_save_filename) != APR_SUCCESS) // -o option 
         || (g_put_filename && open_postfile(g_put_filename) != APR_SUCCESS) // -u option 
         || (g_pkt_filename && open_pktfile(g_pkt_filename) != APR_SUCCESS) // -F option 
+        || (g_mix_filename && open_mix_file(g_mix_filename) != APR_SUCCESS) // -9 option
+        || (g_hist_filename && open_histfile(g_hist_filename) != APR_SUCCESS) // -D option
+        || (g_pkt_stats_filename && open_pkt_stats_file(g_pkt_stats_filename) != APR_SUCCESS) // -6 option
         || (g_post_filename && open_postfile(g_post_filename) != APR_SUCCESS)) // -p option
         exit(1);
 
@@ -3946,8 +5667,9 @@ PARSE_ARGS:
             requests = requests * g_pkt_count;
     }
 
-    // if we need save response to g_save_filename, only 1 connection can be used
-    if (g_save_filename) {
+    // if we need save response to g_save_filename, only 1 connection can be used,
+    // unless the binary records of "-7", which carry their connection
+    if (g_save_filename && !g_save_binary) {
         if (concurrency > 1) {
             fprintf(stderr, "WARNING: To save response to %s, only 1 connection can be used, so ignore -c %d!\n", 
                 g_save_filename, concurrency);
@@ -4042,6 +5764,9 @@ PARSE_ARGS:
     /* Keep memory usage as low as possible */
     SSL_CTX_set_mode (ssl_ctx, SSL_MODE_RELEASE_BUFFERS);
 #endif
+#ifdef _WAF_BENCH_ // the request of a template is flattened into a shared buffer
+    SSL_CTX_set_mode (ssl_ctx, SSL_MODE_ACCEPT_MOVING_WRITE_BUFFER);
+#endif // _WAF_BENCH_ // the request of a template is flattened into a shared buffer
     if (ssl_cipher != NULL) {
         if (!SSL_CTX_set_cipher_list(ssl_ctx, ssl_cipher)) {
             fprintf(stderr, "error setting cipher list [%s]\n", ssl_cipher);
@@ -4052,6 +5777,16 @@ PARSE_ARGS:
     if (verbosity >= 3) {
         SSL_CTX_set_info_callback(ssl_ctx, ssl_state_cb);
     }
+#ifdef _WAF_BENCH_ // "-8", resume TLS sessions
+    // the sessions aren't resumed by default, so each connection does
+    // a full handshake, with "-8" all of connections resume the latest one
+    if (g_tls_session_filename) {
+        SSL_CTX_set_session_cache_mode(ssl_ctx,
+            SSL_SESS_CACHE_CLIENT | SSL_SESS_CACHE_NO_INTERNAL_STORE);
+        SSL_CTX_sess_set_new_cb(ssl_ctx, tls_session_new);
+        tls_session_load(g_tls_session_filename);
+    }
+#endif // _WAF_BENCH_ // "-8", resume TLS sessions
 #endif
 #ifdef SIGPIPE
     apr_signal(SIGPIPE, SIG_IGN);       /* Ignore writes to connections that
@@ -4064,10 +5799,11 @@ PARSE_ARGS:
     test();
 #ifdef _WAF_BENCH_ // close the file handles if they're still opened
     // close file for storing received http messages
-    if (g_save_file_fd) {
-        save_logfile(NULL, 0);
-        apr_file_close(g_save_file_fd);
-    }
+    close_save_file();
+#ifdef USE_SSL
+    if (g_tls_session_filename)
+        tls_session_save(g_tls_session_filename);
+#endif // USE_SSL
 #endif //_WAF_BENCH_ , close the file handles if they're still opened
 
     apr_pool_destroy(cntxt);